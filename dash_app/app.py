@@ -1,4 +1,5 @@
-import sqlite3
+import sys
+import time
 
 import dash
 import dash_bootstrap_components as dbc
@@ -6,18 +7,46 @@ import dash_core_components as dcc
 import dash_html_components as html
 import numpy as np
 import pandas as pd
-from dash.dependencies import Input, Output
-from components import card, tweet
+from dash.dependencies import ALL, Input, Output, State
+from dash.exceptions import PreventUpdate
+from cache import QueryCache
+from components import card, cards_values, trend_figure, tweets_list
+from queries import (
+    TIME_RANGES,
+    TREND_POINTS,
+    TREND_RANGES,
+    data_version,
+    latest_tweets_query,
+    query_params,
+    summary_query,
+    trend_query,
+)
 from utils import human_format, get_color_from_score
 from pathlib import Path
 import logging
 
 
 UPDATE_INTERVAL = 30
+# Time windows move even if no tweets are inserted, so idle dashboards are
+# refreshed every WINDOW_REFRESH seconds
+WINDOW_REFRESH = 300
 ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR / "utils"))
+from database import Database  # noqa: E402
+from partitions import (  # noqa: E402
+    DAY_SECONDS,
+    list_partitions,
+    partition_day,
+    partition_name,
+)
+from series import series_step  # noqa: E402
+
 DATA_DIR = ROOT_DIR / "data"
 DATABASE_PATH = DATA_DIR / "tweets.db"
+DB = Database(DATABASE_PATH, read_only=True)
+QUERY_CACHE = QueryCache(Database(DATA_DIR / "dash_cache.db"), max_age=UPDATE_INTERVAL)
 TARGETS_DF = pd.read_csv(DATA_DIR / "accounts.csv")
+TARGET_IMAGES = dict(zip(TARGETS_DF.id, TARGETS_DF.image))
 LOGS_PATH = Path(__file__).parent / "logs" / "dash_app.log"
 
 external_stylesheets = [
@@ -37,6 +66,33 @@ app = dash.Dash(
 )
 server = app.server
 
+
+def read_dashboard_query(name, query, time_range, filter_rt):
+    """Runs a dashboard query, reusing results of other sessions and workers"""
+    conn = DB.connection()
+    return QUERY_CACHE.get_or_compute(
+        (name, time_range, filter_rt),
+        data_version(conn),
+        lambda: pd.read_sql_query(query, conn, params=query_params(time_range)),
+    )
+
+
+def dashboard_version(now=None):
+    """Returns the data version and the current WINDOW_REFRESH period
+
+    Dashboards only refresh when this changes, i.e., when the fetcher or the
+    scorer write tweets, or after WINDOW_REFRESH seconds without writes.
+    """
+    now = time.time() if now is None else now
+    return [data_version(DB.connection()), int(now // WINDOW_REFRESH)]
+
+
+def window_partitions(conn, time_range):
+    """Tables of the daily partitions of tweets in the last time_range minutes"""
+    first_day = partition_day(query_params(time_range)["since"])
+    return [partition_name(day) for day in list_partitions(conn) if day >= first_day]
+
+
 app.title = "Tweets Scorer: Analyze sentiment of tweets in real-time"
 app.layout = html.Div(
     [
@@ -121,6 +177,10 @@ app.layout = html.Div(
                                     className="title-summary text-center text-sm-left mt-1",
                                 ),
                                 html.Div(
+                                    [
+                                        card(target)
+                                        for target in TARGETS_DF.itertuples()
+                                    ],
                                     id="summary-cards",
                                     className="d-flex flex-wrap flex-column flex-sm-row "
                                     "justify-content-sm-center justify-content-md-end",
@@ -141,11 +201,37 @@ app.layout = html.Div(
                     className="""d-flex flex-column align-items-center align-items-md-start
                                  flex-md-row justify-content-sm-around mt-4""",
                 ),
+                dbc.Card(
+                    [
+                        html.Div(
+                            [
+                                html.P("Trend", className="title-summary"),
+                                dcc.Dropdown(
+                                    id="trend-dropdown",
+                                    options=[
+                                        {"label": "Last 7 days", "value": 7},
+                                        {"label": "Last 30 days", "value": 30},
+                                        {"label": "Last year", "value": 365},
+                                    ],
+                                    value=7,
+                                    clearable=False,
+                                    searchable=False,
+                                    style={"width": "10rem"},
+                                ),
+                            ],
+                            className="d-flex justify-content-between card-chart-top",
+                        ),
+                        dcc.Graph(id="trend-chart", config={"displayModeBar": False}),
+                    ],
+                    className="card-chart mt-4",
+                ),
                 dcc.Interval(
                     id="overview-interval",
                     interval=UPDATE_INTERVAL * 1000,  # in milliseconds
                     n_intervals=0,
                 ),
+                dcc.Store(id="visible-interval"),
+                dcc.Store(id="data-version"),
             ],
             id="cards-container",
         ),
@@ -153,85 +239,86 @@ app.layout = html.Div(
 )
 
 
+# Hidden tabs skip the version check, so they make no requests at all
+app.clientside_callback(
+    """
+    function(n) {
+        return document.hidden ? window.dash_clientside.no_update : n;
+    }
+    """,
+    Output("visible-interval", "data"),
+    [Input("overview-interval", "n_intervals")],
+)
+
+
+@app.callback(
+    Output("data-version", "data"),
+    [Input("visible-interval", "data")],
+    [State("data-version", "data")],
+)
+def check_data_version(n, current_version):
+    version = dashboard_version()
+    if version == current_version:
+        raise PreventUpdate
+    return version
+
+
 @app.callback(
     Output("summary-tweets", "children"),
     [
-        Input("overview-interval", "n_intervals"),
+        Input("data-version", "data"),
         Input("total-dropdown", "value"),
         Input("exclude-rt-checkbox", "value"),
     ],
+    prevent_initial_call=True,
 )
-def update_tweets(n, time_range, exclude_rt):
-    conn = sqlite3.connect(DATABASE_PATH)
-    time_range = 15 if time_range not in (15, 60, 1440) else time_range
+def update_tweets(version, time_range, exclude_rt):
+    time_range = 15 if time_range not in TIME_RANGES else time_range
     filter_rt = True if exclude_rt == [1] else False
-    query = f"""
-    select
-        target as target,
-        tweet_timestamp as tweet_timestamp,
-        full_text as full_text,
-        sentiment as score
-    from tweets
-    where
-        datetime(tweet_timestamp) >= datetime('now', '-{time_range} minutes')
-        {"and IS_RT = 0" if filter_rt else ""}
-    order by datetime(tweet_timestamp) desc
-    limit 5;
-    """
-    df = pd.read_sql_query(query, conn)
-    df["tweet_timestamp"] = pd.to_datetime(df.tweet_timestamp.values)
-    tweets = []
-    for _, row in df.iterrows():
-        time = row["tweet_timestamp"].strftime("%T - %b %-d, %Y")
-        img = TARGETS_DF.loc[TARGETS_DF.id == row["target"]]["image"].item()
-        if row["score"] < 0.5:
-            color = "hsl(360, 67%, 44%)"
-            sentiment = "NEGATIVE"
-        else:
-            color = "hsl(184, 77%, 34%)"
-            sentiment = "POSITIVE"
-        tweets.append(tweet(time, img, row["full_text"], sentiment, color))
+    tables = window_partitions(DB.connection(), time_range)
+    df = read_dashboard_query(
+        "tweets", latest_tweets_query(filter_rt, tables), time_range, filter_rt
+    )
+    tweets = tweets_list(df, TARGET_IMAGES)
     return html.Div(tweets)
 
 
 @app.callback(
     [
-        Output("summary-cards", "children"),
+        Output({"type": "card", "index": ALL}, "className"),
+        Output({"type": "card-responses", "index": ALL}, "children"),
+        Output({"type": "card-kpi", "index": ALL}, "children"),
+        Output({"type": "card-kpi", "index": ALL}, "style"),
         Output("total-responses", "children"),
         Output("total-approval", "children"),
         Output("total-approval", "style"),
     ],
     [
-        Input("overview-interval", "n_intervals"),
+        Input("data-version", "data"),
         Input("total-dropdown", "value"),
         Input("exclude-rt-checkbox", "value"),
     ],
+    [
+        State({"type": "card", "index": ALL}, "className"),
+        State({"type": "card-responses", "index": ALL}, "children"),
+        State({"type": "card-kpi", "index": ALL}, "children"),
+        State({"type": "card-kpi", "index": ALL}, "style"),
+    ],
+    prevent_initial_call=True,
 )
-def update_cards(n, time_range, exclude_rt):
-    conn = sqlite3.connect(DATABASE_PATH)
-    time_range = 15 if time_range not in (15, 60, 1440) else time_range
+def update_cards(version, time_range, exclude_rt, *shown):
+    time_range = 15 if time_range not in TIME_RANGES else time_range
     filter_rt = True if exclude_rt == [1] else False
-    query = f"""
-    select
-        target as target,
-        count(*) as responses,
-        avg(case when sentiment < 0.5 then 0 else 1 end) * 100 as sentiment
-    from tweets
-    where
-        datetime(tweet_timestamp) >= datetime('now', '-{time_range} minutes')
-        {"and IS_RT = 0" if filter_rt else ""}
-        group by target;
-    """
-    df = pd.read_sql_query(query, conn)
-    cards = []
-    for target in TARGETS_DF.itertuples():
-        try:
-            responses = df.loc[df.target == target.id, "responses"].item()
-            sentiment_score = df.loc[df.target == target.id, "sentiment"].item()
-            cards.append(card(target, responses, sentiment_score))
-        except Exception as e:
-            logging.debug(e)
-            pass
+    df = read_dashboard_query("cards", summary_query(filter_rt), time_range, filter_rt)
+    df = df.astype({"sentiment": float})
+    targets = [
+        output["id"]["index"] for output in dash.callback_context.outputs_list[0]
+    ]
+    # Only the values that differ from the ones shown are sent to the browser
+    cards = [
+        [value if value != old else dash.no_update for value, old in zip(new, current)]
+        for new, current in zip(cards_values(df.set_index("target"), targets), shown)
+    ]
     total_responses_num = df.responses.sum()
     total_responses = human_format(total_responses_num)
     total_approval_num = 0
@@ -242,7 +329,26 @@ def update_cards(n, time_range, exclude_rt):
         pass
     total_approval = f"{total_approval_num:.0f}%"
     approval_style = {"color": get_color_from_score(total_approval_num)}
-    return cards, total_responses, total_approval, approval_style
+    return (*cards, total_responses, total_approval, approval_style)
+
+
+@app.callback(
+    Output("trend-chart", "figure"),
+    [
+        Input("data-version", "data"),
+        Input("trend-dropdown", "value"),
+        Input("exclude-rt-checkbox", "value"),
+    ],
+    prevent_initial_call=True,
+)
+def update_trend(version, trend_range, exclude_rt):
+    trend_range = 7 if trend_range not in TREND_RANGES else trend_range
+    filter_rt = True if exclude_rt == [1] else False
+    table, step = series_step(trend_range * DAY_SECONDS, TREND_POINTS)
+    df = read_dashboard_query(
+        "trend", trend_query(filter_rt, table, step), trend_range * 1440, filter_rt
+    )
+    return trend_figure(df, TARGETS_DF)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from components import cards_values, tweet, tweets_list
+from utils import get_color_from_score, human_format
+
+
+def update_cards_legacy(df, targets_df):
+    """Previous card values of update_cards, two boolean scans per target"""
+    values = []
+    for target in targets_df.itertuples():
+        try:
+            responses = df.loc[df.target == target.id, "responses"].item()
+            score = df.loc[df.target == target.id, "sentiment"].item()
+            values.append(
+                (
+                    "card-overview",
+                    human_format(responses),
+                    "-" if np.isnan(score) else f"{score:.0f}%",
+                    {"color": get_color_from_score(score)},
+                )
+            )
+        except Exception:
+            values.append(("card-overview d-none", "0", "-", {}))
+    return [list(column) for column in zip(*values)]
+
+
+def update_tweets_legacy(df, targets_df):
+    """Previous tweet rendering of update_tweets, one target scan per row"""
+    df["tweet_timestamp"] = pd.to_datetime(df.tweet_timestamp.values)
+    tweets = []
+    for _, row in df.iterrows():
+        time = row["tweet_timestamp"].strftime("%T - %b %-d, %Y")
+        img = targets_df.loc[targets_df.id == row["target"]]["image"].item()
+        if row["score"] < 0.5:
+            color = "hsl(360, 67%, 44%)"
+            sentiment = "NEGATIVE"
+        else:
+            color = "hsl(184, 77%, 34%)"
+            sentiment = "POSITIVE"
+        tweets.append(tweet(time, img, row["full_text"], sentiment, color))
+    return tweets
+
+
+def sample_data(n_targets, n_tweets, seed=42):
+    """Generates targets, the summary query of most of them and latest tweets"""
+    rng = np.random.default_rng(seed)
+    ids = [f"target_{i}" for i in range(n_targets)]
+    targets_df = pd.DataFrame({"id": ids, "image": [f"{target}.jpg" for target in ids]})
+    # Some targets have no interactions in the window, others none scored yet
+    with_data = rng.random(n_targets) < 0.9
+    summary = pd.DataFrame(
+        {
+            "target": np.array(ids)[with_data],
+            "responses": rng.integers(1, 50000, with_data.sum()),
+            "sentiment": rng.uniform(0, 100, with_data.sum()),
+        }
+    )
+    summary.loc[summary.index % 20 == 0, "sentiment"] = np.nan
+    tweets = pd.DataFrame(
+        {
+            "target": rng.choice(ids, n_tweets),
+            "tweet_timestamp": pd.date_range(
+                "2020-07-19", periods=n_tweets, freq="s"
+            ).astype(str),
+            "full_text": [f"tweet {i}" for i in range(n_tweets)],
+            "score": rng.random(n_tweets),
+        }
+    )
+    return targets_df, summary, tweets
+
+
+def timeit(function, repeat):
+    """Returns the median seconds of repeat calls of function"""
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start_time)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard rendering")
+    parser.add_argument("--targets", type=int, default=200)
+    parser.add_argument("--tweets", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    targets_df, summary, tweets = sample_data(args.targets, args.tweets)
+    images = dict(zip(targets_df.id, targets_df.image))
+    targets = list(targets_df.id)
+
+    expected = update_cards_legacy(summary, targets_df)
+    output = [
+        list(column) for column in cards_values(summary.set_index("target"), targets)
+    ]
+    mismatches = sum(
+        a != b for old, new in zip(expected, output) for a, b in zip(old, new)
+    )
+    results = {
+        "update_cards": (
+            timeit(lambda: update_cards_legacy(summary, targets_df), args.repeat),
+            timeit(
+                lambda: cards_values(summary.set_index("target"), targets), args.repeat
+            ),
+        ),
+        "update_tweets": (
+            timeit(
+                lambda: update_tweets_legacy(tweets.copy(), targets_df), args.repeat
+            ),
+            timeit(lambda: tweets_list(tweets, images), args.repeat),
+        ),
+    }
+    print(
+        f"{args.targets} targets, {args.tweets} tweets, card mismatches: {mismatches}"
+    )
+    for name, (legacy_time, vectorized_time) in results.items():
+        print(
+            f"{name}: legacy {legacy_time * 1000:.2f}ms, "
+            f"vectorized {vectorized_time * 1000:.2f}ms, "
+            f"speedup {legacy_time / vectorized_time:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import pickle
+import time
+
+
+class QueryCache:
+    """Results of dashboard queries shared by every gunicorn worker
+
+    Results are stored in an SQLite database together with the data version they
+    were computed for. They are reused until the fetcher bumps the version or
+    they are older than max_age seconds (time windows keep moving even if no
+    tweets are inserted).
+    """
+
+    def __init__(self, db, max_age):
+        self.db = db
+        self.max_age = max_age
+        conn = self.db.connection()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS QUERY_CACHE (
+                KEY TEXT PRIMARY KEY,
+                VERSION INTEGER NOT NULL,
+                CREATED REAL NOT NULL,
+                VALUE BLOB NOT NULL
+            )
+            """
+        )
+        conn.commit()
+
+    def get_or_compute(self, key, version, compute):
+        """Returns the cached result of key or computes and stores it
+
+        Args:
+            key: Identifier of the query and its inputs
+            version: Current data version
+            compute: Function that runs the query
+
+        Returns:
+            Result of the query
+        """
+        key = repr(key)
+        now = time.time()
+        conn = self.db.connection()
+        row = conn.execute(
+            "SELECT VALUE FROM QUERY_CACHE WHERE KEY = ? AND VERSION = ? "
+            "AND CREATED >= ?",
+            (key, version, now - self.max_age),
+        ).fetchone()
+        if row is not None:
+            return pickle.loads(row[0])
+        value = compute()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO QUERY_CACHE VALUES (?, ?, ?, ?)",
+                (key, version, now, pickle.dumps(value)),
+            )
+        return value
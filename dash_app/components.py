@@ -1,11 +1,15 @@
 import dash_bootstrap_components as dbc
 import dash_html_components as html
-from utils import human_format, get_color_from_score
+import numpy as np
+import pandas as pd
+from utils import human_format, get_colors_from_scores
 
 
-def card(target, responses, score):
-    """Summary card component"""
-    kpi_color = get_color_from_score(score)
+def card(target):
+    """Summary card component, its values are filled in by update_cards
+
+    Cards are hidden until their target has interactions in the time window.
+    """
     return dbc.Card(
         [
             dbc.CardBody(
@@ -18,7 +22,11 @@ def card(target, responses, score):
                             html.Div(
                                 [
                                     html.P(
-                                        f"{human_format(responses)}",
+                                        "0",
+                                        id={
+                                            "type": "card-responses",
+                                            "index": target.id,
+                                        },
                                         className="card-text",
                                     ),
                                     html.P("INTERACTIONS", className="card-subtitle",),
@@ -28,9 +36,10 @@ def card(target, responses, score):
                             html.Div(
                                 [
                                     html.P(
-                                        f"{score:.0f}%",
+                                        "-",
+                                        id={"type": "card-kpi", "index": target.id},
                                         className="card-kpi",
-                                        style={"color": kpi_color},
+                                        style={},
                                     ),
                                     html.P("APPROVAL RATE", className="card-subtitle",),
                                 ],
@@ -43,13 +52,61 @@ def card(target, responses, score):
                 className="text-center",
             )
         ],
+        id={"type": "card", "index": target.id},
         style={
             "background": f"linear-gradient(to bottom, {target.color} 25%, hsl(0, 0%, 100%) 0%)"
         },
-        className="card-overview",
+        className="card-overview d-none",
+    )
+
+
+def cards_values(df, targets):
+    """Class names, interactions, approvals and approval styles of summary cards
+
+    The summary is aligned to the targets with a single reindex, so the values
+    of every card are computed column by column instead of target by target.
+
+    Args:
+        df: Dataframe of the summary query, indexed by target
+        targets: Ids of the targets of the cards
+
+    Returns:
+        Four lists with a value per target, empty values if it has no
+        interactions
+    """
+    df = df.reindex(targets)
+    shown = df.responses.notna().to_numpy()
+    colors = get_colors_from_scores(df.sentiment)
+    return (
+        np.where(shown, "card-overview", "card-overview d-none").tolist(),
+        df.responses.map(human_format, na_action="ignore").fillna("0").tolist(),
+        df.sentiment.map("{:.0f}%".format, na_action="ignore").fillna("-").tolist(),
+        [
+            {"color": color} if is_shown else {}
+            for color, is_shown in zip(colors, shown)
+        ],
     )
 
 
+def tweets_list(df, images):
+    """Tweet components of the latest tweets
+
+    Args:
+        df: Dataframe of the latest tweets query
+        images: Dictionary of target to its image
+    """
+    times = pd.to_datetime(df.tweet_timestamp.values).strftime("%T - %b %-d, %Y")
+    negative = (df.score < 0.5).to_numpy()
+    sentiments = np.where(negative, "NEGATIVE", "POSITIVE")
+    colors = np.where(negative, "hsl(360, 67%, 44%)", "hsl(184, 77%, 34%)")
+    return [
+        tweet(*values)
+        for values in zip(
+            times, df.target.map(images), df.full_text, sentiments, colors
+        )
+    ]
+
+
 def tweet(time, image, text, sentiment, color):
     """Tweet component"""
     return dbc.Card(
@@ -76,3 +133,38 @@ def tweet(time, image, text, sentiment, color):
         ],
         className="tweet-card",
     )
+
+
+def trend_figure(df, targets):
+    """Trend chart figure with a line of approval over time per target
+
+    Args:
+        df: Dataframe with bucket_ts (epoch seconds), target and sentiment
+        targets: Dataframe of targets with id, name and color columns
+    """
+    series = dict(tuple(df.groupby("target")))
+    lines = []
+    for target in targets.itertuples():
+        rows = series.get(target.id)
+        if rows is None:
+            continue
+        lines.append(
+            {
+                "x": (rows.bucket_ts * 1000).tolist(),
+                "y": rows.sentiment.round(1).tolist(),
+                "name": target.name,
+                "mode": "lines",
+                "line": {"color": target.color},
+                "connectgaps": False,
+            }
+        )
+    return {
+        "data": lines,
+        "layout": {
+            "xaxis": {"type": "date"},
+            "yaxis": {"range": [0, 100], "ticksuffix": "%"},
+            "margin": {"l": 40, "r": 16, "t": 16, "b": 32},
+            "legend": {"orientation": "h"},
+            "hovermode": "x",
+        },
+    }
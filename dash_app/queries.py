@@ -0,0 +1,106 @@
+import time
+
+TIME_RANGES = (15, 60, 1440)
+# Days of the trend chart, each drawn with at most TREND_POINTS buckets
+TREND_RANGES = (7, 30, 365)
+TREND_POINTS = 84
+
+
+def latest_tweets_query(exclude_rt, tables):
+    """Query for the latest scored tweets of the daily partitions of a window
+
+    Each partition is read newest first with a range scan on TWEET_TS that
+    stops after 5 rows, so at most 5 rows per partition are sorted.
+
+    Args:
+        exclude_rt: Whether retweets are left out
+        tables: Partitions that overlap the time window
+    """
+    if not tables:
+        return """
+    select null as target, null as tweet_timestamp, null as full_text, null as score
+    where 0;
+    """
+    partitions = "\n        union all\n".join(
+        f"""
+        select * from (
+            select target, tweet_timestamp, full_text, sentiment, tweet_ts
+            from {table} indexed by idx_{table}_ts
+            where
+                tweet_ts >= :since
+                and sentiment is not null
+                {"and is_rt = 0" if exclude_rt else ""}
+            order by tweet_ts desc
+            limit 5
+        )"""
+        for table in tables
+    )
+    return f"""
+    select
+        target as target,
+        tweet_timestamp as tweet_timestamp,
+        full_text as full_text,
+        sentiment as score
+    from ({partitions}
+    )
+    order by tweet_ts desc
+    limit 5;
+    """
+
+
+def summary_query(exclude_rt):
+    """Query for interactions and approval per target, summing per-minute rollups
+
+    The window starts at the beginning of the minute of :since, so it can
+    include up to 59 extra seconds. Approval only counts the tweets already
+    scored, and it is NULL if none is.
+    """
+    return f"""
+    select
+        target as target,
+        sum(responses) as responses,
+        sum(positive) * 100.0 / nullif(sum(scored), 0) as sentiment
+    from tweets_rollup
+    where
+        minute_ts >= :since / 60 * 60
+        {"and is_rt = 0" if exclude_rt else ""}
+    group by target;
+    """
+
+
+def trend_query(exclude_rt, table, step):
+    """Query for approval per target in buckets of step seconds of a series
+
+    Reads the hourly or daily aggregates, so the rows read and returned depend
+    on the number of buckets and not on the tweets in the window. The window
+    starts at the beginning of the bucket of :since.
+
+    Args:
+        exclude_rt: Whether retweets are left out
+        table: Aggregate series, e.g., TWEETS_HOURLY
+        step: Seconds per bucket, a multiple of the series' bucket seconds
+    """
+    return f"""
+    select
+        bucket_ts / {step} * {step} as bucket_ts,
+        target as target,
+        sum(responses) as responses,
+        sum(positive) * 100.0 / nullif(sum(scored), 0) as sentiment
+    from {table}
+    where
+        bucket_ts >= :since / {step} * {step}
+        {"and is_rt = 0" if exclude_rt else ""}
+    group by 1, 2
+    order by 1;
+    """
+
+
+def data_version(conn):
+    """Returns the counter the fetcher bumps every time it inserts tweets"""
+    return conn.execute("SELECT VERSION FROM DATA_VERSION").fetchone()[0]
+
+
+def query_params(time_range, now=None):
+    """Parameters of the dashboard queries for the last time_range minutes"""
+    now = time.time() if now is None else now
+    return {"since": int(now) - time_range * 60}
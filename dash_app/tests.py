@@ -0,0 +1,229 @@
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from dash.exceptions import PreventUpdate
+
+from cache import QueryCache
+from components import cards_values, trend_figure, tweets_list
+from queries import latest_tweets_query, query_params, summary_query, trend_query
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR / "utils"))
+
+import create_database  # noqa: E402
+from database import Database  # noqa: E402
+import migrate_database  # noqa: E402
+from partitions import add_partitions  # noqa: E402
+from series import series_step  # noqa: E402
+
+
+def query_plan(conn, query, params):
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+    return " | ".join(row[-1] for row in rows)
+
+
+def test_dashboard_queries_use_range_scans(tmp_path):
+    """Check if the dashboard queries are range scans on the time columns"""
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        add_partitions(conn, [18461, 18462])
+    tables = ["TWEETS_20200719", "TWEETS_20200718"]
+    params = query_params(15)
+    for exclude_rt in (True, False):
+        plan = query_plan(conn, summary_query(exclude_rt), params)
+        assert "SEARCH tweets_rollup USING PRIMARY KEY (MINUTE_TS>?)" in plan
+
+        plan = query_plan(conn, latest_tweets_query(exclude_rt, tables), params)
+        for table in tables:
+            assert f"USING INDEX IDX_{table}_TS (TWEET_TS>?)" in plan
+        assert (
+            conn.execute(latest_tweets_query(exclude_rt, []), params).fetchall() == []
+        )
+
+
+def test_trend_is_downsampled_from_aggregate_series(tmp_path):
+    """Check if the trend reads a series with a range scan in fixed-size buckets"""
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    conn = sqlite3.connect(db_path)
+    now = 1595160000
+    with conn:
+        conn.executemany(
+            "INSERT INTO TWEETS_ROLLUP VALUES (?, ?, 0, 1, ?, 1)",
+            [
+                (now - hours * 3600, target, hours % 2)
+                for hours in range(7 * 24)
+                for target in ("pablo_casado", "pedro_sanchez")
+            ],
+        )
+    table, step = series_step(7 * 86400, 84)
+    params = query_params(7 * 1440, now=now)
+    for exclude_rt in (True, False):
+        plan = query_plan(conn, trend_query(exclude_rt, table, step), params)
+        assert "SEARCH TWEETS_HOURLY USING PRIMARY KEY (BUCKET_TS>?)" in plan
+
+    df = pd.read_sql_query(trend_query(False, table, step), conn, params=params)
+    assert len(df) <= 2 * 85
+    assert set(df.bucket_ts % step) == {0}
+    assert df.sentiment.iloc[2:-2].eq(50.0).all()
+    targets = pd.DataFrame(
+        {"id": ["pablo_casado"], "name": ["Pablo Casado"], "color": ["#53B3E3"]}
+    )
+    figure = trend_figure(df, targets)
+    assert [line["name"] for line in figure["data"]] == ["Pablo Casado"]
+    assert len(figure["data"][0]["x"]) == len(df) // 2
+
+
+def test_migrate_database_adds_epoch_timestamps(tmp_path):
+    """Check if existing databases get TWEET_TS and the new indexes"""
+    db_path = tmp_path / "tweets.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        """
+        CREATE TABLE TWEETS (
+            ID INTEGER PRIMARY KEY,
+            TWEET_ID INTEGER NOT NULL,
+            TARGET TEXT NOT NULL,
+            INSERT_TIMESTAMP TEXT NOT NULL,
+            TWEET_TIMESTAMP TEXT NOT NULL,
+            IS_RT INTEGER NOT NULL,
+            SENTIMENT REAL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IDX_TWEETS ON TWEETS(TWEET_TIMESTAMP, TARGET, IS_RT)")
+    conn.execute(
+        "INSERT INTO TWEETS (TWEET_ID, TARGET, INSERT_TIMESTAMP, TWEET_TIMESTAMP, "
+        "IS_RT, SENTIMENT) VALUES (1, 'pablo_casado', '', '2020-07-19 12:00:00', 0, 0.8)"
+    )
+    conn.commit()
+    conn.close()
+
+    migrate_database.main(db_path)
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT TWEET_TS FROM TWEETS").fetchone()[0] == 1595160000
+    indexes = {row[1] for row in conn.execute("PRAGMA index_list(TWEETS_20200719)")}
+    assert {"IDX_TWEETS_20200719_TS", "IDX_TWEETS_20200719_TARGET"} <= indexes
+    assert conn.execute("SELECT * FROM TWEETS_ROLLUP").fetchall() == [
+        (1595160000, "pablo_casado", 0, 1, 1, 1)
+    ]
+    assert conn.execute("SELECT VERSION FROM DATA_VERSION").fetchone()[0] == 0
+
+
+def test_query_cache_is_invalidated_by_data_version(tmp_path):
+    """Check if cached results are reused until the data version changes"""
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    cache = QueryCache(Database(tmp_path / "cache.db"), max_age=60)
+    other_worker = QueryCache(Database(tmp_path / "cache.db"), max_age=60)
+    assert cache.get_or_compute(("cards", 15, False), 1, compute) == 1
+    assert other_worker.get_or_compute(("cards", 15, False), 1, compute) == 1
+    assert cache.get_or_compute(("cards", 60, False), 1, compute) == 2
+    assert cache.get_or_compute(("cards", 15, False), 2, compute) == 3
+
+    expired = QueryCache(Database(tmp_path / "cache.db"), max_age=0)
+    assert expired.get_or_compute(("cards", 15, False), 2, compute) == 4
+
+
+def test_update_cards_only_sends_changed_values(tmp_path, monkeypatch):
+    """Check if idle dashboards skip refreshes and only changed cards are sent"""
+    import app
+
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute(
+            "INSERT INTO TWEETS_ROLLUP VALUES (?, 'pablo_casado', 0, 4, 3, 4)",
+            (int(time.time()) // 60 * 60,),
+        )
+    monkeypatch.setattr(app, "DB", Database(db_path, read_only=True))
+    monkeypatch.setattr(app, "QUERY_CACHE", QueryCache(Database(tmp_path / "c.db"), 0))
+    version = app.dashboard_version()
+    assert version == [0, int(time.time() // app.WINDOW_REFRESH)]
+    with pytest.raises(PreventUpdate):
+        app.check_data_version.__wrapped__(1, version)
+
+    targets = list(app.TARGETS_DF.id)
+    shown = [
+        ["card-overview d-none"] * len(targets),
+        ["0"] * len(targets),
+        ["-"] * len(targets),
+        [{}] * len(targets),
+    ]
+    properties = ["className", "children", "children", "style"]
+    types = ["card", "card-responses", "card-kpi", "card-kpi"]
+    outputs = [
+        [{"id": {"type": t, "index": target}, "property": p} for target in targets]
+        for t, p in zip(types, properties)
+    ]
+    output = next(key for key in app.app.callback_map if "card-responses" in key)
+    response = app.server.test_client().post(
+        "/_dash-update-component",
+        json={
+            "output": output,
+            "outputs": outputs
+            + [
+                {"id": "total-responses", "property": "children"},
+                {"id": "total-approval", "property": "children"},
+                {"id": "total-approval", "property": "style"},
+            ],
+            "inputs": [
+                {"id": "data-version", "property": "data", "value": version},
+                {"id": "total-dropdown", "property": "value", "value": 15},
+                {"id": "exclude-rt-checkbox", "property": "value", "value": []},
+            ],
+            "state": [
+                [dict(output, value=value) for output, value in zip(group, values)]
+                for group, values in zip(outputs, shown)
+            ],
+            "changedPropIds": ["data-version.data"],
+        },
+    )
+    updated = response.get_json()["response"]
+    card_ids = [key for key in updated if key.startswith("{")]
+    assert all("pablo_casado" in key for key in card_ids)
+    assert updated['{"index":"pablo_casado","type":"card-kpi"}'] == {
+        "children": "75%",
+        "style": {"color": "hsl(185, 57%, 50%)"},
+    }
+    assert updated["total-responses"] == {"children": "4"}
+
+
+def test_cards_and_tweets_are_rendered_from_lookups():
+    """Check if card values and tweets handle missing targets and unscored tweets"""
+    summary = pd.DataFrame(
+        {"responses": [1200, 3], "sentiment": [75.0, float("nan")]},
+        index=pd.Index(["pablo_casado", "pedro_sanchez"], name="target"),
+    )
+    assert cards_values(summary, ["pedro_sanchez", "other", "pablo_casado"]) == (
+        ["card-overview", "card-overview d-none", "card-overview"],
+        ["3", "0", "1.2K"],
+        ["-", "-", "75%"],
+        [{"color": "hsl(184, 77%, 34%)"}, {}, {"color": "hsl(185, 57%, 50%)"}],
+    )
+
+    tweets = pd.DataFrame(
+        {
+            "target": ["pedro_sanchez", "pablo_casado"],
+            "tweet_timestamp": ["2020-07-19 12:00:00", "2020-07-19 11:59:00"],
+            "full_text": ["Bien", "Mal"],
+            "score": [0.9, 0.1],
+        }
+    )
+    images = {"pablo_casado": "pablo.jpg", "pedro_sanchez": "pedro.jpg"}
+    rendered = [str(component) for component in tweets_list(tweets, images)]
+    assert "12:00:00 - Jul 19, 2020" in rendered[0]
+    assert "pedro.jpg" in rendered[0] and "POSITIVE" in rendered[0]
+    assert "pablo.jpg" in rendered[1] and "NEGATIVE" in rendered[1]
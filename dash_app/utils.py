@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def human_format(num):
     """Returns a formated number depending on digits (e.g., 30K instead of 30,000)"""
     num = float("{:.2g}".format(num))
@@ -21,3 +24,13 @@ def get_color_from_score(score):
     elif score < 80:
         color = "hsl(185, 57%, 50%)"
     return color
+
+
+def get_colors_from_scores(scores):
+    """Returns the colors of an array of scores, as get_color_from_score does"""
+    scores = np.asarray(scores, dtype=float)
+    return np.select(
+        [scores < 20, scores < 50, scores < 80],
+        ["hsl(360, 67%, 44%)", "hsl(360, 71%, 66%)", "hsl(185, 57%, 50%)"],
+        default="hsl(184, 77%, 34%)",
+    )
@@ -0,0 +1,78 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import emoji
+from fetch_tweets import EMOJI_TO_ORIG_LANG, process_text
+
+SAMPLE_WORDS = (
+    "el gobierno presidente españa votos partido congreso ley gracias nunca "
+    "vergüenza mentira apoyo todos gente país pandemia medidas #hashtag ¡¿?! ..."
+).split()
+SAMPLE_EMOJIS = ["🥑", "🙄", "😂", "👏", "🤮", "❤️", "🇪🇸", "🔥", "#️⃣", "👍🏽"]
+
+
+def process_text_legacy(column):
+    """Previous implementation of process_text, one pandas pass per step"""
+    column = column.str.replace(
+        r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+",
+        "",
+        regex=True,
+    )
+    column = column.map(emoji.demojize)
+    column = column.replace(EMOJI_TO_ORIG_LANG, regex=True)
+    column = column.str.replace("^RT", "", regex=True)
+    column = column.str.replace(r"(?<=@)\w+", "", regex=True)
+    column = column.str.replace(
+        r"[.,\/#@!¡\?¿$%\^&\*;:{}=\-_`~()”“\"]", " ", regex=True
+    )
+    column = column.str.replace(r"\s+", " ", regex=True)
+    column = column.str.lower()
+    column = column.str.strip()
+    return column
+
+
+def sample_tweets(n_tweets, seed=42):
+    """Generates tweets with mentions, URLs, emojis and punctuation"""
+    rng = np.random.default_rng(seed)
+    tweets = []
+    for _ in range(n_tweets):
+        words = list(rng.choice(SAMPLE_WORDS, size=rng.integers(3, 40)))
+        for _ in range(rng.integers(0, 4)):
+            words.insert(rng.integers(0, len(words)), rng.choice(SAMPLE_EMOJIS))
+        if rng.random() < 0.3:
+            words.insert(0, f"@user{rng.integers(1000)}")
+        if rng.random() < 0.2:
+            words.append(f"https://t.co/{rng.integers(10**8)}")
+        if rng.random() < 0.2:
+            words.insert(0, "RT @pablocasado_:")
+        tweets.append(" ".join(words))
+    return pd.Series(tweets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tweet processing")
+    parser.add_argument("--tweets", type=int, default=10000)
+    args = parser.parse_args()
+
+    tweets = sample_tweets(args.tweets)
+    start_time = time.perf_counter()
+    expected = process_text_legacy(tweets)
+    legacy_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    output = process_text(tweets)
+    compiled_time = time.perf_counter() - start_time
+
+    mismatches = int((expected != output).sum())
+    print(f"Legacy:   {legacy_time:.2f}s ({len(tweets) / legacy_time:.0f} tweets/s)")
+    print(
+        f"Compiled: {compiled_time:.2f}s ({len(tweets) / compiled_time:.0f} tweets/s)"
+    )
+    print(f"Speedup: {legacy_time / compiled_time:.1f}x, mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import requests
+import tweepy
+from requests.adapters import HTTPAdapter
+from tweepy.error import is_rate_limit_error_message
+from tweepy.models import SearchResults
+
+SEARCH_URL = "https://api.twitter.com/1.1/search/tweets.json"
+
+
+def create_session(pool_size=10):
+    """Creates an HTTP session that keeps connections alive between requests
+
+    Args:
+        pool_size: Connections kept open per host, at least the number of
+            threads that share the session
+
+    Returns:
+        requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class TwitterClient:
+    """Client of the search API that reuses a pooled HTTP session
+
+    tweepy.API opens and closes a new session on every call, which costs a
+    TLS handshake per request. This client sends the same request through a
+    shared session and parses the response with tweepy's models, so it
+    returns the same Status objects and raises the same errors.
+
+    Args:
+        auth: Tweepy authentication handler
+        session: Shared requests.Session
+        timeout: Seconds to wait for a response
+    """
+
+    def __init__(self, auth, session, timeout=60):
+        self.auth = auth
+        self.session = session
+        self.timeout = timeout
+        self.api = tweepy.API(auth)
+
+    def search(self, **params):
+        """Gets one page of search results
+
+        Args:
+            params: Parameters of the search/tweets endpoint, None values
+                are left out
+
+        Returns:
+            SearchResults and the HTTP response, which has the rate limit headers
+        """
+        response = self.session.get(
+            SEARCH_URL,
+            params={key: value for key, value in params.items() if value is not None},
+            auth=self.auth.apply_auth(),
+            timeout=self.timeout,
+        )
+        if not 200 <= response.status_code < 300:
+            try:
+                error_msg, api_code = self.api.parser.parse_error(response.text)
+            except Exception:
+                error_msg = (
+                    f"Twitter error response: status code = {response.status_code}"
+                )
+                api_code = None
+            if response.status_code == 429 or is_rate_limit_error_message(error_msg):
+                raise tweepy.RateLimitError(error_msg, response)
+            raise tweepy.TweepError(error_msg, response, api_code=api_code)
+        return SearchResults.parse(self.api, response.json()), response
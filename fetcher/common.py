@@ -0,0 +1,80 @@
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+import msgpack
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR / "utils"))
+from clients import create_session  # noqa: E402
+from database import Database  # noqa: E402
+from targets import Targets  # noqa: E402
+
+DATA_DIR = ROOT_DIR / "data"
+TWEETS_DB = DATA_DIR / "tweets.db"
+DB = Database(TWEETS_DB)
+LANGUAGE = os.getenv("LANGUAGE")
+TARGETS = Targets(DATA_DIR / "accounts.csv", default_language=LANGUAGE)
+SENTIMENT_APP_HOST = os.getenv("SENTIMENT_APP_HOST")
+# Keep-alive connections to the sentiment service
+SENTIMENT_SESSION = create_session()
+
+
+def wait_for_sentiment_service(timeout=600, interval=5):
+    """Waits until the inference service has loaded its model
+
+    Args:
+        timeout: Maximum number of seconds to wait
+        interval: Seconds between readiness checks
+
+    Returns:
+        True if the service is ready, False if it timed out
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            req = SENTIMENT_SESSION.get(
+                f"http://{SENTIMENT_APP_HOST}:5000/ready", timeout=5
+            )
+            if req.status_code == 200:
+                return True
+            logging.info(f"Sentiment service not ready: {req.status_code}")
+        except requests.exceptions.RequestException as e:
+            logging.info(f"Sentiment service not reachable: {e}")
+        time.sleep(interval)
+    return False
+
+
+def get_sentiment_scores(texts, language=None):
+    """Gets the sentiment of each text from inference service
+
+    Args:
+        texts: List of processed texts
+        language: Language of the texts, the service's default if None
+
+    Returns:
+        Array of scores aligned with texts
+    """
+    if len(texts) == 0:
+        return np.zeros(0, dtype=np.float32)
+    req = SENTIMENT_SESSION.post(
+        f"http://{SENTIMENT_APP_HOST}:5000/score",
+        data=msgpack.packb(
+            {"texts": texts, **({"language": language} if language else {})},
+            use_bin_type=True,
+        ),
+        headers={"content-type": "application/msgpack"},
+    )
+    req.raise_for_status()
+    scores = np.frombuffer(req.content, dtype="<f4")
+    if scores.shape[0] != len(texts):
+        raise ValueError(f"Expected {len(texts)} scores, got {scores.shape[0]}")
+    return scores
@@ -4,36 +4,177 @@ import os
 import re
 import sqlite3
 import time
+from functools import lru_cache, partial
 from pathlib import Path
 from time import sleep
+from typing import NamedTuple, Optional
 
 import numpy as np
 import pandas as pd
 
 import emoji
-import requests
 import tweepy
-from dotenv import load_dotenv
+from common import DATA_DIR, DB, LANGUAGE, TARGETS
 
-load_dotenv()
 sqlite3.register_adapter(np.int32, lambda val: int(val))
 sqlite3.register_adapter(np.int64, lambda val: int(val))
 
-ROOT_DIR = Path(__file__).resolve().parents[1]
-DATA_DIR = ROOT_DIR / "data"
-TWEETS_DB = DATA_DIR / "tweets.db"
+# common adds utils/ to the path
+from archive import archive_partition  # noqa: E402
+from clients import TwitterClient, create_session  # noqa: E402
+from partitions import (  # noqa: E402
+    add_partitions,
+    drop_expired_partitions,
+    partition_day,
+    partition_name,
+)
+from scheduler import Scheduler, SearchQuota  # noqa: E402
+from series import prune_series  # noqa: E402
+
 LOGS_PATH = Path(__file__).parent / "logs" / "fetcher.log"
-TARGETS_DF = pd.read_csv(DATA_DIR / "accounts.csv")
 EMOJI_TO_ORIG_LANG = (
     pd.read_csv(DATA_DIR / "emojis_dict.csv").set_index("name")["name_es"].to_dict()
 )
 
 CONSUMER_KEY = os.getenv("TWITTER_KEY")
 CONSUMER_SECRET = os.getenv("TWITTER_SECRET")
-SENTIMENT_APP_HOST = os.getenv("SENTIMENT_APP_HOST")
 FETCH_INTERVAL = int(os.getenv("FETCH_INTERVAL"))
-LANGUAGE = os.getenv("LANGUAGE")
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "1"))
+FETCH_MAX_INTERVAL = int(os.getenv("FETCH_MAX_INTERVAL", "300"))
+BACKFILL_MAX_REQUESTS = int(os.getenv("BACKFILL_MAX_REQUESTS", "10"))
+SEARCH_RATE_LIMIT = int(os.getenv("SEARCH_RATE_LIMIT", "450"))
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "2"))
+# Expired days are archived as Parquet files before being dropped, unless empty
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", str(DATA_DIR / "archive"))
+SEARCH_PAGE_SIZE = 100
+QUOTA = SearchQuota(SEARCH_RATE_LIMIT)
 AUTH = tweepy.AppAuthHandler(CONSUMER_KEY, CONSUMER_SECRET)
+# One pool of keep-alive connections to the Twitter API shared by the workers
+SESSION = create_session(pool_size=max(10, 2 * FETCH_WORKERS))
+CLIENT = TwitterClient(AUTH, SESSION)
+
+
+def trie_pattern(strings):
+    """Builds a regex that matches the longest of several literal strings
+
+    The strings are merged into a trie, so the regex engine only follows the
+    branch of the current character instead of trying every alternative.
+
+    Args:
+        strings: Iterable of literal strings
+
+    Returns:
+        Regex pattern (not compiled)
+    """
+    trie = {}
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def to_pattern(node):
+        is_end = "" in node
+        branches = [
+            re.escape(char) + to_pattern(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if is_end:
+            # Optional and greedy, so the longest string is matched first
+            return f"(?:{pattern})?"
+        return pattern
+
+    return to_pattern(trie)
+
+
+def start_lookahead(strings, max_gap=64):
+    """Builds a lookahead that skips the positions where no string can start
+
+    Non-ASCII first characters are merged into a few ranges of code points.
+    Strings starting with an ASCII character (e.g., keycaps like "#️⃣") also need
+    one of the possible second characters, so regular text is rejected early.
+
+    Args:
+        strings: Iterable of literal strings
+        max_gap: Code points between two first characters that are merged into
+            the same range
+
+    Returns:
+        Regex pattern (not compiled)
+    """
+    strings = [string for string in strings if string]
+    ranges = []
+    for code in sorted({ord(string[0]) for string in strings if ord(string[0]) > 127}):
+        if ranges and code - ranges[-1][1] <= max_gap:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code])
+    char_class = "".join(
+        re.escape(chr(start)) + ("-" + re.escape(chr(end)) if end > start else "")
+        for start, end in ranges
+    )
+    alternatives = [f"[{char_class}]"] if char_class else []
+    ascii_strings = [string for string in strings if ord(string[0]) <= 127]
+    if ascii_strings:
+        first = "".join(sorted({re.escape(string[0]) for string in ascii_strings}))
+        if all(len(string) > 1 for string in ascii_strings):
+            second = "".join(sorted({re.escape(s[1]) for s in ascii_strings}))
+            alternatives.append(f"[{first}][{second}]")
+        else:
+            alternatives.append(f"[{first}]")
+    return f"(?={'|'.join(alternatives)})"
+
+
+URL_PATTERN = re.compile(
+    r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+"
+)
+# Same matches as the pattern used by emoji.demojize
+EMOJI_PATTERN = re.compile(
+    start_lookahead(emoji.EMOJI_UNICODE.values())
+    + trie_pattern(emoji.EMOJI_UNICODE.values())
+)
+# Emoji names that match themselves as regexes are replaced in one pass. The
+# few that don't (e.g., ":keycap_*:") keep their original regex behaviour.
+EMOJI_NAME_PATTERN = re.compile(
+    trie_pattern(name for name in EMOJI_TO_ORIG_LANG if re.fullmatch(name, name))
+)
+EMOJI_NAME_REGEXES = [
+    (re.compile(name), name_es)
+    for name, name_es in EMOJI_TO_ORIG_LANG.items()
+    if not re.fullmatch(name, name)
+]
+# Mentions, punctuation and whitespace collapse into a single space
+SEPARATORS_PATTERN = re.compile(r"(?:@\w*|[.,\/#@!¡\?¿$%\^&\*;:{}=\-_`~()”“\"]|\s)+")
+
+
+def demojize_match(match):
+    """Replaces an emoji by its name, same as emoji.demojize"""
+    name = emoji.UNICODE_EMOJI.get(match[0], match[0])
+    return f":{name[1:-1]}:"
+
+
+def normalize_text(text):
+    """Processes a tweet for using it when predicting sentiment
+
+    Args:
+        text: Tweet
+
+    Returns:
+        Text after removing URLs, translating emojis, removing mentions and
+        punctuation, and lowercasing
+    """
+    text = URL_PATTERN.sub("", text)
+    text = EMOJI_PATTERN.sub(demojize_match, text).replace("\ufe0f", "")
+    text = EMOJI_NAME_PATTERN.sub(lambda match: EMOJI_TO_ORIG_LANG[match[0]], text)
+    for pattern, name_es in EMOJI_NAME_REGEXES:
+        text = pattern.sub(name_es, text)
+    if text.startswith("RT"):
+        text = text[2:]
+    return SEPARATORS_PATTERN.sub(" ", text).lower().strip()
 
 
 def process_text(column):
@@ -45,37 +186,56 @@ def process_text(column):
     Returns:
         Column after processing
     """
-    column = column.str.replace(
-        r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+",
-        "",
-    )
-    column = column.map(emoji.demojize)
-    column = column.replace(EMOJI_TO_ORIG_LANG, regex=True)
-    column = column.str.replace("^RT", "")
-    column = column.str.replace(r"(?<=@)\w+", "")
-    column = column.str.replace(r"[.,\/#@!¡\?¿$%\^&\*;:{}=\-_`~()”“\"]", " ")
-    column = column.str.replace(r"\s+", " ")
-    column = column.str.lower()
-    column = column.str.strip()
-    return column
+    return column.map(normalize_text)
+
+
+class Tweet(NamedTuple):
+    """Row of the TWEETS table, with the fields in the order of its columns"""
+
+    TWEET_ID: int
+    TARGET: str
+    INSERT_TIMESTAMP: str
+    FULL_TEXT: str
+    PROCESSED_TEXT: str
+    FOLLOWERS_COUNT: int
+    FAVOURITES_COUNT: int
+    FRIENDS_COUNT: int
+    TWEETS_COUNT: int
+    ACCOUNT_CREATION_DATE: str
+    TWEET_TIMESTAMP: str
+    IS_RT: int
+    SENTIMENT: Optional[float]
+    TWEET_TS: int
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
 
+@lru_cache(maxsize=None)
+def account_prefixes(target_account):
+    """Returns the mention and retweet prefixes of an account"""
+    return f"@{target_account}", f"RT @{target_account}"
 
-def extract_tweets_data(response, target, target_account):
-    """Extract data from queried tweets
+
+def status_timestamp(status):
+    """Returns the epoch seconds of the creation of a status"""
+    return (status.created_at - EPOCH) // datetime.timedelta(seconds=1)
+
+
+def iter_tweets(response, target, target_account):
+    """Extract data from queried tweets, one row at a time
 
     Args:
-        response: Response from Tweepy
+        response: Iterable of statuses from Tweepy
         target: Identifier of user of interest
         target_account: Twitter account of user of interest
 
-    Returns:
-        Dataframe of processed tweets
+    Yields:
+        Tweet rows with their processed text and without sentiment
     """
-    output = []
-    timestamp = datetime.datetime.utcnow()
+    mention, retweet = account_prefixes(target_account)
+    timestamp = str(datetime.datetime.utcnow())
     for status in response:
-        tweet_id = status.id
-        tweeted_at = status.created_at
         is_retweet = 0
         try:
             # Get full response if it is a RT
@@ -87,205 +247,311 @@ def extract_tweets_data(response, target, target_account):
         except AttributeError:
             text = status.full_text
 
+        is_related = text.startswith(mention) or (
+            status.in_reply_to_screen_name == target_account
+        )
         # Filter tweets where the target account is mentioned but
         # it is not mentioned first (so it's hard to know if it is
         # related to the target account)
-        if (
-            text.startswith("@")
-            and not text.startswith(f"@{target_account}")
-            and (
-                not status.in_reply_to_screen_name
-                or status.in_reply_to_screen_name != target_account
-            )
-        ):
+        if text.startswith("@") and not is_related:
             continue
 
         # Filters tweets that includes too many accounts but are not
         # RTs or responses to the target account
-        if (
-            not text.startswith(f"RT @{target_account}")
-            and not text.startswith(f"@{target_account}")
-            and (
-                not status.in_reply_to_screen_name
-                or status.in_reply_to_screen_name != target_account
-            )
-            and len(re.findall(r"@", text)) > 2
-        ):
+        if not is_related and not text.startswith(retweet) and text.count("@") > 2:
             continue
 
         user = status.author
-        followers_count = user.followers_count
-        favourites_count = user.favourites_count
-        friends_count = user.friends_count
-        tweets_count = user.statuses_count
-        created_at = user.created_at
-
-        output.append(
-            (
-                tweet_id,
-                target,
-                timestamp,
-                text,
-                followers_count,
-                favourites_count,
-                friends_count,
-                tweets_count,
-                created_at,
-                tweeted_at,
-                is_retweet,
-            )
+        yield Tweet(
+            status.id,
+            target,
+            timestamp,
+            text,
+            normalize_text(text),
+            user.followers_count,
+            user.favourites_count,
+            user.friends_count,
+            user.statuses_count,
+            str(user.created_at),
+            str(status.created_at),
+            is_retweet,
+            None,
+            status_timestamp(status),
         )
-    df_output = pd.DataFrame(
-        output,
-        columns=[
-            "TWEET_ID",
-            "TARGET",
-            "INSERT_TIMESTAMP",
-            "FULL_TEXT",
-            "FOLLOWERS_COUNT",
-            "FAVOURITES_COUNT",
-            "FRIENDS_COUNT",
-            "TWEETS_COUNT",
-            "ACCOUNT_CREATION_DATE",
-            "TWEET_TIMESTAMP",
-            "IS_RT",
-        ],
-    )
-    df_output.insert(
-        loc=4, column="PROCESSED_TEXT", value=process_text(df_output["FULL_TEXT"]),
-    )
-    return df_output
-
-
-def insert_data(tweets):
-    """Insert data into SQLite database"""
-    conn = sqlite3.connect(TWEETS_DB)
-    insert_query = """
-    INSERT INTO TWEETS (
-        TWEET_ID,
-        TARGET,
-        INSERT_TIMESTAMP,
-        FULL_TEXT,
-        PROCESSED_TEXT,
-        FOLLOWERS_COUNT,
-        FAVOURITES_COUNT,
-        FRIENDS_COUNT,
-        TWEETS_COUNT,
-        ACCOUNT_CREATION_DATE,
-        TWEET_TIMESTAMP,
-        IS_RT,
-        SENTIMENT
-    )
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+
+
+ROLLUP_QUERY = """
+INSERT INTO TWEETS_ROLLUP (MINUTE_TS, TARGET, IS_RT, RESPONSES, POSITIVE, SCORED)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (MINUTE_TS, TARGET, IS_RT) DO UPDATE SET
+    RESPONSES = RESPONSES + excluded.RESPONSES,
+    POSITIVE = POSITIVE + excluded.POSITIVE,
+    SCORED = SCORED + excluded.SCORED
+"""
+CURSOR_QUERY = """
+INSERT INTO FETCH_CURSORS (TARGET, LAST_ID) VALUES (?, ?)
+ON CONFLICT (TARGET) DO UPDATE SET LAST_ID = MAX(LAST_ID, excluded.LAST_ID)
+"""
+INSERT_QUERY = f"""
+INSERT INTO {{table}} ({", ".join(Tweet._fields)})
+VALUES ({", ".join("?" * len(Tweet._fields))})
+"""
+
+
+def rollup_rows(tweets):
+    """Aggregates tweets per minute, target and IS_RT for TWEETS_ROLLUP
+
+    Args:
+        tweets: Iterable of Tweet rows, SENTIMENT is None if not scored yet
+
+    Returns:
+        List of (minute, target, is_rt, responses, positive, scored) tuples
     """
-    tweets["ACCOUNT_CREATION_DATE"] = tweets["ACCOUNT_CREATION_DATE"].astype(str)
-    tweets["INSERT_TIMESTAMP"] = tweets["INSERT_TIMESTAMP"].astype(str)
-    tweets["TWEET_TIMESTAMP"] = tweets["TWEET_TIMESTAMP"].astype(str)
-    conn.executemany(insert_query, tweets.to_records(index=False))
-    conn.commit()
-    conn.close()
-    return
+    rollup = {}
+    for tweet in tweets:
+        key = (tweet.TWEET_TS // 60 * 60, tweet.TARGET, tweet.IS_RT)
+        responses, positive, scored = rollup.get(key, (0, 0, 0))
+        if tweet.SENTIMENT is not None:
+            positive += not tweet.SENTIMENT < 0.5
+            scored += 1
+        rollup[key] = (responses + 1, positive, scored)
+    return [(*key, *counts) for key, counts in rollup.items()]
 
 
-def get_latest_tweets(target_account, since_id):
-    """Get latest tweets directed at certain account
+def save_gap(conn, target, since_id, max_id):
+    """Stores the range of tweet ids a fetch still has to page through
+
+    Args:
+        conn: Connection to the database
+        target: Identifier of user of interest
+        since_id: Identifier of the tweet the range starts after
+        max_id: Identifier of the newest tweet left, or None if the range is done
+    """
+    if max_id is None:
+        conn.execute(
+            "DELETE FROM BACKFILL_GAPS WHERE TARGET = ? AND SINCE_ID = ?",
+            (target, since_id),
+        )
+    else:
+        conn.execute(
+            "INSERT OR REPLACE INTO BACKFILL_GAPS VALUES (?, ?, ?)",
+            (target, since_id, max_id),
+        )
+
+
+def retention_cutoff(now=None):
+    """Returns the day number of the oldest partition kept by retention"""
+    now = time.time() if now is None else now
+    return partition_day(int(now)) - RETENTION_DAYS
+
+
+def insert_tweets(tweets, gap=None):
+    """Insert Tweet rows into SQLite database, update the rollups and the data version
+
+    Each tweet goes to the partition of its day, which is created if needed.
+    Tweets of days retention already dropped are left out, so they do not
+    create those partitions again, but they still move the target's cursor.
+
+    Args:
+        tweets: List of Tweet rows with sentiment
+        gap: Optional (target, since_id, max_id) saved in the same transaction
+
+    Returns:
+        Number of tweets inserted
+    """
+    cutoff = retention_cutoff()
+    days = {}
+    last_ids = {}
+    for tweet in tweets:
+        last_ids[tweet.TARGET] = max(last_ids.get(tweet.TARGET, 0), tweet.TWEET_ID)
+        day = partition_day(tweet.TWEET_TS)
+        if day >= cutoff:
+            days.setdefault(day, []).append(tweet)
+    kept = [tweet for day_tweets in days.values() for tweet in day_tweets]
+    with DB.connection() as conn:
+        if kept:
+            add_partitions(conn, days)
+            for day, day_tweets in days.items():
+                conn.executemany(
+                    INSERT_QUERY.format(table=partition_name(day)), day_tweets
+                )
+            conn.executemany(ROLLUP_QUERY, rollup_rows(kept))
+            conn.execute("UPDATE DATA_VERSION SET VERSION = VERSION + 1")
+        conn.executemany(CURSOR_QUERY, last_ids.items())
+        if gap is not None:
+            save_gap(conn, *gap)
+    return len(kept)
+
+
+def search_tweets(target_account, since_id, max_id=None, language=LANGUAGE):
+    """Get one page of the latest tweets directed at certain account
 
     Args:
         target_account: Account of interest
         since_id: Identifier of tweet after which the query will get tweets
+        max_id: Identifier of the newest tweet the query will get
+        language: Language of the tweets, None for any language
 
     Returns:
-        JSON results from request to the Twitter API and API rate limit status
+        JSON results from request to the Twitter API, newest first
     """
-    api = tweepy.API(AUTH)
-    query = f"to:{target_account} OR (@{target_account}"
-    for target in TARGETS_DF.itertuples():
-        if target_account != target.account:
-            query += f" -@{target.account}"
-    query += ")"
-    results = api.search(
-        q=query,
-        lang=LANGUAGE,
+    results, response = CLIENT.search(
+        q=TARGETS.query(target_account),
+        lang=language,
         result_type="recent",
-        count="100",
+        count=SEARCH_PAGE_SIZE,
         tweet_mode="extended",
-        since_id=since_id,
-    )
-    search_limits = (
-        api.rate_limit_status()
-        .get("resources", {})
-        .get("search", {})
-        .get("/search/tweets", {})
+        since_id=since_id or None,
+        max_id=max_id,
     )
-    return results, search_limits
+    QUOTA.update(response)
+    return results
 
 
-def add_sentiment_to_tweets(processed_tweets, account):
-    """Gets sentiment per tweet from inference service
+def score_retweets(tweets, account):
+    """Scores the retweets of the target account, which are considered positive
+
+    The rest of the tweets keep a NULL sentiment, so they are inserted into the
+    scoring queue and scored later by scorer.py.
 
     Args:
-        processed_tweets: Processed tweets
+        tweets: List of Tweet rows
         account: Target account used in query
 
     Returns:
-        Dataframe with tweets and sentiment
+        List of Tweet rows
     """
-    df_deduplicated = processed_tweets[["FULL_TEXT", "PROCESSED_TEXT"]].drop_duplicates()
-    logging.debug(f"Deduplicated DF: {df_deduplicated.shape[0]}")
-    payload = df_deduplicated.to_json()
-    req = requests.get(
-        f"http://{SENTIMENT_APP_HOST}:5000/predict",
-        params={"data": payload, "account": account},
-        headers={"content-type": "application/json"},
-    )
-    response = req.json()
-    df_response = pd.DataFrame.from_dict(response)
-    output = processed_tweets.merge(
-        df_response, on=["FULL_TEXT", "PROCESSED_TEXT"], how="left"
-    )
-    logging.debug(f"{output.columns}")
-    return output
+    _, retweet = account_prefixes(account)
+    return [
+        tweet._replace(SENTIMENT=1.0) if tweet.FULL_TEXT.startswith(retweet) else tweet
+        for tweet in tweets
+    ]
+
+
+def process_statuses(statuses, target, target_account, gap=None):
+    """Filters and inserts a page of statuses, queueing them for scoring
+
+    Args:
+        statuses: Iterable of statuses from Tweepy
+        target: Identifier of user of interest
+        target_account: Twitter account of user of interest
+        gap: Optional (target, since_id, max_id) checkpoint saved with the page
+
+    Returns:
+        Number of tweets inserted
+    """
+    tweets = list(iter_tweets(statuses, target, target_account))
+    logging.info(f"{target} Inserting {len(tweets)} tweets into the DB")
+    if tweets:
+        tweets = score_retweets(tweets, target_account)
+        logging.debug(f"{target} Sample of tweets: {tweets[0]}")
+        return insert_tweets(tweets, gap)
+    if gap is not None:
+        with DB.connection() as conn:
+            save_gap(conn, *gap)
+    return 0
+
 
+def pending_ranges(target):
+    """Ranges of tweet ids to fetch for a target, newest first
 
-def main(target, target_account):
+    New tweets since the last one fetched come first, then the gaps left by
+    earlier fetches that ran out of requests. The last id is kept in
+    FETCH_CURSORS, so it survives the partitions dropped by retention.
+
+    Returns:
+        List of (since_id, max_id) tuples, max_id is None for the newest range
+    """
+    conn = DB.connection()
+    row = conn.execute(
+        "SELECT LAST_ID FROM FETCH_CURSORS WHERE TARGET = ?", (target,)
+    ).fetchone()
+    last_id = row[0] if row is not None else None
+    gaps = conn.execute(
+        """
+        SELECT SINCE_ID, MAX_ID FROM BACKFILL_GAPS
+        WHERE TARGET = ? ORDER BY SINCE_ID DESC
+        """,
+        (target,),
+    ).fetchall()
+    return [(last_id or 0, None)] + gaps
+
+
+def fetch_range(target, target_account, since_id, max_id, max_requests):
+    """Pages backwards with max_id through the tweets after since_id
+
+    Each page is inserted as it arrives, together with a checkpoint of the
+    range left, so an interrupted fetch resumes where it stopped. A page with
+    less than SEARCH_PAGE_SIZE results ends the range. Requests stop early if
+    the search quota is used up, and the range ends at the first page that
+    reaches a day retention already dropped, as older pages would be ignored.
+
+    Args:
+        target: Identifier of user of interest
+        target_account: Twitter account of user of interest
+        since_id: Identifier of the tweet the range starts after
+        max_id: Identifier of the newest tweet of the range, None for the latest
+        max_requests: Maximum number of search requests
+
+    Returns:
+        Number of search requests made and number of tweets received
+    """
+    requests_made = 0
+    received = 0
+    while requests_made < max_requests and QUOTA.take():
+        page = search_tweets(target_account, since_id, max_id, TARGETS.language(target))
+        requests_made += 1
+        received += len(page)
+        logging.info(f"{target} Got {len(page)} tweets before max_id={max_id}")
+        oldest = min(page, key=lambda status: status.id, default=None)
+        if len(page) < SEARCH_PAGE_SIZE:
+            max_id = None
+        elif partition_day(status_timestamp(oldest)) < retention_cutoff():
+            # Older pages only have tweets of days retention already dropped
+            max_id = None
+        else:
+            max_id = oldest.id - 1
+        process_statuses(page, target, target_account, (target, since_id, max_id))
+        if max_id is None:
+            break
+    return requests_made, received
+
+
+def main(target, target_account, max_requests=None):
     """Download tweets directed at target
 
     Args:
         target: Identifier of user of interest
         target_account: Twitter account of user of interest
+        max_requests: Maximum search requests, defaults to BACKFILL_MAX_REQUESTS
+
+    Returns:
+        Number of tweets received since the last tweet stored
     """
     start_time = datetime.datetime.utcnow()
     logging.info(f"{target} Started new execution ({target}) at: {start_time}")
-    logging.info(f"{target} Getting last TWEET_ID from the database")
-    conn = sqlite3.connect(TWEETS_DB)
-    cur = conn.cursor()
-    cur.execute("SELECT MAX(TWEET_ID) FROM TWEETS WHERE TARGET=?;", (target,))
-    last_id = cur.fetchone()[0]
-
     logging.info(f"{target} Getting most recent tweets from API")
+    new_tweets = 0
     for trial in range(3):  # Tries to get data from API 3 times, unless rate limit error
         try:
-            latest_tweets, api_limits = get_latest_tweets(target_account, last_id)
-            logging.info(f"{target} Limits of API: {api_limits}")
-            logging.info(f"{target} Got {len(latest_tweets)} tweets")
-            processed_tweets = extract_tweets_data(latest_tweets, target, target_account)
-            logging.info(
-                f"{target} Inserting {processed_tweets.shape[0]} tweets into the DB"
-            )
-            if processed_tweets.shape[0] > 0:
-                logging.debug(
-                    f"{target} Sample of tweets with sentiment: {processed_tweets.head(1)}"
-                )
-                processed_tweets_with_sentiment = add_sentiment_to_tweets(
-                    processed_tweets, target_account
+            # Ranges are read again on retries, as pages already inserted moved
+            # the checkpoints
+            budget = max_requests or BACKFILL_MAX_REQUESTS
+            for i, (since_id, max_id) in enumerate(pending_ranges(target)):
+                if budget <= 0 or QUOTA.available() <= 0:
+                    logging.info(f"{target} Request budget used, will resume later")
+                    break
+                requests_made, received = fetch_range(
+                    target, target_account, since_id, max_id, budget
                 )
-                logging.debug(
-                    f"{target} Sample of tweets with sentiment: {processed_tweets_with_sentiment.head(1)}"
-                )
-                insert_data(processed_tweets_with_sentiment)
-        except tweepy.error.RateLimitError:
+                budget -= requests_made
+                if i == 0:
+                    new_tweets = received
+        except tweepy.error.RateLimitError as e:
+            # The scheduler waits until the rate limit window resets
             logging.warning(f"{target} Rate Limit Error!")
-            raise
+            QUOTA.exhaust(e.response)
+            break
         except Exception:
             logging.exception(
                 f"{target} Could not retrieve tweets. Will retry in {5} seconds."
@@ -296,6 +562,35 @@ def main(target, target_account):
     logging.info(
         f"{target} Completed process. It took {(datetime.datetime.utcnow() - start_time).total_seconds()} seconds"
     )
+    return new_tweets
+
+
+def apply_retention(max_partitions=1):
+    """Drops the partitions older than RETENTION_DAYS, a few at a time
+
+    Called after every scheduler cycle, so each call holds the write lock
+    briefly and retention keeps up without a separate cleaning job. Partitions
+    are archived to ARCHIVE_DIR first, and kept if archiving fails. Buckets
+    of the hourly series past the days it keeps are deleted too.
+
+    Returns:
+        Day numbers of the partitions dropped
+    """
+    archive = None
+    if ARCHIVE_DIR:
+        archive = partial(archive_partition, archive_dir=ARCHIVE_DIR)
+    try:
+        with DB.connection() as conn:
+            dropped = drop_expired_partitions(
+                conn, RETENTION_DAYS, max_partitions=max_partitions, archive=archive
+            )
+            prune_series(conn)
+    except Exception:
+        logging.exception("Could not drop expired partitions")
+        return []
+    for day in dropped:
+        logging.info(f"Dropped expired partition {partition_name(day)}")
+    return dropped
 
 
 if __name__ == "__main__":
@@ -306,21 +601,19 @@ if __name__ == "__main__":
         level=logging.INFO,
         datefmt="%Y-%m-%d %H:%M:%S",
     )
-    time.sleep(30)
-    start_time = datetime.datetime.now()
-    end_time = datetime.datetime.now() + datetime.timedelta(hours=12)
+    scheduler = Scheduler(
+        TARGETS.df,
+        QUOTA,
+        main,
+        min_interval=FETCH_INTERVAL,
+        max_interval=FETCH_MAX_INTERVAL,
+        max_requests=BACKFILL_MAX_REQUESTS,
+        page_size=SEARCH_PAGE_SIZE,
+        workers=FETCH_WORKERS,
+    )
     while True:
-        diff = (end_time - start_time).total_seconds()
-        logging.info(f"Execution took {diff} seconds")
-        if diff >= FETCH_INTERVAL:
-            logging.info("Will start execution now")
-            start_time = datetime.datetime.now()
-            for target in TARGETS_DF.itertuples():
-                main(target.id, target.account)
-        else:
-            logging.info(f"Will start execution in {FETCH_INTERVAL - diff} seconds")
-            time.sleep(FETCH_INTERVAL - diff)
-            start_time = datetime.datetime.now()
-            for target in TARGETS_DF.itertuples():
-                main(target.id, target.account)
-        end_time = datetime.datetime.now()
+        if TARGETS.reload():
+            logging.info(f"Reloaded accounts: {list(TARGETS.df.account)}")
+            scheduler.set_targets(TARGETS.df)
+        scheduler.run_once()
+        apply_retention()
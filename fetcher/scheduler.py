@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SearchQuota:
+    """Local count of the search requests left in the current rate limit window
+
+    The count is decremented before each request and corrected with the
+    x-rate-limit-* headers of each response, so the quota is known without
+    calling the rate_limit_status endpoint.
+    """
+
+    def __init__(self, limit=450, window=900, clock=time.time):
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self.remaining = limit
+        self.reset_at = clock() + window
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        now = self.clock()
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.window
+
+    def take(self):
+        """Reserves one request, returns False if the quota is used up"""
+        with self._lock:
+            self._roll()
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def update(self, response):
+        """Syncs the quota with the rate limit headers of an API response"""
+        headers = getattr(response, "headers", None) or {}
+        with self._lock:
+            if "x-rate-limit-remaining" in headers:
+                self.remaining = int(headers["x-rate-limit-remaining"])
+            if "x-rate-limit-reset" in headers:
+                self.reset_at = float(headers["x-rate-limit-reset"])
+
+    def exhaust(self, response=None):
+        """Marks the quota as used up, e.g., after a rate limit error"""
+        self.update(response)
+        with self._lock:
+            self.remaining = 0
+
+    def available(self):
+        """Returns the requests left in the current window"""
+        with self._lock:
+            self._roll()
+            return self.remaining
+
+    def seconds_to_reset(self):
+        """Returns the seconds until the current window ends"""
+        with self._lock:
+            return max(0.0, self.reset_at - self.clock())
+
+
+class Scheduler:
+    """Plans when each target is fetched so the search quota is never exceeded
+
+    Targets are fetched again sooner when a fetch returned a full page, and
+    later when they are quiet, aiming for half a page of new tweets per fetch.
+    If the planned fetches need more requests than the quota has left until
+    the window resets, every interval is stretched by the same factor.
+
+    Args:
+        targets: Dataframe of targets with id and account columns
+        quota: SearchQuota shared by every fetch
+        fetch: Function called as fetch(target, account, max_requests) that
+            returns the number of new tweets it got
+        min_interval: Minimum seconds between fetches of a target
+        max_interval: Maximum seconds between fetches of a target
+        max_requests: Maximum requests of a single fetch
+        page_size: Tweets per search request
+        workers: Number of targets fetched at the same time
+        clock: Function that returns the current time in seconds
+        sleep: Function that waits for a number of seconds
+    """
+
+    def __init__(
+        self,
+        targets,
+        quota,
+        fetch,
+        min_interval,
+        max_interval,
+        max_requests=10,
+        page_size=100,
+        workers=1,
+        clock=time.time,
+        sleep=time.sleep,
+    ):
+        self.quota = quota
+        self.fetch = fetch
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.max_requests = max_requests
+        self.page_size = page_size
+        self.workers = workers
+        self.clock = clock
+        self.sleep = sleep
+        self.targets = {}
+        self.intervals = {}
+        self.next_at = {}
+        self.last_at = {}
+        self.set_targets(targets)
+
+    def set_targets(self, targets):
+        """Replaces the targets, keeping the plan of the ones that remain
+
+        Args:
+            targets: Dataframe of targets with id and account columns
+        """
+        now = self.clock()
+        self.targets = {target.id: target.account for target in targets.itertuples()}
+        for plan in (self.intervals, self.next_at, self.last_at):
+            for target in list(plan):
+                if target not in self.targets:
+                    del plan[target]
+        for target in self.targets:
+            self.intervals.setdefault(target, self.min_interval)
+            self.next_at.setdefault(target, now)
+
+    def plan_interval(self, target, new_tweets, elapsed):
+        """Seconds until the next fetch of a target, before throttling"""
+        interval = self.intervals[target]
+        if new_tweets >= self.page_size:
+            interval = self.min_interval
+        elif new_tweets == 0:
+            interval *= 2
+        else:
+            interval = self.page_size / 2 * elapsed / new_tweets
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def throttle(self):
+        """Factor that stretches the intervals to fit in the quota left"""
+        needed = sum(1 / interval for interval in self.intervals.values())
+        allowed = self.quota.available() / max(self.quota.seconds_to_reset(), 1)
+        if allowed <= 0:
+            return self.max_interval / self.min_interval
+        return max(1.0, needed / allowed)
+
+    def run_once(self):
+        """Fetches the targets that are due, or sleeps until one is
+
+        Returns:
+            List of the targets fetched
+        """
+        now = self.clock()
+        if self.quota.available() <= 0:
+            wait = self.quota.seconds_to_reset()
+            logging.warning(f"Search quota used up, sleeping {wait:.0f}s until reset")
+            self.sleep(wait)
+            return []
+        due = [target for target, at in self.next_at.items() if at <= now]
+        if not due:
+            # Wake up at least every min_interval, e.g., to reload the targets
+            next_at = min(self.next_at.values(), default=now + self.min_interval)
+            self.sleep(min(next_at - now, self.min_interval))
+            return []
+
+        max_requests = min(
+            self.max_requests, max(1, self.quota.available() // len(due))
+        )
+        args = [(target, self.targets[target], max_requests) for target in due]
+        if self.workers <= 1:
+            results = [self.fetch(*arg) for arg in args]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="fetcher"
+            ) as pool:
+                results = list(pool.map(lambda arg: self.fetch(*arg), args))
+
+        finished = self.clock()
+        for target, new_tweets in zip(due, results):
+            elapsed = now - self.last_at.get(target, now - self.intervals[target])
+            self.intervals[target] = self.plan_interval(target, new_tweets, elapsed)
+            self.last_at[target] = now
+        factor = self.throttle()
+        for target in due:
+            self.next_at[target] = finished + self.intervals[target] * factor
+            logging.info(
+                f"{target} Next fetch in {self.intervals[target] * factor:.0f}s"
+            )
+        return due
@@ -0,0 +1,206 @@
+import logging
+import math
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import requests
+from common import DB, TARGETS, get_sentiment_scores, wait_for_sentiment_service
+from partitions import ID_SPAN, id_partition, partition_name
+
+SCORER_BATCH_SIZE = int(os.getenv("SCORER_BATCH_SIZE", "512"))
+SCORER_IDLE_SECONDS = float(os.getenv("SCORER_IDLE_SECONDS", "2"))
+# Batches a tweet the inference service fails on is tried in, before giving up
+SCORER_MAX_ATTEMPTS = int(os.getenv("SCORER_MAX_ATTEMPTS", "3"))
+LOGS_PATH = Path(__file__).parent / "logs" / "scorer.log"
+# Languages the inference service has no model for, scored with its default
+UNSUPPORTED_LANGUAGES = set()
+# Queue row of each tweet that could not be scored to its number of attempts
+FAILED_ATTEMPTS = {}
+
+PENDING_QUERY = """
+SELECT T.ID, T.TWEET_TS, T.TARGET, T.IS_RT, T.PROCESSED_TEXT
+FROM SCORING_QUEUE Q JOIN {table} T ON T.ID = Q.TWEET_ROWID
+WHERE Q.TWEET_ROWID >= ? AND Q.TWEET_ROWID < ?
+ORDER BY Q.TWEET_ROWID
+LIMIT ?
+"""
+ROLLUP_SCORES_QUERY = """
+UPDATE TWEETS_ROLLUP SET POSITIVE = POSITIVE + ?, SCORED = SCORED + ?
+WHERE MINUTE_TS = ? AND TARGET = ? AND IS_RT = ?
+"""
+
+
+def pending_tweets(conn, batch_size):
+    """Reads the oldest tweets of the scoring queue from their partitions
+
+    Ids of each partition start at its day number * ID_SPAN, so the queue is
+    read one partition at a time with range scans.
+
+    Args:
+        conn: Connection to the database
+        batch_size: Maximum number of tweets read
+
+    Returns:
+        List of (ID, TWEET_TS, TARGET, IS_RT, PROCESSED_TEXT) tuples
+    """
+    pending = []
+    next_id = 0
+    while len(pending) < batch_size:
+        first_id = conn.execute(
+            "SELECT MIN(TWEET_ROWID) FROM SCORING_QUEUE WHERE TWEET_ROWID >= ?",
+            (next_id,),
+        ).fetchone()[0]
+        if first_id is None:
+            break
+        day = id_partition(first_id)
+        next_id = (day + 1) * ID_SPAN
+        pending += conn.execute(
+            PENDING_QUERY.format(table=partition_name(day)),
+            (first_id, next_id, batch_size - len(pending)),
+        ).fetchall()
+    return pending
+
+
+def score_language(texts, language):
+    """Scores texts with the model of a language, or the default one if missing
+
+    The inference service answers 400 to languages without a model. Those are
+    remembered, so later batches go straight to the default model instead of
+    failing every time (and holding back the tweets of the other languages).
+    """
+    if language in UNSUPPORTED_LANGUAGES:
+        language = None
+    try:
+        return get_sentiment_scores(texts, language)
+    except requests.exceptions.HTTPError as e:
+        if language is None or e.response is None or e.response.status_code != 400:
+            raise
+        logging.warning(f"No sentiment model for {language}, using the default one")
+        UNSUPPORTED_LANGUAGES.add(language)
+        return get_sentiment_scores(texts)
+
+
+def score_or_split(texts, language):
+    """Scores texts, splitting them to find the ones the service fails on
+
+    When the inference service answers with a server error, each half is sent
+    again, so a text that breaks the model only leaves itself unscored (NaN)
+    instead of the whole batch. Other errors (e.g., the service is down) are
+    raised.
+    """
+    try:
+        return score_language(texts, language)
+    except requests.exceptions.HTTPError as e:
+        if e.response is None or e.response.status_code < 500:
+            raise
+        if len(texts) == 1:
+            logging.warning(f"Could not score {texts[0]!r}: {e}")
+            return np.full(1, np.nan, dtype=np.float32)
+    middle = len(texts) // 2
+    return np.concatenate(
+        [
+            score_or_split(texts[:middle], language),
+            score_or_split(texts[middle:], language),
+        ]
+    )
+
+
+def score_pending(batch_size=SCORER_BATCH_SIZE):
+    """Scores the oldest tweets of the scoring queue
+
+    Texts are deduplicated and scored with a single request per language to
+    the inference service, using the default model for languages without one.
+    Sentiments, rollups and the queue are updated in one transaction, so a
+    batch that fails is scored again later. Tweets the service fails on stay
+    in the queue, and are left without sentiment after SCORER_MAX_ATTEMPTS
+    batches, so they do not block the rest.
+
+    Args:
+        batch_size: Maximum number of tweets scored
+
+    Returns:
+        Number of tweets scored
+    """
+    conn = DB.connection()
+    pending = pending_tweets(conn, batch_size)
+    if not pending:
+        return 0
+    keys = [(TARGETS.language(row[2]), row[-1]) for row in pending]
+    texts = {}
+    for language, text in keys:
+        texts.setdefault(language, {}).setdefault(text)
+    scores = {}
+    for language, unique_texts in texts.items():
+        language_scores = score_or_split(list(unique_texts), language)
+        scores.update(
+            ((language, text), score)
+            for text, score in zip(unique_texts, language_scores.tolist())
+        )
+    # The service fails on every text, e.g., while its model is broken
+    if len(scores) > 1 and all(math.isnan(score) for score in scores.values()):
+        raise RuntimeError(f"Could not score any of {len(scores)} texts")
+
+    rollup = {}
+    updates = {}
+    done = []
+    for (rowid, tweet_ts, target, is_rt, _), key in zip(pending, keys):
+        if math.isnan(scores[key]):
+            FAILED_ATTEMPTS[rowid] = FAILED_ATTEMPTS.get(rowid, 0) + 1
+            if FAILED_ATTEMPTS[rowid] >= SCORER_MAX_ATTEMPTS:
+                logging.warning(f"Giving up on scoring tweet {rowid}")
+                del FAILED_ATTEMPTS[rowid]
+                done.append(rowid)
+            continue
+        FAILED_ATTEMPTS.pop(rowid, None)
+        done.append(rowid)
+        bucket = (tweet_ts // 60 * 60, target, is_rt)
+        positive, scored = rollup.get(bucket, (0, 0))
+        rollup[bucket] = (positive + (not scores[key] < 0.5), scored + 1)
+        updates.setdefault(id_partition(rowid), []).append((scores[key], rowid))
+    with conn:
+        for day, rows in updates.items():
+            conn.executemany(
+                f"UPDATE {partition_name(day)} SET SENTIMENT = ? WHERE ID = ?", rows
+            )
+        conn.executemany(
+            ROLLUP_SCORES_QUERY,
+            ((*counts, *key) for key, counts in rollup.items()),
+        )
+        conn.executemany(
+            "DELETE FROM SCORING_QUEUE WHERE TWEET_ROWID = ?",
+            ((rowid,) for rowid in done),
+        )
+        conn.execute("UPDATE DATA_VERSION SET VERSION = VERSION + 1")
+    logging.info(f"Scored {len(pending)} tweets ({len(scores)} unique texts)")
+    return len(pending)
+
+
+def main():
+    """Drains the scoring queue, waiting for new tweets when it is empty"""
+    while True:
+        if TARGETS.reload():
+            # Check again the languages that had no model when accounts change
+            UNSUPPORTED_LANGUAGES.clear()
+        try:
+            scored = score_pending()
+        except Exception:
+            logging.exception(f"Could not score tweets. Will retry in {5} seconds.")
+            time.sleep(5)
+            continue
+        if scored < SCORER_BATCH_SIZE:
+            time.sleep(SCORER_IDLE_SECONDS)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename=LOGS_PATH,
+        filemode="w",
+        format="[%(levelname)s] %(threadName)s %(asctime)s %(message)s",
+        level=logging.INFO,
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    if not wait_for_sentiment_service():
+        logging.warning("Sentiment service is not ready, starting anyway")
+    main()
@@ -0,0 +1,235 @@
+import argparse
+import logging
+import os
+import queue
+import re
+import time
+from pathlib import Path
+
+import joblib
+import tweepy
+from fetch_tweets import (
+    CONSUMER_KEY,
+    CONSUMER_SECRET,
+    TARGETS,
+    apply_retention,
+    process_statuses,
+)
+
+ACCESS_TOKEN = os.getenv("TWITTER_ACCESS_TOKEN")
+ACCESS_SECRET = os.getenv("TWITTER_ACCESS_SECRET")
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "100"))
+STREAM_BATCH_SECONDS = float(os.getenv("STREAM_BATCH_SECONDS", "5"))
+# Seconds between two runs of the retention (drop, archive and prune) of expired days
+STREAM_RETENTION_SECONDS = float(os.getenv("STREAM_RETENTION_SECONDS", "60"))
+LOGS_PATH = Path(__file__).parent / "logs" / "stream.log"
+MENTION_PATTERN = re.compile(r"@(\w+)")
+
+
+def set_full_text(status):
+    """Copies the untruncated text of a streamed status to status.full_text
+
+    Statuses from the streaming API keep texts longer than 140 characters in
+    extended_tweet, while the filtering steps read full_text as in the search
+    API responses.
+    """
+    for tweet in (status, getattr(status, "retweeted_status", None)):
+        if tweet is None or hasattr(tweet, "full_text"):
+            continue
+        extended_tweet = getattr(tweet, "extended_tweet", None)
+        tweet.full_text = extended_tweet["full_text"] if extended_tweet else tweet.text
+    return status
+
+
+def route_status(status, targets):
+    """Finds the target a status is directed at
+
+    Mirrors the search query of the polling mode: replies to the target
+    account, or statuses that mention it and no other tracked account.
+
+    Args:
+        status: Status with full_text
+        targets: Dictionary of lowercase account to (target, account)
+
+    Returns:
+        (target, account) tuple or None if the status is not for one target
+    """
+    reply_to = (status.in_reply_to_screen_name or "").lower()
+    if reply_to in targets:
+        return targets[reply_to]
+    text = status.full_text
+    retweeted_status = getattr(status, "retweeted_status", None)
+    if retweeted_status is not None:
+        text = f"RT @{retweeted_status.author.screen_name} {retweeted_status.full_text}"
+    mentioned = {account.lower() for account in MENTION_PATTERN.findall(text)}
+    mentioned &= targets.keys()
+    if len(mentioned) == 1:
+        return targets[mentioned.pop()]
+    return None
+
+
+class StreamIngester:
+    """Routes statuses to their targets and processes them in micro-batches
+
+    A target's batch is filtered and inserted when it has batch_size
+    statuses or its oldest status waited for max_wait seconds.
+    """
+
+    def __init__(
+        self,
+        targets,
+        batch_size=STREAM_BATCH_SIZE,
+        max_wait=STREAM_BATCH_SECONDS,
+        process=process_statuses,
+        clock=time.monotonic,
+    ):
+        self.targets = {
+            target.account.lower(): (target.id, target.account)
+            for target in targets.itertuples()
+        }
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.process = process
+        self.clock = clock
+        self.inserted = 0
+        self._batches = {}
+
+    def add(self, status):
+        """Buffers a status in the batch of its target"""
+        route = route_status(set_full_text(status), self.targets)
+        if route is None:
+            return
+        _, batch = self._batches.setdefault(route, (self.clock(), []))
+        batch.append(status)
+        if len(batch) >= self.batch_size:
+            self._flush(route)
+
+    def flush_due(self):
+        """Processes the batches that waited for max_wait seconds"""
+        now = self.clock()
+        for route, (started_at, _) in list(self._batches.items()):
+            if now - started_at >= self.max_wait:
+                self._flush(route)
+
+    def flush(self):
+        """Processes every buffered status"""
+        for route in list(self._batches):
+            self._flush(route)
+
+    def _flush(self, route):
+        _, batch = self._batches.pop(route)
+        target, account = route
+        try:
+            self.inserted += self.process(batch, target, account)
+        except Exception:
+            logging.exception(f"{target} Could not process {len(batch)} statuses")
+
+
+class QueueListener(tweepy.StreamListener):
+    """Passes statuses to the ingester thread, so reading never blocks"""
+
+    def __init__(self, statuses):
+        super().__init__()
+        self.statuses = statuses
+
+    def on_status(self, status):
+        self.statuses.put(status)
+
+    def on_error(self, status_code):
+        # Tweepy reconnects with exponential backoff, including on 420 errors
+        logging.warning(f"Stream error: {status_code}")
+
+
+def consume(
+    statuses, ingester, stop=None, maintain=None, interval=STREAM_RETENTION_SECONDS
+):
+    """Feeds statuses from a queue into an ingester until stop is set
+
+    Args:
+        statuses: Queue of statuses
+        ingester: StreamIngester
+        stop: Optional threading.Event that ends consuming, runs forever if None
+        maintain: Optional function called every interval seconds (measured
+            with the ingester's clock), e.g., apply_retention
+        interval: Seconds between two calls of maintain
+    """
+    next_maintenance = ingester.clock()
+    while stop is None or not stop.is_set():
+        try:
+            ingester.add(statuses.get(timeout=ingester.max_wait / 2))
+        except queue.Empty:
+            pass
+        ingester.flush_due()
+        if maintain is not None and ingester.clock() >= next_maintenance:
+            maintain()
+            next_maintenance = ingester.clock() + interval
+    ingester.flush()
+
+
+def replay_statuses(path):
+    """Reads recorded statuses (e.g., data/sample_tweets.joblib) oldest first"""
+    return sorted(joblib.load(path), key=lambda status: status.id)
+
+
+def run_replay(path, targets=None, process=process_statuses):
+    """Ingests recorded statuses as if they arrived from the stream
+
+    Args:
+        path: Path of a joblib file with a list of statuses
+        targets: Dataframe of targets with id and account columns
+        process: Function that filters and inserts a batch of statuses
+
+    Returns:
+        Number of tweets inserted
+    """
+    if targets is None:
+        targets = TARGETS.df
+    ingester = StreamIngester(targets, process=process)
+    for status in replay_statuses(path):
+        ingester.add(status)
+    ingester.flush()
+    return ingester.inserted
+
+
+def run_stream(targets=None):
+    """Consumes a filtered stream of the mentions of every target
+
+    The tracked accounts are fixed for the lifetime of the connection, so
+    changes to accounts.csv need a restart of the stream.
+    """
+    if targets is None:
+        targets = TARGETS.df
+    auth = tweepy.OAuthHandler(CONSUMER_KEY, CONSUMER_SECRET)
+    auth.set_access_token(ACCESS_TOKEN, ACCESS_SECRET)
+    # Without a language for every target, the stream gets all languages
+    languages = {TARGETS.language(target) for target in targets.id}
+    statuses = queue.Queue()
+    stream = tweepy.Stream(auth, QueueListener(statuses))
+    stream.filter(
+        track=list(targets.account),
+        languages=None if None in languages else sorted(languages),
+        is_async=True,
+    )
+    ingester = StreamIngester(targets)
+    try:
+        consume(statuses, ingester, maintain=apply_retention)
+    finally:
+        stream.disconnect()
+        ingester.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest tweets from a stream")
+    parser.add_argument("--replay", help="Ingest recorded statuses from a joblib file")
+    args = parser.parse_args()
+    logging.basicConfig(
+        filename=LOGS_PATH,
+        filemode="w",
+        format="[%(levelname)s] %(threadName)s %(asctime)s %(message)s",
+        level=logging.INFO,
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    if args.replay:
+        logging.info(f"Inserted {run_replay(args.replay)} tweets")
+    else:
+        run_stream()
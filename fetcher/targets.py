@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+
+import pandas as pd
+
+
+def search_queries(accounts):
+    """Builds the search query of each account
+
+    Each query gets the replies to the account and the tweets that mention it
+    but none of the other accounts tracked.
+
+    Args:
+        accounts: List of Twitter accounts
+
+    Returns:
+        Dictionary of account to query
+    """
+    return {
+        account: f"to:{account} OR (@{account}"
+        + "".join(f" -@{other}" for other in accounts if other != account)
+        + ")"
+        for account in accounts
+    }
+
+
+class Targets:
+    """Accounts to track, read from a CSV file with id and account columns
+
+    Search queries are built once per load, and reload() reads the file again
+    only when its modification time changed, so accounts can be edited
+    without restarting the fetcher. An optional language column sets the
+    language of each target's tweets, which defaults to default_language.
+    """
+
+    def __init__(self, path, default_language=None):
+        self.path = path
+        self.default_language = default_language
+        self.df = None
+        self.queries = {}
+        self.languages = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Reads the file again if it changed
+
+        Returns:
+            True if the accounts were loaded again
+        """
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return False
+            try:
+                df = pd.read_csv(self.path)
+                queries = search_queries(list(df.account))
+                languages = {}
+                if "language" in df.columns:
+                    languages = df.dropna(subset=["language"])
+                    languages = dict(zip(languages.id, languages.language))
+            except Exception:
+                if self.df is None:
+                    raise
+                logging.exception(f"Could not reload {self.path}, keeping accounts")
+                return False
+            self.df, self.queries, self._mtime = df, queries, mtime
+            self.languages = languages
+            return True
+
+    def query(self, account):
+        """Returns the search query of an account"""
+        try:
+            return self.queries[account]
+        except KeyError:
+            return search_queries(list(self.df.account) + [account])[account]
+
+    def language(self, target):
+        """Returns the language of a target's tweets, None for any language"""
+        return self.languages.get(target, self.default_language)
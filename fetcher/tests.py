@@ -1,33 +1,75 @@
+import numpy as np
+import os
+import queue
 import pandas as pd
 import sqlite3
+import subprocess
+import sys
+import threading
+from datetime import datetime
 from pathlib import Path
+from types import SimpleNamespace
 import joblib
+import pytest
+import requests
+import tweepy
+import fetch_tweets
 from fetch_tweets import (
-    add_sentiment_to_tweets,
-    extract_tweets_data,
-    get_latest_tweets,
+    Tweet,
+    insert_tweets,
+    iter_tweets,
+    process_statuses,
     process_text,
-    insert_data,
+    search_tweets,
 )
+from clients import TwitterClient
+from common import get_sentiment_scores
+from database import Database
+from partitions import ID_SPAN
+from scheduler import Scheduler, SearchQuota
+import scorer
+from targets import Targets, search_queries
+from stream_tweets import StreamIngester, consume, run_replay
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
 DATA_DIR = ROOT_DIR / "data"
 SAMPLE_TWEETS = DATA_DIR / "sample_tweets.joblib"
 TWEETS_DB = DATA_DIR / "tweets.db"
+sys.path.append(str(ROOT_DIR / "utils"))
 
 TARGET = "pablo_casado"
 TARGET_ACCOUNT = "pablocasado_"
 DOWNLOAD_SAMPLE_TWEETS = False
 
 
-def test_get_latest_tweets():
+@pytest.fixture(autouse=True)
+def keep_sample_days(monkeypatch):
+    """Sample tweets are from 2020, so retention must not leave them out"""
+    monkeypatch.setattr(fetch_tweets, "RETENTION_DAYS", 10**5)
+
+
+def test_search_tweets():
     """Check if downloading tweets using Tweepy works"""
     if DOWNLOAD_SAMPLE_TWEETS:
-        latest_tweets, api_limits = get_latest_tweets(TARGET_ACCOUNT, 1)
+        latest_tweets = search_tweets(TARGET_ACCOUNT, 1)
         joblib.dump(latest_tweets, SAMPLE_TWEETS)
     assert Path(SAMPLE_TWEETS).is_file()
 
 
+def test_search_tweets_syncs_quota_from_response_headers(monkeypatch):
+    """Check if searches update the quota without calling rate_limit_status"""
+    response = SimpleNamespace(
+        headers={"x-rate-limit-remaining": "42", "x-rate-limit-reset": "1595160900"}
+    )
+    client = SimpleNamespace(search=lambda **kwargs: (["status"], response))
+    quota = SearchQuota(limit=450, window=900, clock=lambda: 1595160000.0)
+    monkeypatch.setattr(fetch_tweets, "CLIENT", client)
+    monkeypatch.setattr(fetch_tweets, "QUOTA", quota)
+    assert search_tweets(TARGET_ACCOUNT, 1) == ["status"]
+    assert quota.available() == 42
+    assert quota.seconds_to_reset() == 900
+
+
 def test_process_text():
     """Check if the pre-processing text function works as expected"""
     df = pd.DataFrame(
@@ -54,62 +96,636 @@ def test_process_text():
     assert process_text(df["text"])[7] == "this text has multiple spaces"
 
 
-def test_extract_tweets_data():
+def test_iter_tweets():
     """Checks if extracting the relevant fields from the API response works as expected"""
     tweets_sample = joblib.load(SAMPLE_TWEETS)
-    tweets = extract_tweets_data(tweets_sample, TARGET, TARGET_ACCOUNT)
-    columns = [
-        "TWEET_ID",
-        "TARGET",
-        "INSERT_TIMESTAMP",
-        "FULL_TEXT",
-        "PROCESSED_TEXT",
-        "FOLLOWERS_COUNT",
-        "FAVOURITES_COUNT",
-        "FRIENDS_COUNT",
-        "TWEETS_COUNT",
-        "ACCOUNT_CREATION_DATE",
-        "TWEET_TIMESTAMP",
-        "IS_RT",
-    ]
+    tweets = list(iter_tweets(tweets_sample, TARGET, TARGET_ACCOUNT))
+    assert tweets
+    assert all(value is not None for tweet in tweets for value in tweet[:12])
+    assert all(tweet.SENTIMENT is None for tweet in tweets)
 
-    assert (tweets.isna().sum() == 0).all()
-    assert (tweets.columns == columns).all()
 
-
-def test_add_sentiment_to_tweets():
+def test_get_sentiment_scores():
     """Checks if the sentiment service works as expected"""
     tweets_sample = joblib.load(SAMPLE_TWEETS)
-    tweets = extract_tweets_data(tweets_sample, TARGET, TARGET_ACCOUNT)
-    print(tweets.columns)
-    tweets_with_sentiment = add_sentiment_to_tweets(tweets, TARGET_ACCOUNT)
-    columns = [
-        "TWEET_ID",
-        "TARGET",
-        "INSERT_TIMESTAMP",
-        "FULL_TEXT",
-        "PROCESSED_TEXT",
-        "FOLLOWERS_COUNT",
-        "FAVOURITES_COUNT",
-        "FRIENDS_COUNT",
-        "TWEETS_COUNT",
-        "ACCOUNT_CREATION_DATE",
-        "TWEET_TIMESTAMP",
-        "IS_RT",
-        "SENTIMENT",
-    ]
-    assert (tweets_with_sentiment.columns == columns).all()
-    assert (tweets_with_sentiment.isna().sum() == 0).all()
+    tweets = list(iter_tweets(tweets_sample, TARGET, TARGET_ACCOUNT))
+    scores = get_sentiment_scores([tweet.PROCESSED_TEXT for tweet in tweets])
+    assert scores.shape == (len(tweets),)
+    assert not np.isnan(scores).any()
 
 
 def test_insert_tweets_in_db():
     """Check if it is possible to insert tweets into the db"""
     tweets_sample = joblib.load(SAMPLE_TWEETS)
-    tweets = extract_tweets_data(tweets_sample, TARGET, TARGET_ACCOUNT)
-    tweets_with_sentiment = add_sentiment_to_tweets(tweets, TARGET_ACCOUNT)
-    insert_data(tweets_with_sentiment)
+    process_statuses(tweets_sample, TARGET, TARGET_ACCOUNT)
     conn = sqlite3.connect(TWEETS_DB)
     cur = conn.cursor()
     cur.execute("SELECT COUNT(*) FROM TWEETS WHERE TWEET_ID=1284798583040913410;")
     count = cur.fetchone()[0]
     assert count == 1
+
+
+def test_insert_tweets_updates_rollups(tmp_path, monkeypatch):
+    """Check if inserting tweets adds them to the per-minute rollups"""
+    import create_database
+
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    monkeypatch.setattr(fetch_tweets, "DB", Database(db_path))
+
+    def tweets(timestamps, is_rt, sentiment):
+        return [
+            Tweet(
+                i,
+                TARGET,
+                "2020-07-19 12:05:00",
+                "text",
+                "text",
+                1,
+                1,
+                1,
+                1,
+                "2010-01-01 00:00:00",
+                str(datetime.utcfromtimestamp(timestamp)),
+                rt,
+                score,
+                timestamp,
+            )
+            for i, (timestamp, rt, score) in enumerate(
+                zip(timestamps, is_rt, sentiment)
+            )
+        ]
+
+    insert_tweets(tweets([1595160005, 1595160050], [0, 0], [0.9, 0.1]))
+    insert_tweets(tweets([1595160030, 1595160060], [0, 1], [0.7, 0.2]))
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT * FROM TWEETS_ROLLUP ORDER BY MINUTE_TS").fetchall()
+    assert rows == [
+        (1595160000, TARGET, 0, 3, 2, 3),
+        (1595160060, TARGET, 1, 1, 0, 1),
+    ]
+
+
+def fake_status(tweet_id, text, in_reply_to=None, retweet_of=None, created_at=None):
+    author = SimpleNamespace(
+        screen_name="user",
+        followers_count=1,
+        favourites_count=2,
+        friends_count=3,
+        statuses_count=4,
+        created_at=datetime(2010, 1, 1),
+    )
+    status = SimpleNamespace(
+        id=tweet_id,
+        full_text=text,
+        author=author,
+        created_at=created_at or datetime(2020, 7, 19, 12, 0, tweet_id),
+        in_reply_to_screen_name=in_reply_to,
+    )
+    if retweet_of:
+        status.retweeted_status = SimpleNamespace(
+            author=SimpleNamespace(screen_name=retweet_of), full_text=text
+        )
+    return status
+
+
+def test_process_statuses_inserts_and_scorer_drains_queue(tmp_path, monkeypatch):
+    """Check if statuses are inserted right away and scored from the queue"""
+    import create_database
+
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    monkeypatch.setattr(fetch_tweets, "DB", Database(db_path))
+    monkeypatch.setattr(scorer, "DB", fetch_tweets.DB)
+    monkeypatch.setattr(
+        scorer,
+        "get_sentiment_scores",
+        lambda texts, language=None: np.full(len(texts), 0.25, dtype=np.float32),
+    )
+    statuses = [
+        fake_status(1, f"@{TARGET_ACCOUNT} hola 🥑"),
+        fake_status(2, "@someone else"),
+        fake_status(3, "@a @b @c too many mentions", in_reply_to="a"),
+        fake_status(4, "hola @a @b @c", in_reply_to=TARGET_ACCOUNT),
+        fake_status(5, "great speech", retweet_of=TARGET_ACCOUNT),
+    ]
+    tweets = list(iter_tweets(statuses, TARGET, TARGET_ACCOUNT))
+    assert [tweet.TWEET_ID for tweet in tweets] == [1, 4, 5]
+    assert tweets[0].PROCESSED_TEXT == "hola aguacate"
+    assert tweets[0].TWEET_TS == 1595160001
+
+    assert process_statuses(statuses, TARGET, TARGET_ACCOUNT) == 3
+    conn = sqlite3.connect(db_path)
+    query = "SELECT TWEET_ID, IS_RT, SENTIMENT, TWEET_TIMESTAMP FROM TWEETS"
+    assert conn.execute(query).fetchall() == [
+        (1, 0, None, "2020-07-19 12:00:01"),
+        (4, 0, None, "2020-07-19 12:00:04"),
+        (5, 1, 1.0, "2020-07-19 12:00:05"),
+    ]
+    # Ids of each daily partition start at its day number * ID_SPAN
+    first_id = 1595160001 // 86400 * ID_SPAN + 1
+    assert conn.execute("SELECT * FROM SCORING_QUEUE").fetchall() == [
+        (first_id,),
+        (first_id + 1,),
+    ]
+    assert conn.execute("SELECT * FROM TWEETS_ROLLUP").fetchall() == [
+        (1595160000, TARGET, 0, 2, 0, 0),
+        (1595160000, TARGET, 1, 1, 1, 1),
+    ]
+
+    assert scorer.score_pending(batch_size=1) == 1
+    assert scorer.score_pending() == 1
+    assert scorer.score_pending() == 0
+    assert [row[2] for row in conn.execute(query)] == [0.25, 0.25, 1.0]
+    assert conn.execute("SELECT * FROM SCORING_QUEUE").fetchall() == []
+    assert conn.execute("SELECT * FROM TWEETS_ROLLUP").fetchall() == [
+        (1595160000, TARGET, 0, 2, 0, 2),
+        (1595160000, TARGET, 1, 1, 1, 1),
+    ]
+
+
+def test_scorer_scores_each_text_once(tmp_path, monkeypatch):
+    """Check if scores of deduplicated texts are assigned to every matching tweet"""
+    import create_database
+
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    monkeypatch.setattr(fetch_tweets, "DB", Database(db_path))
+    monkeypatch.setattr(scorer, "DB", fetch_tweets.DB)
+    scored_texts = []
+
+    def fake_scores(texts, language=None):
+        scored_texts.append(texts)
+        return np.array([len(text) / 10 for text in texts], dtype=np.float32)
+
+    monkeypatch.setattr(scorer, "get_sentiment_scores", fake_scores)
+    statuses = [
+        fake_status(1, "hola", retweet_of=TARGET_ACCOUNT),
+        fake_status(2, f"@{TARGET_ACCOUNT} a"),
+        fake_status(3, f"@{TARGET_ACCOUNT} bb"),
+        fake_status(4, f"@{TARGET_ACCOUNT} a!"),
+    ]
+    process_statuses(statuses, TARGET, TARGET_ACCOUNT)
+    assert scorer.score_pending() == 3
+    assert scored_texts == [["a", "bb"]]
+    query = "SELECT SENTIMENT FROM TWEETS ORDER BY TWEET_ID"
+    scores = [row[0] for row in sqlite3.connect(db_path).execute(query)]
+    assert [round(score, 2) for score in scores] == [1.0, 0.1, 0.2, 0.1]
+
+
+def test_scorer_skips_texts_the_service_fails_on(tmp_path, monkeypatch):
+    """Check if a text that breaks the model does not block the queue"""
+    import create_database
+
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    monkeypatch.setattr(fetch_tweets, "DB", Database(db_path))
+    monkeypatch.setattr(scorer, "DB", fetch_tweets.DB)
+    monkeypatch.setattr(scorer, "FAILED_ATTEMPTS", {})
+    monkeypatch.setattr(scorer, "SCORER_MAX_ATTEMPTS", 2)
+    calls = []
+
+    def get_sentiment_scores(texts, language=None):
+        calls.append(len(texts))
+        if "veneno" in texts:
+            response = SimpleNamespace(status_code=500)
+            raise requests.exceptions.HTTPError("500", response=response)
+        return np.full(len(texts), 0.75, dtype=np.float32)
+
+    monkeypatch.setattr(scorer, "get_sentiment_scores", get_sentiment_scores)
+    statuses = [
+        fake_status(i, f"@{TARGET_ACCOUNT} {text}")
+        for i, text in enumerate(["hola", "veneno", "adios", "gracias"], 1)
+    ]
+    assert process_statuses(statuses, TARGET, TARGET_ACCOUNT) == 4
+    conn = sqlite3.connect(db_path)
+    query = "SELECT SENTIMENT FROM TWEETS ORDER BY TWEET_ID"
+
+    assert scorer.score_pending() == 4
+    assert calls == [4, 2, 1, 1, 2]
+    assert [row[0] for row in conn.execute(query)] == [0.75, None, 0.75, 0.75]
+    assert conn.execute("SELECT COUNT(*) FROM SCORING_QUEUE").fetchone()[0] == 1
+
+    assert scorer.score_pending() == 1
+    assert conn.execute("SELECT COUNT(*) FROM SCORING_QUEUE").fetchone()[0] == 0
+    assert [row[0] for row in conn.execute(query)] == [0.75, None, 0.75, 0.75]
+    assert scorer.FAILED_ATTEMPTS == {}
+
+
+def test_scorer_uses_default_model_for_unsupported_languages(monkeypatch):
+    """Check if a language without a model does not block the other tweets"""
+    requests_made = []
+
+    def get_sentiment_scores(texts, language=None):
+        requests_made.append(language)
+        if language == "xx":
+            response = SimpleNamespace(status_code=400)
+            raise requests.exceptions.HTTPError("400", response=response)
+        return np.full(len(texts), 0.5, dtype=np.float32)
+
+    monkeypatch.setattr(scorer, "get_sentiment_scores", get_sentiment_scores)
+    monkeypatch.setattr(scorer, "UNSUPPORTED_LANGUAGES", set())
+    assert scorer.score_language(["a", "b"], "xx").tolist() == [0.5, 0.5]
+    assert scorer.score_language(["c"], "xx").tolist() == [0.5]
+    assert scorer.score_language(["d"], "es").tolist() == [0.5]
+    assert requests_made == ["xx", None, None, "es"]
+
+
+def test_scorer_does_not_import_the_fetcher():
+    """Check if the scorer starts without Twitter credentials or fetcher settings"""
+    env = {key: value for key, value in os.environ.items() if key != "FETCH_INTERVAL"}
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, scorer; assert 'fetch_tweets' not in sys.modules",
+        ],
+        cwd=Path(__file__).parent,
+        env=env,
+        check=True,
+    )
+
+
+def test_stream_ingester_routes_and_batches_statuses():
+    """Check if streamed statuses are routed to their targets in micro-batches"""
+    now = [0.0]
+    batches = []
+
+    def process(statuses, target, account):
+        batches.append((target, [status.id for status in statuses]))
+        return len(statuses)
+
+    targets = pd.DataFrame(
+        {"id": [TARGET, "other"], "account": [TARGET_ACCOUNT, "Other"]}
+    )
+    ingester = StreamIngester(
+        targets, batch_size=2, max_wait=5, process=process, clock=lambda: now[0]
+    )
+    ingester.add(fake_status(1, f"@{TARGET_ACCOUNT} hola"))
+    ingester.add(fake_status(2, "@other hola"))
+    ingester.add(fake_status(3, f"@{TARGET_ACCOUNT} @other both"))
+    ingester.add(fake_status(4, "hola", in_reply_to=TARGET_ACCOUNT))
+    assert batches == [(TARGET, [1, 4])]
+
+    now[0] = 4.0
+    ingester.flush_due()
+    assert len(batches) == 1
+    now[0] = 5.0
+    ingester.flush_due()
+    assert batches == [(TARGET, [1, 4]), ("other", [2])]
+    assert ingester.inserted == 3
+
+
+def test_consume_applies_retention_periodically():
+    """Check if the stream mode drops expired days while it consumes statuses"""
+    now = [0.0]
+    retention_runs = []
+    stop = threading.Event()
+
+    class IdleQueue:
+        def get(self, timeout):
+            now[0] += 30
+            raise queue.Empty
+
+    def maintain():
+        retention_runs.append(now[0])
+        if len(retention_runs) == 3:
+            stop.set()
+
+    targets = pd.DataFrame({"id": [TARGET], "account": [TARGET_ACCOUNT]})
+    ingester = StreamIngester(targets, clock=lambda: now[0])
+    consume(IdleQueue(), ingester, stop, maintain=maintain, interval=60)
+    assert retention_runs == [30, 90, 150]
+
+
+def test_run_replay_inserts_recorded_statuses(tmp_path):
+    """Check if recorded statuses can be ingested offline"""
+    inserted = []
+
+    def process(statuses, target, account):
+        inserted.extend(status.id for status in statuses)
+        return len(statuses)
+
+    path = tmp_path / "statuses.joblib"
+    joblib.dump(
+        [
+            fake_status(2, f"@{TARGET_ACCOUNT} b"),
+            fake_status(1, f"@{TARGET_ACCOUNT} a"),
+        ],
+        path,
+    )
+    targets = pd.DataFrame({"id": [TARGET], "account": [TARGET_ACCOUNT]})
+    assert run_replay(path, targets, process) == 2
+    assert inserted == [1, 2]
+
+
+def test_main_backfills_pages_and_resumes_gaps(tmp_path, monkeypatch):
+    """Check if fetches page back with max_id and resume from checkpoints"""
+    import create_database
+
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    monkeypatch.setattr(fetch_tweets, "DB", Database(db_path))
+    monkeypatch.setattr(fetch_tweets, "SEARCH_PAGE_SIZE", 2)
+    monkeypatch.setattr(fetch_tweets, "BACKFILL_MAX_REQUESTS", 2)
+    published = list(range(1, 6))
+    calls = []
+
+    def search_tweets(target_account, since_id, max_id=None, language=None):
+        calls.append((since_id, max_id))
+        ids = [i for i in published if i > since_id and (max_id is None or i <= max_id)]
+        return [fake_status(i, f"@{TARGET_ACCOUNT} {i}") for i in sorted(ids)[::-1][:2]]
+
+    monkeypatch.setattr(fetch_tweets, "search_tweets", search_tweets)
+    conn = sqlite3.connect(db_path)
+
+    fetch_tweets.main(TARGET, TARGET_ACCOUNT)
+    assert calls == [(0, None), (0, 3)]
+    assert conn.execute("SELECT * FROM BACKFILL_GAPS").fetchall() == [(TARGET, 0, 1)]
+
+    published += [6, 7]
+    calls.clear()
+    fetch_tweets.main(TARGET, TARGET_ACCOUNT)
+    assert calls == [(5, None), (5, 5)]
+
+    calls.clear()
+    fetch_tweets.main(TARGET, TARGET_ACCOUNT)
+    assert calls == [(7, None), (0, 1)]
+    assert conn.execute("SELECT * FROM BACKFILL_GAPS").fetchall() == []
+    ids = conn.execute("SELECT TWEET_ID FROM TWEETS ORDER BY TWEET_ID").fetchall()
+    assert ids == [(i,) for i in range(1, 8)]
+
+
+def test_expired_tweets_are_skipped_and_cursors_survive_retention(
+    tmp_path, monkeypatch
+):
+    """Check if old tweets do not recreate dropped days nor reset since_id"""
+    import create_database
+    from partitions import drop_expired_partitions, list_partitions, partition_day
+
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    monkeypatch.setattr(fetch_tweets, "DB", Database(db_path))
+    monkeypatch.setattr(fetch_tweets, "RETENTION_DAYS", 2)
+    monkeypatch.setattr(fetch_tweets, "SEARCH_PAGE_SIZE", 2)
+    now = datetime.utcnow().replace(microsecond=0)
+    created = {3: now, 2: now - pd.Timedelta(days=5), 1: now - pd.Timedelta(days=6)}
+    calls = []
+
+    def search_tweets(target_account, since_id, max_id=None, language=None):
+        calls.append((since_id, max_id))
+        ids = [i for i in (3, 2, 1) if i > since_id and (max_id is None or i <= max_id)]
+        return [
+            fake_status(i, f"@{TARGET_ACCOUNT} {i}", created_at=created[i])
+            for i in ids[:2]
+        ]
+
+    monkeypatch.setattr(fetch_tweets, "search_tweets", search_tweets)
+    fetch_tweets.main(TARGET, TARGET_ACCOUNT)
+    # The page reached an expired day, so older pages are not requested
+    assert calls == [(0, None)]
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT TWEET_ID FROM TWEETS").fetchall() == [(3,)]
+    today = partition_day(
+        fetch_tweets.status_timestamp(SimpleNamespace(created_at=now))
+    )
+    assert list_partitions(conn) == [today]
+    assert conn.execute("SELECT * FROM BACKFILL_GAPS").fetchall() == []
+
+    with conn:
+        drop_expired_partitions(conn, 0, now=(today + 1) * 86400)
+    assert list_partitions(conn) == []
+    assert fetch_tweets.pending_ranges(TARGET) == [(3, None)]
+
+
+class FakeSearchAPI:
+    """Search API with a simulated clock, rate limit and rate of mentions"""
+
+    def __init__(self, clock, tweets_per_minute, limit, window=900):
+        self.clock = clock
+        self.tweets_per_minute = tweets_per_minute
+        self.limit = limit
+        self.window = window
+        self.start = clock()
+        self.window_start = self.start
+        self.requests = 0
+        self.rate_limit_errors = 0
+        self.searches = {account: 0 for account in tweets_per_minute}
+        self.last_response = None
+        self.api = None
+
+    def search(self, q, since_id=None, max_id=None, count="100", **kwargs):
+        now = self.clock()
+        if now >= self.window_start + self.window:
+            self.window_start, self.requests = now, 0
+        self.requests += 1
+        self.last_response = SimpleNamespace(
+            headers={
+                "x-rate-limit-remaining": str(max(0, self.limit - self.requests)),
+                "x-rate-limit-reset": str(self.window_start + self.window),
+            }
+        )
+        if self.requests > self.limit:
+            self.rate_limit_errors += 1
+            raise tweepy.RateLimitError("Rate limit exceeded", self.last_response)
+        account = q.split()[0][len("to:") :]
+        self.searches[account] += 1
+        # Tweet ids are the tenths of second they were published at
+        step = 600 / self.tweets_per_minute[account]
+        newest = int(now * 10 - self.start * 10) if max_id is None else max_id
+        oldest = max(since_id or 0, 0)
+        ids = np.arange(newest // step * step, oldest, -step)[: int(count)]
+        statuses = [
+            fake_status(
+                int(i),
+                f"@{account} hola",
+                created_at=datetime.utcfromtimestamp(self.start + i / 10),
+            )
+            for i in ids
+            if i > oldest
+        ]
+        return statuses, self.last_response
+
+
+def test_scheduler_polls_busy_targets_more_and_respects_quota(tmp_path, monkeypatch):
+    """Check if the fetch loop adapts to each target without exceeding the quota"""
+    import create_database
+
+    now = [1595160000.0]
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    quota = SearchQuota(limit=30, window=900, clock=lambda: now[0])
+    api = FakeSearchAPI(
+        lambda: now[0], {"busy": 100, "quiet": 0.1, "other": 10}, limit=30
+    )
+    monkeypatch.setattr(fetch_tweets, "DB", Database(db_path))
+    monkeypatch.setattr(fetch_tweets, "QUOTA", quota)
+    monkeypatch.setattr(fetch_tweets, "CLIENT", api)
+    targets = pd.DataFrame(
+        {"id": ["busy", "quiet", "other"], "account": ["busy", "quiet", "other"]}
+    )
+    scheduler = Scheduler(
+        targets,
+        quota,
+        fetch_tweets.main,
+        min_interval=30,
+        max_interval=600,
+        max_requests=5,
+        clock=lambda: now[0],
+        sleep=lambda seconds: now.__setitem__(0, now[0] + seconds),
+    )
+    while now[0] < 1595160000 + 3 * 3600:
+        scheduler.run_once()
+        now[0] += 1
+
+    assert api.rate_limit_errors == 0
+    assert api.searches["busy"] > 2 * api.searches["other"]
+    assert api.searches["other"] > api.searches["quiet"]
+    assert scheduler.intervals["quiet"] == 600
+
+
+def test_scheduler_fetches_due_targets_in_parallel():
+    """Check if FETCH_WORKERS>1 fetches each due target once, sharing the quota"""
+    now = [0.0]
+    quota = SearchQuota(limit=40, window=900, clock=lambda: now[0])
+    targets = pd.DataFrame({"id": list("abcd"), "account": list("abcd")})
+    # Every fetch of a cycle waits for the others, so they must run at once
+    barrier = threading.Barrier(len(targets))
+    calls = []
+    reserved = []
+
+    def fetch(target, account, max_requests):
+        barrier.wait(timeout=5)
+        calls.append((target, threading.current_thread().name))
+        # Ask for more than the share of the quota, taking turns with the others
+        reserved.append(sum(quota.take() for _ in range(max_requests + 5)))
+        return 0
+
+    scheduler = Scheduler(
+        targets,
+        quota,
+        fetch,
+        min_interval=30,
+        max_interval=600,
+        max_requests=20,
+        workers=4,
+        clock=lambda: now[0],
+        sleep=lambda seconds: now.__setitem__(0, now[0] + seconds),
+    )
+    assert sorted(scheduler.run_once()) == list("abcd")
+    assert sorted(target for target, _ in calls) == list("abcd")
+    assert len({thread for _, thread in calls}) == 4
+    assert sum(reserved) == 40
+    assert quota.available() == 0
+
+    while len(calls) < 8:
+        scheduler.run_once()
+    assert sorted(target for target, _ in calls[4:]) == list("abcd")
+    assert sum(reserved) == 80
+
+
+def test_rate_limit_error_waits_for_reset(monkeypatch):
+    """Check if a rate limit error makes the scheduler sleep instead of crashing"""
+    now = [0.0]
+    sleeps = []
+    quota = SearchQuota(limit=450, window=900, clock=lambda: now[0])
+    monkeypatch.setattr(fetch_tweets, "QUOTA", quota)
+    monkeypatch.setattr(fetch_tweets, "pending_ranges", lambda target: [(0, None)])
+
+    def search_tweets(target_account, since_id, max_id=None, language=None):
+        response = SimpleNamespace(
+            headers={"x-rate-limit-remaining": "0", "x-rate-limit-reset": "600"}
+        )
+        raise tweepy.RateLimitError("Rate limit exceeded", response)
+
+    monkeypatch.setattr(fetch_tweets, "search_tweets", search_tweets)
+    targets = pd.DataFrame({"id": [TARGET], "account": [TARGET_ACCOUNT]})
+    scheduler = Scheduler(
+        targets,
+        quota,
+        fetch_tweets.main,
+        min_interval=30,
+        max_interval=300,
+        clock=lambda: now[0],
+        sleep=sleeps.append,
+    )
+    assert scheduler.run_once() == [TARGET]
+    assert quota.available() == 0
+    assert scheduler.run_once() == []
+    assert sleeps == [600]
+
+
+def test_targets_build_queries_once_and_reload_on_change(tmp_path):
+    """Check if search queries are built per load and the file is hot-reloaded"""
+    assert search_queries(["a", "b", "c"]) == {
+        "a": "to:a OR (@a -@b -@c)",
+        "b": "to:b OR (@b -@a -@c)",
+        "c": "to:c OR (@c -@a -@b)",
+    }
+    path = tmp_path / "accounts.csv"
+    path.write_text("id,account\na,a_account\n")
+    targets = Targets(path)
+    assert targets.query("a_account") == "to:a_account OR (@a_account)"
+    assert not targets.reload()
+
+    path.write_text("id,account\na,a_account\nb,b_account\n")
+    os.utime(path, (0, 1))
+    assert targets.reload()
+    assert targets.query("a_account") == "to:a_account OR (@a_account -@b_account)"
+
+    scheduler = Scheduler(
+        pd.DataFrame({"id": ["a"], "account": ["a_account"]}),
+        SearchQuota(),
+        lambda target, account, max_requests: 0,
+        min_interval=30,
+        max_interval=300,
+        sleep=lambda seconds: None,
+    )
+    scheduler.run_once()
+    scheduler.set_targets(targets.df)
+    assert scheduler.targets == {"a": "a_account", "b": "b_account"}
+    assert scheduler.intervals == {"a": 60, "b": 30}
+
+    path.write_text("id,account,language\na,a_account,ca\nb,b_account,\n")
+    os.utime(path, (0, 2))
+    targets = Targets(path, default_language="es")
+    assert (targets.language("a"), targets.language("b")) == ("ca", "es")
+
+
+def test_twitter_client_reuses_session_and_parses_statuses():
+    """Check if the search client parses statuses and rate limit errors"""
+    status = {
+        "id": 1,
+        "full_text": "@pablocasado_ hola",
+        "created_at": "Sun Jul 19 12:00:00 +0000 2020",
+        "in_reply_to_screen_name": None,
+        "user": {"screen_name": "user", "created_at": "Fri Jan 01 00:00:00 +0000 2010"},
+    }
+    responses = [
+        SimpleNamespace(
+            status_code=200,
+            headers={"x-rate-limit-remaining": "449"},
+            json=lambda: {"search_metadata": {}, "statuses": [status]},
+        ),
+        SimpleNamespace(
+            status_code=429,
+            headers={},
+            text='{"errors": [{"message": "Rate limit exceeded", "code": 88}]}',
+        ),
+    ]
+    calls = []
+
+    def get(url, params, auth, timeout):
+        calls.append(params)
+        return responses[len(calls) - 1]
+
+    client = TwitterClient(
+        SimpleNamespace(apply_auth=lambda: None), SimpleNamespace(get=get)
+    )
+    results, response = client.search(q="to:pablocasado_", max_id=None)
+    assert calls == [{"q": "to:pablocasado_"}]
+    assert results[0].id == 1 and results[0].author.screen_name == "user"
+    assert response.headers["x-rate-limit-remaining"] == "449"
+    with pytest.raises(tweepy.RateLimitError) as error:
+        client.search(q="to:pablocasado_")
+    assert error.value.response.status_code == 429
@@ -1,35 +1,40 @@
 import logging
 import os
 import time
+from functools import partial
 
+import msgpack
 import numpy as np
 import pandas as pd
-from flask import Flask, Response, request
+from flask import Flask, Response, jsonify, request
 
 import config
 import dataset
 import torch
-import torch.utils.data
-from model import BERTBaseUncased
+from backends import load_backend, model_size
+from batcher import MicroBatcher
+from cache import SentimentCache, model_version
+from registry import LoadedModel, ModelRegistry
 
 app = Flask(__name__)
 
 MODEL = None
+REGISTRY = None
 DEVICE = "cpu"
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 
-def generate_predictions(df):
-    df.reset_index(drop=True, inplace=True)
-    predict_dataset = dataset.BERTDataset(review=df.PROCESSED_TEXT.values)
-    predict_data_loader = torch.utils.data.DataLoader(
-        predict_dataset,
-        batch_size=config.PREDICT_BATCH_SIZE,
-        num_workers=config.NUM_WORKERS,
-    )
-    test_preds = np.zeros(df.shape[0])
+def generate_predictions(texts, model=None, tokenizer=None):
+    # Texts are tokenized in one call and grouped by length, so each batch is
+    # only padded to its longest text. Scores are written back in input order.
+    # The default language's model and tokenizer are used if none are given.
+    if model is None:
+        model = MODEL
+    test_preds = np.zeros(len(texts))
     with torch.no_grad():
-        for bi, d in enumerate(predict_data_loader):
+        for indices, d in dataset.padded_batches(
+            texts, config.PREDICT_BATCH_SIZE, tokenizer
+        ):
             ids = d["ids"]
             token_type_ids = d["token_type_ids"]
             mask = d["mask"]
@@ -37,19 +42,79 @@ def generate_predictions(df):
             ids = ids.to(DEVICE, dtype=torch.long)
             token_type_ids = token_type_ids.to(DEVICE, dtype=torch.long)
             mask = mask.to(DEVICE, dtype=torch.long)
-            preds = MODEL(ids=ids, mask=mask, token_type_ids=token_type_ids)
-            test_preds[
-                bi * config.PREDICT_BATCH_SIZE : (bi + 1) * config.PREDICT_BATCH_SIZE
-            ] = (preds[:, 0].detach().cpu().squeeze().numpy())
+            preds = model(ids=ids, mask=mask, token_type_ids=token_type_ids)
+            test_preds[indices] = preds[:, 0].detach().cpu().numpy()
 
     output = torch.sigmoid(torch.tensor(test_preds)).numpy().ravel()
     return output
 
 
+def load_language_model(language, spec):
+    """Loads the model, tokenizer and scores cache of a language
+
+    Args:
+        language: Language code, e.g., "es"
+        spec: Dictionary with the model's bert_model and input_dir
+
+    Returns:
+        LoadedModel
+    """
+    input_dir = spec["input_dir"]
+    model_path = os.path.join(input_dir, "model.bin")
+    model = load_backend(
+        config.INFERENCE_BACKEND,
+        DEVICE,
+        model_path=model_path,
+        onnx_path=os.path.join(input_dir, "model.onnx"),
+        bert_model=spec["bert_model"],
+    )
+    tokenizer = dataset.load_tokenizer(input_dir)
+    batcher = MicroBatcher(
+        partial(generate_predictions, model=model, tokenizer=tokenizer),
+        max_batch_size=config.BATCH_MAX_SIZE,
+        max_wait=config.BATCH_MAX_WAIT_MS / 1000,
+    )
+    cache = SentimentCache(
+        config.CACHE_PATH,
+        version=model_version(model_path, spec["bert_model"])
+        + f":{config.INFERENCE_BACKEND}",
+        max_size=config.CACHE_MAX_SIZE,
+        ttl=config.CACHE_TTL_HOURS * 3600,
+    )
+    return LoadedModel(model, tokenizer, batcher, cache, size=model_size(model))
+
+
+def score_texts(texts, language=None):
+    """Scores texts, only running the model on the ones that are not cached
+
+    Args:
+        texts: Sequence of processed texts
+        language: Language of the texts, defaults to config.DEFAULT_LANGUAGE
+
+    Returns:
+        Array with one score per text
+    """
+    texts = list(texts)
+    entry = REGISTRY.get(language or config.DEFAULT_LANGUAGE)
+    if entry.cache is None:
+        return entry.batcher.predict(texts)
+    scores = entry.cache.get_many(texts)
+    missing = list(dict.fromkeys(t for t, s in zip(texts, scores) if s is None))
+    if missing:
+        predictions = entry.batcher.predict(missing)
+        entry.cache.set_many(missing, predictions)
+        predicted = dict(zip(missing, predictions))
+        scores = [predicted[t] if s is None else s for t, s in zip(texts, scores)]
+    return np.array(scores, dtype=float)
+
+
 @app.route("/predict")
 def predict():
     data = request.args.get("data")
     account = request.args.get("account")
+    language = request.args.get("language")
+    if language is not None and language not in config.MODELS:
+        return jsonify({"error": f"No model for language {language}"}), 400
     df = pd.read_json(data)
     start_time = time.time()
 
@@ -58,7 +123,9 @@ def predict():
     retweets_frame["SENTIMENT"] = 1.0
 
     tweets_frame = df.loc[~rt_mask, :].copy()
-    tweets_frame["SENTIMENT"] = generate_predictions(tweets_frame)
+    tweets_frame["SENTIMENT"] = score_texts(
+        tweets_frame.PROCESSED_TEXT.values, language
+    )
     output_frame = pd.concat([retweets_frame, tweets_frame], axis=0)
     output_frame.reset_index(drop=True, inplace=True)
 
@@ -66,14 +133,95 @@ def predict():
     return Response(output_frame.to_json(), mimetype="application/json")
 
 
-if __name__ == "__main__":
+@app.route("/score", methods=["POST"])
+def score():
+    """Scores a msgpack body of the form {"texts": [...], "language": "es"}
+
+    The language is optional and defaults to config.DEFAULT_LANGUAGE. Returns
+    one little-endian float32 score per text, in the same order.
+    """
+    # msgpack's unpack errors are ValueErrors, a body that is not a map with a
+    # list of texts raises KeyError or TypeError
+    try:
+        body = msgpack.unpackb(request.get_data(), raw=False)
+        texts = body["texts"]
+        language = body.get("language")
+        if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+            raise TypeError("texts is not a list of strings")
+        if language is not None and not isinstance(language, str):
+            raise TypeError("language is not a string")
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"error": f"Invalid body: {e}"}), 400
+    if language is not None and language not in config.MODELS:
+        return jsonify({"error": f"No model for language {language}"}), 400
+    scores = score_texts(texts, language).astype("<f4")
+    return Response(scores.tobytes(), mimetype="application/octet-stream")
+
+
+@app.route("/health")
+def health():
+    return jsonify({"status": "ok"})
+
+
+@app.route("/ready")
+def ready():
+    if MODEL is None:
+        return jsonify({"status": "loading"}), 503
+    return jsonify(
+        {
+            "status": "ready",
+            "backend": config.INFERENCE_BACKEND,
+            "languages": sorted(config.MODELS),
+            "loaded": {
+                language: round(entry.size / 2**20)
+                for language, entry in REGISTRY.loaded().items()
+            },
+        }
+    )
+
+
+@app.route("/cache/stats")
+def cache_stats():
+    if REGISTRY is None:
+        return jsonify({})
+    return jsonify(
+        {
+            language: entry.cache.stats() if entry.cache is not None else {}
+            for language, entry in REGISTRY.loaded().items()
+        }
+    )
+
+
+def load_model():
+    """Creates the model registry and loads the default language's model
+
+    Models of other languages are loaded on their first request and unloaded
+    when idle or above the memory budget.
+    """
+    global MODEL, REGISTRY
+    REGISTRY = ModelRegistry(
+        config.MODELS,
+        load_language_model,
+        memory_budget=config.MODEL_MEMORY_BUDGET_MB * 2**20,
+        idle_seconds=config.MODEL_IDLE_MINUTES * 60,
+        pinned=[config.DEFAULT_LANGUAGE],
+    )
+    MODEL = REGISTRY.get(config.DEFAULT_LANGUAGE).model
+
+
+def create_app():
+    """App factory for WSGI servers (e.g., gunicorn "app:create_app()")
+
+    With gunicorn's preload_app, the model is loaded once in the master process
+    and its weights are shared copy-on-write by the forked workers.
+    """
     logging.basicConfig(
         filename="./logs/sentiment_app.log", filemode="w", level=logging.DEBUG
     )
-    MODEL = BERTBaseUncased()
-    MODEL.to(DEVICE)
-    MODEL.load_state_dict(
-        torch.load(config.MODEL_PATH, map_location=torch.device(DEVICE))
-    )
-    MODEL.eval()
-    app.run(host="0.0.0.0", port=5000)
+    load_model()
+    return app
+
+
+if __name__ == "__main__":
+    create_app()
+    app.run(host="0.0.0.0", port=5000, threaded=True)
@@ -0,0 +1,146 @@
+import logging
+import os
+
+import numpy as np
+
+import config
+import torch
+import torch.nn as nn
+from model import BERTBaseUncased
+
+BACKENDS = ("torch", "quantized", "onnx")
+
+
+def load_torch_model(
+    device="cpu", model_path=config.MODEL_PATH, bert_model=config.BERT_MODEL
+):
+    """Loads the full precision model with the parameters in model_path"""
+    model = BERTBaseUncased(bert_model)
+    model.to(device)
+    model.load_state_dict(torch.load(model_path, map_location=torch.device(device)))
+    model.eval()
+    return model
+
+
+def quantize_model(model):
+    """Quantizes the weights of the linear layers to int8"""
+    return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def export_onnx(model, onnx_path):
+    """Exports the model to ONNX with dynamic batch size and sequence length"""
+    dummy = torch.ones((1, 8), dtype=torch.long)
+    dynamic_axes = {0: "batch", 1: "sequence"}
+    torch.onnx.export(
+        model,
+        (dummy, dummy, torch.zeros_like(dummy)),
+        onnx_path,
+        input_names=["ids", "mask", "token_type_ids"],
+        output_names=["output"],
+        dynamic_axes={
+            "ids": dynamic_axes,
+            "mask": dynamic_axes,
+            "token_type_ids": dynamic_axes,
+            "output": {0: "batch"},
+        },
+        opset_version=11,
+    )
+
+
+class OnnxModel:
+    """ONNX Runtime session with the same call signature as BERTBaseUncased
+
+    The session (and its thread pool) is created on first use in each process,
+    so the model can be loaded before forking server workers.
+    """
+
+    def __init__(self, onnx_path, num_threads=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError(
+                "The onnx backend requires onnxruntime: pip install onnxruntime"
+            )
+        self.onnxruntime = onnxruntime
+        self.onnx_path = str(onnx_path)
+        self.num_threads = num_threads
+        self._session = None
+        self._session_pid = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session_pid != os.getpid():
+            options = self.onnxruntime.SessionOptions()
+            options.graph_optimization_level = (
+                self.onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            )
+            options.intra_op_num_threads = self.num_threads or torch.get_num_threads()
+            self._session = self.onnxruntime.InferenceSession(self.onnx_path, options)
+            self._session_pid = os.getpid()
+        return self._session
+
+    def __call__(self, ids, mask, token_type_ids):
+        (output,) = self.session.run(
+            ["output"],
+            {
+                "ids": ids.numpy().astype(np.int64),
+                "mask": mask.numpy().astype(np.int64),
+                "token_type_ids": token_type_ids.numpy().astype(np.int64),
+            },
+        )
+        return torch.from_numpy(output)
+
+
+def load_backend(
+    name,
+    device="cpu",
+    model_path=config.MODEL_PATH,
+    onnx_path=config.ONNX_PATH,
+    bert_model=config.BERT_MODEL,
+):
+    """Loads the model used for inference
+
+    Args:
+        name: One of "torch" (full precision), "quantized" (dynamic int8) or
+            "onnx" (ONNX Runtime graph exported from model.bin)
+        device: Device of the PyTorch model
+        model_path: File with the fine-tuned parameters
+        onnx_path: File where the ONNX graph is exported
+        bert_model: Pretrained BERT weights the model was fine-tuned from
+
+    Returns:
+        Callable with the same signature as BERTBaseUncased.forward
+    """
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown inference backend {name}, expected one of {BACKENDS}"
+        )
+    model = load_torch_model(device, model_path, bert_model)
+    if name == "quantized":
+        return quantize_model(model)
+    if name == "onnx":
+        model_mtime = os.path.getmtime(model_path)
+        if not os.path.isfile(onnx_path) or os.path.getmtime(onnx_path) < model_mtime:
+            logging.info(f"Exporting {model_path} to {onnx_path}")
+            export_onnx(model, onnx_path)
+        return OnnxModel(onnx_path)
+    return model
+
+
+def model_size(model):
+    """Approximates the memory used by a loaded model, in bytes
+
+    PyTorch models are measured by their parameters and buffers, including
+    the packed weights of quantized layers, and ONNX models by their file.
+    """
+    if isinstance(model, OnnxModel):
+        return os.path.getsize(model.onnx_path)
+    size = 0
+    values = list(model.state_dict().values())
+    while values:
+        value = values.pop()
+        if isinstance(value, (tuple, list)):
+            values.extend(value)
+        elif torch.is_tensor(value):
+            size += value.numel() * value.element_size()
+    return size
@@ -0,0 +1,114 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Merges texts sent by concurrent requests into shared model batches
+
+    Requests are queued by submit() and a background thread scores them together
+    as soon as max_batch_size texts are waiting or the oldest request has waited
+    max_wait seconds. Each caller gets back the scores of its own texts.
+    """
+
+    def __init__(self, predict_fn, max_batch_size, max_wait):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+    def submit(self, texts):
+        """Queues texts for scoring
+
+        Args:
+            texts: Sequence of processed texts
+
+        Returns:
+            Future that resolves to an array with one score per text
+        """
+        future = Future()
+        texts = list(texts)
+        if not texts:
+            future.set_result(np.zeros(0))
+            return future
+        with self._lock:
+            self._ensure_worker()
+            self._queue.put((texts, future))
+        return future
+
+    def predict(self, texts, timeout=None):
+        """Scores texts, blocking until their batch has been processed"""
+        return self.submit(texts).result(timeout)
+
+    def close(self):
+        """Stops the worker once the texts already queued have been scored
+
+        The worker holds a reference to predict_fn (and its model), so it must
+        stop for the model to be freed. Later calls to submit() start a new one.
+        """
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid():
+                self._queue.put(None)
+            self._worker = None
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so start the worker lazily in the
+        # process that actually serves requests. Called with the lock held.
+        if self._worker is None or self._worker_pid != os.getpid():
+            self._queue = Queue()
+            self._worker = threading.Thread(
+                target=self._run, args=(self._queue,), name="micro-batcher", daemon=True
+            )
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _collect_batch(self, queue):
+        # Returns the batch and whether close() was called
+        item = queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        size = len(item[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = queue.get(timeout=remaining)
+            except Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            size += len(item[0])
+        return batch, False
+
+    def _run(self, queue):
+        closed = False
+        while not closed:
+            batch, closed = self._collect_batch(queue)
+            if not batch:
+                continue
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            logging.debug(f"Scoring {len(texts)} texts from {len(batch)} requests")
+            try:
+                scores = self.predict_fn(texts)
+            except Exception as e:
+                logging.exception("Could not score batch")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for item_texts, future in batch:
+                end = start + len(item_texts)
+                future.set_result(scores[start:end])
+                start = end
@@ -0,0 +1,140 @@
+import argparse
+import time
+
+import numpy as np
+
+import app
+import config
+import torch
+import torch.utils.data
+from model import BERTBaseUncased
+
+# DataLoader processes of the previous implementation
+NUM_WORKERS = 4
+WORDS = (
+    "el gobierno presidente españa votos partido congreso ley gracias nunca "
+    "vergüenza mentira apoyo sánchez casado todos gente país pandemia medidas"
+).split()
+
+
+def sample_tweets(n_tweets, seed=42):
+    """Generates texts with a length distribution similar to processed tweets
+
+    Most tweets are short replies (median of ~15 words), with a long tail up
+    to the 280 characters limit.
+    """
+    rng = np.random.default_rng(seed)
+    n_words = np.clip(rng.lognormal(mean=2.7, sigma=0.6, size=n_tweets), 1, 55)
+    texts = []
+    for length in n_words.astype(int):
+        text = " ".join(rng.choice(WORDS, size=length))
+        texts.append(text[:280])
+    return texts
+
+
+class BERTDataset:
+    """Previous dataset: tokenizes one text per item, padded to config.MAX_LEN"""
+
+    def __init__(self, review):
+        self.review = review
+        self.tokenizer = config.TOKENIZER
+        self.max_len = config.MAX_LEN
+
+    def __len__(self):
+        return len(self.review)
+
+    def __getitem__(self, item):
+        review = str(self.review[item])
+        review = " ".join(review.split())
+
+        inputs = self.tokenizer.encode_plus(
+            review,
+            None,
+            add_special_tokens=True,
+            max_length=self.max_len,
+            pad_to_max_length=True,
+            truncation=True,
+        )
+
+        return {
+            "ids": torch.tensor(inputs["input_ids"], dtype=torch.long),
+            "mask": torch.tensor(inputs["attention_mask"], dtype=torch.long),
+            "token_type_ids": torch.tensor(inputs["token_type_ids"], dtype=torch.long),
+        }
+
+
+def predict_fixed_padding(texts):
+    """Previous implementation: per-item tokenization, padded to config.MAX_LEN"""
+    predict_dataset = BERTDataset(review=texts)
+    predict_data_loader = torch.utils.data.DataLoader(
+        predict_dataset,
+        batch_size=config.PREDICT_BATCH_SIZE,
+        num_workers=NUM_WORKERS,
+    )
+    test_preds = np.zeros(len(texts))
+    with torch.no_grad():
+        for bi, d in enumerate(predict_data_loader):
+            preds = app.MODEL(
+                ids=d["ids"], mask=d["mask"], token_type_ids=d["token_type_ids"]
+            )
+            test_preds[
+                bi * config.PREDICT_BATCH_SIZE : (bi + 1) * config.PREDICT_BATCH_SIZE
+            ] = (preds[:, 0].detach().cpu().squeeze().numpy())
+    return torch.sigmoid(torch.tensor(test_preds)).numpy().ravel()
+
+
+def time_predictions(predict_fn, texts, repeats):
+    """Returns the best time out of several runs and the last predictions"""
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        preds = predict_fn(texts)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), preds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sentiment predictions")
+    parser.add_argument("--tweets", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--random-weights",
+        action="store_true",
+        help="Skip loading config.MODEL_PATH (timings do not depend on weights)",
+    )
+    args = parser.parse_args()
+
+    app.MODEL = BERTBaseUncased()
+    if not args.random_weights:
+        app.MODEL.load_state_dict(
+            torch.load(config.MODEL_PATH, map_location=torch.device(app.DEVICE))
+        )
+    app.MODEL.eval()
+
+    texts = sample_tweets(args.tweets)
+    lengths = [len(config.TOKENIZER.encode(text)) for text in texts]
+    print(
+        f"{len(texts)} tweets, tokens per tweet: median={np.median(lengths):.0f} "
+        f"p95={np.percentile(lengths, 95):.0f} max={max(lengths)}"
+    )
+
+    fixed_time, fixed_preds = time_predictions(
+        predict_fixed_padding, texts, args.repeats
+    )
+    dynamic_time, dynamic_preds = time_predictions(
+        app.generate_predictions, texts, args.repeats
+    )
+    print(
+        f"Per-item tokenization, fixed padding: {fixed_time:.2f}s "
+        f"({len(texts) / fixed_time:.1f} tweets/s)"
+    )
+    print(
+        f"Batched tokenization, dynamic padding: {dynamic_time:.2f}s "
+        f"({len(texts) / dynamic_time:.1f} tweets/s)"
+    )
+    print(f"Speedup: {fixed_time / dynamic_time:.1f}x")
+    print(f"Max score difference: {np.abs(fixed_preds - dynamic_preds).max():.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+SQLITE_MAX_VARIABLES = 500
+# Fraction of max_size freed when the cache is full, so the rows are only
+# counted again after that many inserts
+EVICTION_FRACTION = 0.1
+# Hits whose access time is kept in memory before writing them without an insert
+MAX_PENDING_ACCESSES = 10000
+
+
+def model_version(model_path, name):
+    """Identifies a version of the model using its name and learned parameters file
+
+    Replacing model.bin changes its size and modification time, so scores cached
+    for the previous parameters are not reused.
+    """
+    try:
+        stat = os.stat(model_path)
+        return f"{name}:{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        return name
+
+
+class SentimentCache:
+    """Bounded SQLite cache of sentiment scores that survives restarts
+
+    Scores are keyed by a hash of the model version and the processed text.
+    Entries older than ttl seconds are ignored and, when there are more than
+    max_size entries, the expired and least recently used ones are evicted
+    until a tenth of the cache is free. The models of every language share the
+    table, so max_size bounds their entries together.
+
+    Lookups only read the database: the access times of hits are kept in
+    memory and written along with the next insert, so hits from every worker
+    do not wait for the write lock.
+    """
+
+    def __init__(self, path, version, max_size, ttl):
+        self.path = str(path)
+        self.version = version
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._size = 0
+        self._accessed = {}
+        self._connect()
+
+    def _connect(self):
+        # SQLite connections must not be shared with forked processes, so each
+        # process opens its own
+        if self._conn is not None and self._conn_pid == os.getpid():
+            return self._conn
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn_pid = os.getpid()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS SENTIMENT_CACHE (
+                KEY BLOB PRIMARY KEY,
+                SCORE REAL NOT NULL,
+                CREATED REAL NOT NULL,
+                LAST_ACCESS REAL NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS IDX_SENTIMENT_CACHE_ACCESS
+            ON SENTIMENT_CACHE(LAST_ACCESS)
+            """
+        )
+        self._conn.commit()
+        self._size = self._conn.execute(
+            "SELECT COUNT(*) FROM SENTIMENT_CACHE"
+        ).fetchone()[0]
+        return self._conn
+
+    def _key(self, text):
+        return hashlib.sha1(f"{self.version}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, texts):
+        """Looks up cached scores
+
+        Args:
+            texts: Sequence of processed texts
+
+        Returns:
+            List with the cached score of each text or None if it is not cached
+        """
+        keys = [self._key(text) for text in texts]
+        now = time.time()
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                chunk = keys[start : start + SQLITE_MAX_VARIABLES]
+                rows = conn.execute(
+                    f"""
+                    SELECT KEY, SCORE FROM SENTIMENT_CACHE
+                    WHERE KEY IN ({",".join("?" * len(chunk))}) AND CREATED >= ?
+                    """,
+                    (*chunk, now - self.ttl),
+                )
+                found.update(rows)
+            self._accessed.update(dict.fromkeys(found, now))
+            if len(self._accessed) >= MAX_PENDING_ACCESSES:
+                self._write_accesses(conn)
+                conn.commit()
+            scores = [found.get(key) for key in keys]
+            hits = sum(score is not None for score in scores)
+            self.hits += hits
+            self.misses += len(scores) - hits
+        return scores
+
+    def set_many(self, texts, scores):
+        """Stores scores and evicts the entries that do not fit in the cache"""
+        now = time.time()
+        rows = [
+            (self._key(text), float(score), now, now)
+            for text, score in zip(texts, scores)
+        ]
+        with self._lock:
+            conn = self._connect()
+            self._write_accesses(conn)
+            conn.executemany(
+                "INSERT OR REPLACE INTO SENTIMENT_CACHE VALUES (?, ?, ?, ?)", rows
+            )
+            # Replaced rows are counted as new, so the size is an upper bound
+            # until _evict counts the rows
+            self._size += len(rows)
+            if self._size > self.max_size:
+                self._evict(conn, now)
+            conn.commit()
+
+    def _write_accesses(self, conn):
+        conn.executemany(
+            "UPDATE SENTIMENT_CACHE SET LAST_ACCESS = ? WHERE KEY = ?",
+            ((now, key) for key, now in self._accessed.items()),
+        )
+        self._accessed = {}
+
+    def _evict(self, conn, now):
+        conn.execute(
+            "DELETE FROM SENTIMENT_CACHE WHERE CREATED < ?", (now - self.ttl,)
+        )
+        self._size = conn.execute("SELECT COUNT(*) FROM SENTIMENT_CACHE").fetchone()[0]
+        if self._size > self.max_size:
+            excess = self._size - self.max_size + int(self.max_size * EVICTION_FRACTION)
+            conn.execute(
+                """
+                DELETE FROM SENTIMENT_CACHE WHERE KEY IN (
+                    SELECT KEY FROM SENTIMENT_CACHE ORDER BY LAST_ACCESS LIMIT ?
+                )
+                """,
+                (excess,),
+            )
+            self._size -= excess
+
+    def stats(self):
+        """Returns hit and miss counters of this process and the cache size"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": self._size}
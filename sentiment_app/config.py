@@ -1,10 +1,31 @@
+import json
+import os
+
 import transformers
 
 MAX_LEN = 256
 PREDICT_BATCH_SIZE = 32
-NUM_WORKERS = 4
+INTRA_OP_THREADS = int(os.getenv("INTRA_OP_THREADS", "0"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "128"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "20"))
+CACHE_PATH = os.getenv("SENTIMENT_CACHE_PATH", "../data/sentiment_cache.db")
+CACHE_MAX_SIZE = int(os.getenv("SENTIMENT_CACHE_MAX_SIZE", "200000"))
+CACHE_TTL_HOURS = float(os.getenv("SENTIMENT_CACHE_TTL_HOURS", "72"))
 MODEL_PATH = "./input/model.bin"
+ONNX_PATH = "./input/model.onnx"
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
 BERT_MODEL = "dccuchile/bert-base-spanish-wwm-uncased"
+# Model of each language: the pretrained BERT weights it was fine-tuned from and
+# the directory with its model.bin and tokenizer files. More languages can be
+# added with a JSON object, e.g., {"en": {"bert_model": "bert-base-uncased",
+# "input_dir": "./input/en/"}}
+MODELS = {
+    "es": {"bert_model": BERT_MODEL, "input_dir": "./input/"},
+    **json.loads(os.getenv("SENTIMENT_MODELS", "{}")),
+}
+DEFAULT_LANGUAGE = os.getenv("DEFAULT_LANGUAGE", "es")
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+MODEL_IDLE_MINUTES = float(os.getenv("MODEL_IDLE_MINUTES", "60"))
 TOKENIZER = transformers.BertTokenizerFast.from_pretrained(
     "./input/", do_lower_case=True, truncation=True
 )
@@ -1,39 +1,65 @@
 import config
+import numpy as np
 import torch
+import transformers
 
 
-class BERTDataset:
-    def __init__(self, review, target=None):
-        self.review = review
-        self.target = target
-        self.tokenizer = config.TOKENIZER
-        self.max_len = config.MAX_LEN
-
-    def __len__(self):
-        return len(self.review)
-
-    def __getitem__(self, item):
-        review = str(self.review[item])
-        review = " ".join(review.split())
-
-        inputs = self.tokenizer.encode_plus(
-            review,
-            None,
-            add_special_tokens=True,
-            max_length=self.max_len,
-            pad_to_max_length=True,
-            truncation=True,
-        )
-
-        ids = inputs["input_ids"]
-        mask = inputs["attention_mask"]
-        token_type_ids = inputs["token_type_ids"]
-
-        output = {
-            "ids": torch.tensor(ids, dtype=torch.long),
-            "mask": torch.tensor(mask, dtype=torch.long),
-            "token_type_ids": torch.tensor(token_type_ids, dtype=torch.long),
+def load_tokenizer(input_dir):
+    """Loads the fast tokenizer saved in a model's directory"""
+    return transformers.BertTokenizerFast.from_pretrained(
+        input_dir, do_lower_case=True, truncation=True
+    )
+
+
+def tokenize_batch(texts, tokenizer=None):
+    """Tokenizes all texts with a single call to the fast tokenizer"""
+    if tokenizer is None:
+        tokenizer = config.TOKENIZER
+    reviews = [" ".join(str(text).split()) for text in texts]
+    return tokenizer(
+        reviews,
+        add_special_tokens=True,
+        max_length=config.MAX_LEN,
+        truncation=True,
+        return_attention_mask=False,
+        return_token_type_ids=True,
+    )
+
+
+def padded_batches(texts, batch_size, tokenizer=None):
+    """Yields batches of texts of similar length, padded to their longest text
+
+    Args:
+        texts: Sequence of processed texts
+        batch_size: Maximum number of texts per batch
+        tokenizer: Tokenizer of the model, defaults to config.TOKENIZER
+
+    Yields:
+        Positions of the batch's texts in the input and a dictionary of tensors
+    """
+    if len(texts) == 0:
+        return
+    if tokenizer is None:
+        tokenizer = config.TOKENIZER
+    encodings = tokenize_batch(texts, tokenizer)
+    input_ids = encodings["input_ids"]
+    token_type_ids = encodings["token_type_ids"]
+    lengths = np.fromiter((len(ids) for ids in input_ids), dtype=np.int64)
+    order = np.argsort(lengths, kind="stable")
+    pad_token_id = tokenizer.pad_token_id
+    for start in range(0, len(order), batch_size):
+        indices = order[start : start + batch_size]
+        max_len = lengths[indices].max()
+        ids = np.full((len(indices), max_len), pad_token_id, dtype=np.int64)
+        mask = np.zeros((len(indices), max_len), dtype=np.int64)
+        types = np.zeros((len(indices), max_len), dtype=np.int64)
+        for row, item in enumerate(indices):
+            length = lengths[item]
+            ids[row, :length] = input_ids[item]
+            mask[row, :length] = 1
+            types[row, :length] = token_type_ids[item]
+        yield indices, {
+            "ids": torch.from_numpy(ids),
+            "mask": torch.from_numpy(mask),
+            "token_type_ids": torch.from_numpy(types),
         }
-        if self.target:
-            output["targets"] = torch.tensor(self.target[item], dtype=torch.float)
-        return output
@@ -0,0 +1,20 @@
+import os
+
+import config
+
+bind = "0.0.0.0:5000"
+workers = int(os.getenv("SENTIMENT_WORKERS", "2"))
+# Request threads per worker, concurrent requests are merged by the micro-batcher
+threads = int(os.getenv("SENTIMENT_THREADS", "4"))
+worker_class = "gthread"
+timeout = 120
+# Load the model once in the master, workers share its weights copy-on-write
+preload_app = True
+
+
+def post_fork(server, worker):
+    import torch
+
+    intra_op_threads = config.INTRA_OP_THREADS or max(1, os.cpu_count() // workers)
+    torch.set_num_threads(intra_op_threads)
+    server.log.info(f"Worker {worker.pid} uses {intra_op_threads} intra-op threads")
@@ -4,14 +4,14 @@ import torch.nn as nn
 
 
 class BERTBaseUncased(nn.Module):
-    def __init__(self):
+    def __init__(self, bert_model=config.BERT_MODEL):
         super(BERTBaseUncased, self).__init__()
-        self.bert = transformers.BertModel.from_pretrained(config.BERT_MODEL)
+        self.bert = transformers.BertModel.from_pretrained(bert_model)
         self.bert_drop = nn.Dropout(0.2)
         self.out = nn.Linear(768, 1)
 
     def forward(self, ids, mask, token_type_ids):
-        _, o2 = self.bert(ids, attention_mask=mask, token_type_ids=token_type_ids)
+        o2 = self.bert(ids, attention_mask=mask, token_type_ids=token_type_ids)[1]
         bo = self.bert_drop(o2)
         output = self.out(bo)
         return output
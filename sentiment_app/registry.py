@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+
+
+class LoadedModel:
+    """A model in memory with everything needed to score texts with it
+
+    Args:
+        model: Callable with the same signature as BERTBaseUncased.forward
+        tokenizer: Tokenizer of the model
+        batcher: MicroBatcher that runs the model
+        cache: SentimentCache of the model's scores, or None
+        size: Approximate bytes of memory used by the model
+    """
+
+    def __init__(self, model, tokenizer, batcher, cache=None, size=0):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batcher = batcher
+        self.cache = cache
+        self.size = size
+        self.last_used = None
+
+    def close(self):
+        """Stops the batcher, so the model can be freed"""
+        self.batcher.close()
+
+
+class ModelRegistry:
+    """Sentiment models keyed by language, loaded the first time they are used
+
+    When the loaded models take more than memory_budget bytes, the least
+    recently used ones are unloaded, as are the models that were not used for
+    idle_seconds. Pinned models (e.g., the default language, loaded before
+    forking the server workers) are never unloaded.
+
+    Args:
+        specs: Dictionary of language to the settings of its model
+        load: Function called as load(language, spec) that returns a LoadedModel
+        memory_budget: Maximum bytes of loaded models, 0 for no limit
+        idle_seconds: Seconds an unused model is kept, 0 to keep it forever
+        pinned: Languages that are never unloaded
+        clock: Function that returns the current time in seconds
+    """
+
+    def __init__(
+        self,
+        specs,
+        load,
+        memory_budget=0,
+        idle_seconds=0,
+        pinned=(),
+        clock=time.monotonic,
+    ):
+        self.specs = specs
+        self.load = load
+        self.memory_budget = memory_budget
+        self.idle_seconds = idle_seconds
+        self.pinned = set(pinned)
+        self.clock = clock
+        self._models = {}
+        self._lock = threading.Lock()
+        self._load_locks = {language: threading.Lock() for language in specs}
+
+    def get(self, language):
+        """Returns the model of a language, loading it if needed
+
+        Args:
+            language: Language code, e.g., "es"
+
+        Returns:
+            LoadedModel
+        """
+        if language not in self.specs:
+            raise KeyError(f"No sentiment model for language {language}")
+        # Loading takes a while, so only requests for the same language wait
+        with self._load_locks[language]:
+            with self._lock:
+                entry = self._models.get(language)
+            if entry is None:
+                logging.info(f"Loading the sentiment model of {language}")
+                entry = self.load(language, self.specs[language])
+            with self._lock:
+                entry.last_used = self.clock()
+                self._models[language] = entry
+                self._evict(keep=language)
+        return entry
+
+    def evict_idle(self):
+        """Unloads the models that were not used for idle_seconds"""
+        with self._lock:
+            self._evict()
+
+    def loaded(self):
+        """Returns a dictionary of the loaded languages to their LoadedModel"""
+        with self._lock:
+            return dict(self._models)
+
+    def _evict(self, keep=None):
+        now = self.clock()
+        evictable = sorted(
+            (
+                language
+                for language in self._models
+                if language != keep and language not in self.pinned
+            ),
+            key=lambda language: self._models[language].last_used,
+        )
+        total = sum(entry.size for entry in self._models.values())
+        for language in evictable:
+            entry = self._models[language]
+            idle = self.idle_seconds and now - entry.last_used >= self.idle_seconds
+            over_budget = self.memory_budget and total > self.memory_budget
+            if not (idle or over_budget):
+                continue
+            logging.info(f"Unloading the sentiment model of {language}")
+            del self._models[language]
+            entry.close()
+            total -= entry.size
@@ -0,0 +1,357 @@
+import importlib.util
+import os
+import threading
+from types import SimpleNamespace
+
+import msgpack
+import numpy as np
+import pytest
+import torch
+import transformers
+from batcher import MicroBatcher
+from cache import SentimentCache
+from registry import LoadedModel, ModelRegistry
+
+VOCAB = "[PAD] [UNK] [CLS] [SEP] [MASK] el la de gobierno ley votos gracias nunca"
+TEXTS = ["el gobierno", "gracias", "nunca la ley de el gobierno", "votos"]
+
+
+def import_app_module(name):
+    """Imports a module of the app, which loads the tokenizer in ./input/"""
+    try:
+        return importlib.import_module(name)
+    except OSError:
+        pytest.skip("The tokenizer files are not downloaded to ./input/")
+
+
+class WordTokenizer:
+    """Tokenizer stub with one token per word plus [CLS] and [SEP]"""
+
+    pad_token_id = 0
+
+    def __call__(self, texts, **kwargs):
+        input_ids = [[2] + [5] * len(text.split()) + [3] for text in texts]
+        return {
+            "input_ids": input_ids,
+            "token_type_ids": [[0] * len(ids) for ids in input_ids],
+        }
+
+
+@pytest.fixture
+def tiny_bert(tmp_path):
+    """Saves a one-layer BERT with random weights, its vocabulary and model.bin"""
+    model = import_app_module("model")
+    bert_config = transformers.BertConfig(
+        vocab_size=len(VOCAB.split()),
+        hidden_size=768,
+        num_hidden_layers=1,
+        num_attention_heads=12,
+        intermediate_size=32,
+        max_position_embeddings=64,
+    )
+    torch.manual_seed(0)
+    transformers.BertModel(bert_config).save_pretrained(tmp_path)
+    (tmp_path / "vocab.txt").write_text("\n".join(VOCAB.split()))
+    torch.save(
+        model.BERTBaseUncased(str(tmp_path)).state_dict(), tmp_path / "model.bin"
+    )
+    return tmp_path
+
+
+@pytest.fixture
+def app_module(monkeypatch):
+    """The Flask app module with no model loaded"""
+    app = import_app_module("app")
+    monkeypatch.setattr(app, "MODEL", None)
+    monkeypatch.setattr(app, "REGISTRY", None)
+    return app
+
+
+def register_models(monkeypatch, app):
+    """Loads the default language with a model that scores texts by length"""
+
+    def load(language, spec):
+        batcher = MicroBatcher(
+            lambda texts: np.array([len(text) / 100 for text in texts]), 10, 0
+        )
+        return LoadedModel(language, None, batcher, size=2**20)
+
+    config = import_app_module("config")
+    registry = ModelRegistry(config.MODELS, load, pinned=[config.DEFAULT_LANGUAGE])
+    monkeypatch.setattr(app, "REGISTRY", registry)
+    monkeypatch.setattr(app, "MODEL", registry.get(config.DEFAULT_LANGUAGE).model)
+
+
+def test_micro_batcher_merges_concurrent_requests():
+    """Check if texts sent at the same time are scored in one batch"""
+    batch_sizes = []
+
+    def predict_fn(texts):
+        batch_sizes.append(len(texts))
+        return np.array([float(len(text)) for text in texts])
+
+    batcher = MicroBatcher(predict_fn, max_batch_size=100, max_wait=0.2)
+    requests = [["a" * i, "b" * (i + 1)] for i in range(5)]
+    results = [None] * len(requests)
+
+    def call(i):
+        results[i] = batcher.predict(requests[i], timeout=5)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(batch_sizes) == 10
+    assert len(batch_sizes) < len(requests)
+    for texts, scores in zip(requests, results):
+        assert list(scores) == [float(len(text)) for text in texts]
+
+
+def test_micro_batcher_flushes_when_batch_is_full():
+    """Check if a full batch is scored without waiting for the deadline"""
+    batcher = MicroBatcher(lambda texts: np.ones(len(texts)), 2, max_wait=60)
+    assert list(batcher.predict(["a", "b"], timeout=5)) == [1.0, 1.0]
+    assert len(batcher.predict([], timeout=5)) == 0
+
+
+def test_sentiment_cache_survives_restarts(tmp_path):
+    """Check if cached scores are kept in disk and counted as hits"""
+    cache = SentimentCache(tmp_path / "cache.db", "v1", max_size=10, ttl=3600)
+    assert cache.get_many(["hola", "adios"]) == [None, None]
+    cache.set_many(["hola", "adios"], [0.25, 0.75])
+
+    cache = SentimentCache(tmp_path / "cache.db", "v1", max_size=10, ttl=3600)
+    assert cache.get_many(["adios", "hola", "otro"]) == [0.75, 0.25, None]
+    assert cache.stats() == {"hits": 2, "misses": 1, "size": 2}
+
+    other_model = SentimentCache(tmp_path / "cache.db", "v2", max_size=10, ttl=3600)
+    assert other_model.get_many(["hola"]) == [None]
+
+
+def test_sentiment_cache_evicts_least_recently_used(tmp_path):
+    """Check if the cache keeps at most max_size entries"""
+    cache = SentimentCache(tmp_path / "cache.db", "v1", max_size=2, ttl=3600)
+    cache.set_many(["a"], [0.1])
+    cache.set_many(["b"], [0.2])
+    cache.get_many(["a"])
+    cache.set_many(["c"], [0.3])
+    assert cache.get_many(["a", "b", "c"]) == [0.1, None, 0.3]
+
+    expired = SentimentCache(tmp_path / "cache.db", "v1", max_size=2, ttl=0)
+    assert expired.get_many(["a"]) == [None]
+
+
+
+def test_sentiment_cache_hits_do_not_write(tmp_path):
+    """Check if lookups only read and access times are written with inserts"""
+    cache = SentimentCache(tmp_path / "cache.db", "v1", max_size=10, ttl=3600)
+    cache.set_many(["a", "b"], [0.1, 0.2])
+    changes = cache._conn.total_changes
+    assert cache.get_many(["a", "b", "c"]) == [0.1, 0.2, None]
+    assert cache._conn.total_changes == changes
+
+    cache.set_many(["c"], [0.3])
+    assert cache._conn.total_changes == changes + 3
+
+def test_micro_batcher_close_scores_queued_texts():
+    """Check if closing a batcher scores what was queued and stops its worker"""
+    batcher = MicroBatcher(lambda texts: np.ones(len(texts)), 100, max_wait=0.05)
+    future = batcher.submit(["a", "b"])
+    worker = batcher._worker
+    batcher.close()
+    assert list(future.result(timeout=5)) == [1.0, 1.0]
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert list(batcher.predict(["c"], timeout=5)) == [1.0]
+
+
+def test_model_registry_loads_lazily_and_evicts():
+    """Check if models are loaded on first use and unloaded when idle or too big"""
+    now = [0.0]
+    loads = []
+
+    def load(language, spec):
+        loads.append(language)
+        batcher = MicroBatcher(lambda texts: np.zeros(len(texts)), 10, max_wait=0)
+        return LoadedModel(spec["model"], None, batcher, size=spec["size"])
+
+    specs = {
+        "es": {"model": "beto", "size": 400},
+        "en": {"model": "bert", "size": 400},
+        "ca": {"model": "berta", "size": 400},
+    }
+    registry = ModelRegistry(
+        specs,
+        load,
+        memory_budget=1000,
+        idle_seconds=600,
+        pinned=["es"],
+        clock=lambda: now[0],
+    )
+    assert registry.get("es").model == "beto"
+    assert loads == ["es"]
+
+    now[0] += 10
+    assert registry.get("en").model == "bert"
+    assert registry.get("en").model == "bert"
+    assert loads == ["es", "en"]
+
+    # Over the budget: the least recently used model that is not pinned goes
+    now[0] += 10
+    registry.get("ca")
+    assert sorted(registry.loaded()) == ["ca", "es"]
+
+    now[0] += 600
+    registry.evict_idle()
+    assert sorted(registry.loaded()) == ["es"]
+
+    registry.get("en")
+    assert loads == ["es", "en", "ca", "en"]
+    with pytest.raises(KeyError):
+        registry.get("fr")
+
+
+def test_backends_score_close_to_torch(tiny_bert):
+    """Check if the quantized and ONNX backends agree with the fp32 model"""
+    app = import_app_module("app")
+    backends = import_app_module("backends")
+    tokenizer = import_app_module("dataset").load_tokenizer(str(tiny_bert))
+
+    def scores(name):
+        model = backends.load_backend(
+            name,
+            model_path=str(tiny_bert / "model.bin"),
+            onnx_path=str(tiny_bert / "model.onnx"),
+            bert_model=str(tiny_bert),
+        )
+        return app.generate_predictions(TEXTS, model, tokenizer)
+
+    reference = scores("torch")
+    assert reference.shape == (len(TEXTS),)
+    quantized = scores("quantized")
+    assert quantized.shape == reference.shape
+    assert np.abs(quantized - reference).max() < 0.05
+    onnx = scores("onnx")
+    assert onnx.shape == reference.shape
+    assert np.abs(onnx - reference).max() < 1e-4
+
+
+def test_unknown_backend_raises():
+    """Check if an unknown INFERENCE_BACKEND fails instead of loading torch"""
+    backends = import_app_module("backends")
+    with pytest.raises(ValueError, match="Unknown inference backend"):
+        backends.load_backend("tensorrt")
+
+
+def test_health_and_readiness(monkeypatch, app_module):
+    """Check if the app is live at once and only ready when its model is loaded"""
+    client = app_module.app.test_client()
+    assert client.get("/health").get_json() == {"status": "ok"}
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.get_json() == {"status": "loading"}
+
+    register_models(monkeypatch, app_module)
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "ready"
+    assert response.get_json()["loaded"] == {app_module.config.DEFAULT_LANGUAGE: 1}
+
+
+def test_post_fork_sets_intra_op_threads(monkeypatch):
+    """Check if each gunicorn worker uses INTRA_OP_THREADS threads"""
+    config = import_app_module("config")
+    spec = importlib.util.spec_from_file_location(
+        "gunicorn_conf", os.path.join(os.path.dirname(__file__), "gunicorn.conf.py")
+    )
+    gunicorn_conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gunicorn_conf)
+    monkeypatch.setattr(config, "INTRA_OP_THREADS", 3)
+    messages = []
+    server = SimpleNamespace(log=SimpleNamespace(info=messages.append))
+
+    num_threads = torch.get_num_threads()
+    try:
+        gunicorn_conf.post_fork(server, SimpleNamespace(pid=1234))
+        assert torch.get_num_threads() == 3
+    finally:
+        torch.set_num_threads(num_threads)
+    assert messages == ["Worker 1234 uses 3 intra-op threads"]
+
+
+def test_score_returns_float32_scores(monkeypatch, app_module):
+    """Check if /score takes a msgpack body and returns one float32 per text"""
+    register_models(monkeypatch, app_module)
+    client = app_module.app.test_client()
+    texts = ["hola", "adios", "hola", "buenos dias"]
+
+    response = client.post("/score", data=msgpack.packb({"texts": texts}))
+    assert response.status_code == 200
+    scores = np.frombuffer(response.data, dtype="<f4")
+    assert scores.shape == (len(texts),)
+    assert np.allclose(scores, [len(text) / 100 for text in texts])
+
+    response = client.post(
+        "/score", data=msgpack.packb({"texts": texts, "language": "xx"})
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b"\xc1",
+        b"",
+        msgpack.packb(["hola"]),
+        msgpack.packb({"language": "es"}),
+        msgpack.packb({"texts": "hola"}),
+        msgpack.packb({"texts": [1, 2]}),
+        msgpack.packb({"texts": ["hola"], "language": ["es"]}),
+    ],
+)
+def test_score_rejects_invalid_bodies(monkeypatch, app_module, body):
+    """Check if /score answers 400 to bodies that are not a map with texts"""
+    register_models(monkeypatch, app_module)
+    response = app_module.app.test_client().post("/score", data=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_predictions_are_padded_per_batch_and_keep_input_order(monkeypatch):
+    """Check if each batch is padded to its longest text and scores keep the order"""
+    app = import_app_module("app")
+    texts = ["a b c d e", "a", "a b c", "", "a b c d e f g", "a b"]
+    lengths = np.array([len(text.split()) + 2 for text in texts])
+
+    batches = list(app.dataset.padded_batches(texts, 2, WordTokenizer()))
+    assert sorted(np.concatenate([indices for indices, _ in batches])) == list(
+        range(len(texts))
+    )
+    for indices, batch in batches:
+        assert batch["ids"].shape == (len(indices), lengths[indices].max())
+        assert batch["mask"].sum(dim=1).tolist() == lengths[indices].tolist()
+    assert [batch["ids"].shape[1] for _, batch in batches] == [3, 5, 9]
+
+    def model(ids, mask, token_type_ids):
+        return mask.sum(dim=1, keepdim=True).float() / 10
+
+    monkeypatch.setattr(app.config, "PREDICT_BATCH_SIZE", 2)
+    scores = app.generate_predictions(texts, model, WordTokenizer())
+    assert np.allclose(scores, 1 / (1 + np.exp(-lengths / 10)))
+
+
+def test_sentiment_cache_frees_a_fraction_when_full(tmp_path):
+    """Check if a full cache is trimmed below max_size, so rows are counted rarely"""
+    cache = SentimentCache(tmp_path / "cache.db", "v1", max_size=20, ttl=3600)
+    for i in range(20):
+        cache.set_many([f"text {i}"], [0.5])
+    assert cache.stats()["size"] == 20
+
+    cache.set_many(["text 20"], [0.5])
+    assert cache.stats()["size"] == 18
+    assert cache.get_many(["text 20"]) == [0.5]
+
+    restarted = SentimentCache(tmp_path / "cache.db", "v1", max_size=20, ttl=3600)
+    assert restarted.stats()["size"] == 18
@@ -0,0 +1,68 @@
+import argparse
+import time
+
+import numpy as np
+
+import app
+import backends
+import config
+from benchmark import sample_tweets
+
+
+def load_texts(texts_file, n_tweets):
+    """Reads one processed text per line, or generates sample tweets"""
+    if texts_file is None:
+        return sample_tweets(n_tweets)
+    with open(texts_file, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()][:n_tweets]
+
+
+def timed_predictions(model, texts, repeats):
+    """Returns the predictions of a model and the median seconds of repeats calls
+
+    One untimed call runs first, so the timings leave out the set-up of the
+    backend (e.g., creating the ONNX Runtime session).
+    """
+    app.MODEL = model
+    app.generate_predictions(texts)
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        preds = app.generate_predictions(texts)
+        timings.append(time.perf_counter() - start_time)
+    return preds, float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the scores of an inference backend against the fp32 model"
+    )
+    parser.add_argument("--backend", choices=backends.BACKENDS, required=True)
+    parser.add_argument("--texts-file", help="File with one processed text per line")
+    parser.add_argument("--tweets", type=int, default=512)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--max-drift", type=float, default=0.05, help="Fail above this score drift"
+    )
+    args = parser.parse_args()
+
+    texts = load_texts(args.texts_file, args.tweets)
+    reference, reference_time = timed_predictions(
+        backends.load_backend("torch"), texts, args.repeats
+    )
+    scores, backend_time = timed_predictions(
+        backends.load_backend(args.backend), texts, args.repeats
+    )
+
+    drift = np.abs(scores - reference)
+    flipped = ((scores >= 0.5) != (reference >= 0.5)).mean() * 100
+    print(f"Backend: {args.backend} ({config.MODEL_PATH}), {len(texts)} texts")
+    print(f"Max drift: {drift.max():.4f}, mean drift: {drift.mean():.4f}")
+    print(f"Labels changed: {flipped:.2f}%")
+    print(f"Speedup against torch: {reference_time / backend_time:.1f}x")
+    if drift.max() > args.max_drift:
+        raise SystemExit(f"Max drift is above {args.max_drift}")
+
+
+if __name__ == "__main__":
+    main()
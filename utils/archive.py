@@ -0,0 +1,201 @@
+import argparse
+import datetime
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from partitions import EPOCH, TWEETS_COLUMNS, partition_name
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+ARCHIVE_DIR = ROOT_DIR / "data" / "archive"
+ARCHIVE_CHUNK_SIZE = 50000
+TIMESTAMP_COLUMNS = ("INSERT_TIMESTAMP", "ACCOUNT_CREATION_DATE")
+
+
+def import_pyarrow():
+    """Imports pyarrow, which is only needed to archive tweets"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Archiving tweets requires pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def archive_schema(pa):
+    """Typed columns of the archive, TWEET_TIMESTAMP is kept as TWEET_TS only
+
+    Parquet has no second resolution, so TWEET_TS is read back in milliseconds.
+    """
+    return pa.schema(
+        [
+            ("TWEET_ID", pa.int64()),
+            ("TARGET", pa.dictionary(pa.int32(), pa.string())),
+            ("TWEET_TS", pa.timestamp("s", tz="UTC")),
+            ("IS_RT", pa.bool_()),
+            ("SENTIMENT", pa.float32()),
+            ("FULL_TEXT", pa.string()),
+            ("PROCESSED_TEXT", pa.string()),
+            ("FOLLOWERS_COUNT", pa.int64()),
+            ("FAVOURITES_COUNT", pa.int64()),
+            ("FRIENDS_COUNT", pa.int64()),
+            ("TWEETS_COUNT", pa.int64()),
+            ("INSERT_TIMESTAMP", pa.timestamp("us")),
+            ("ACCOUNT_CREATION_DATE", pa.timestamp("us")),
+        ]
+    )
+
+
+def archive_path(archive_dir, day):
+    """Returns the Parquet file of a day, e.g., date=2020-07-19/tweets.parquet"""
+    date = EPOCH + datetime.timedelta(days=day)
+    return Path(archive_dir) / f"date={date:%Y-%m-%d}" / "tweets.parquet"
+
+
+def parse_timestamp(text):
+    """Parses the ISO timestamps stored as text, None if empty or invalid"""
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def archive_partition(
+    conn, day, archive_dir=ARCHIVE_DIR, chunk_size=ARCHIVE_CHUNK_SIZE
+):
+    """Writes the tweets of a daily partition to a Parquet file
+
+    Rows are read and written in chunks of chunk_size, one row group each, so
+    memory use does not depend on the size of the partition. The file is
+    written next to its final path and renamed when complete, so archiving a
+    day again (e.g., when the transaction that drops its partition is rolled
+    back) replaces it with the same tweets.
+
+    Args:
+        conn: Connection to the database
+        day: Day number of the partition
+        archive_dir: Directory of the archive
+        chunk_size: Rows per row group
+
+    Returns:
+        Number of tweets archived
+    """
+    pa = import_pyarrow()
+    schema = archive_schema(pa)
+    path = archive_path(archive_dir, day)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".parquet.tmp")
+    columns = [name for name in schema.names if name in TWEETS_COLUMNS]
+    cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {partition_name(day)}")
+    archived = 0
+    with pa.parquet.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            values = dict(zip(columns, zip(*rows)))
+            for column in TIMESTAMP_COLUMNS:
+                values[column] = [parse_timestamp(text) for text in values[column]]
+            values["IS_RT"] = [bool(is_rt) for is_rt in values["IS_RT"]]
+            arrays = [
+                pa.array(values[field.name], pa.string()).dictionary_encode()
+                if field.name == "TARGET"
+                else pa.array(values[field.name], field.type)
+                for field in schema
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            archived += len(rows)
+    os.replace(tmp_path, path)
+    return archived
+
+
+def sentiment_history(archive_dir=ARCHIVE_DIR, start=None, end=None, exclude_rt=False):
+    """Aggregates the archived tweets per day and target
+
+    Only the TARGET, IS_RT and SENTIMENT columns of the days between start and
+    end are read, from memory-mapped files, and each row group is reduced to
+    counts per target before reading the next one.
+
+    Args:
+        archive_dir: Directory of the archive
+        start: First date (datetime.date), None for the oldest archived day
+        end: Last date (datetime.date), None for the newest archived day
+        exclude_rt: Whether retweets are left out
+
+    Returns:
+        Dataframe with date, target, responses, scored, positive and
+        sentiment (percentage of positive scored tweets) columns
+    """
+    pa = import_pyarrow()
+    rows = []
+    for path in sorted(Path(archive_dir).glob("date=*/tweets.parquet")):
+        date = datetime.date.fromisoformat(path.parent.name[len("date=") :])
+        if (start is not None and date < start) or (end is not None and date > end):
+            continue
+        parquet_file = pa.parquet.ParquetFile(path, memory_map=True)
+        counts = {}
+        for group in range(parquet_file.num_row_groups):
+            table = parquet_file.read_row_group(
+                group, columns=["TARGET", "IS_RT", "SENTIMENT"]
+            )
+            for target, totals in count_by_target(table, exclude_rt).items():
+                counts[target] = counts.get(target, 0) + totals
+        rows.extend(
+            (date, target, *totals) for target, totals in sorted(counts.items())
+        )
+    df = pd.DataFrame(
+        rows, columns=["date", "target", "responses", "scored", "positive"]
+    )
+    df["sentiment"] = df.positive * 100.0 / df.scored.where(df.scored > 0)
+    return df
+
+
+def count_by_target(table, exclude_rt=False):
+    """Counts the tweets, scored tweets and positive tweets of each target
+
+    Uses the indices of the dictionary-encoded TARGET column, so targets are
+    never materialized as one string per row.
+
+    Returns:
+        Dictionary of target to an array of responses, scored and positive
+    """
+    counts = {}
+    targets = table.column("TARGET")
+    sentiment = table.column("SENTIMENT")
+    is_rt = table.column("IS_RT")
+    for chunk in range(targets.num_chunks):
+        dictionary = targets.chunk(chunk).dictionary.to_pylist()
+        indices = targets.chunk(chunk).indices.to_numpy(zero_copy_only=False)
+        scores = sentiment.chunk(chunk).to_numpy(zero_copy_only=False)
+        if exclude_rt:
+            original = ~is_rt.chunk(chunk).to_numpy(zero_copy_only=False)
+            indices, scores = indices[original], scores[original]
+        is_scored = ~np.isnan(scores)
+        is_positive = np.zeros(len(scores), dtype=bool)
+        is_positive[is_scored] = scores[is_scored] >= 0.5
+        size = len(dictionary)
+        totals = np.stack(
+            [
+                np.bincount(indices, minlength=size),
+                np.bincount(indices, weights=is_scored, minlength=size),
+                np.bincount(indices, weights=is_positive, minlength=size),
+            ],
+            axis=1,
+        ).astype(np.int64)
+        for target, target_totals in zip(dictionary, totals):
+            if target_totals[0]:
+                counts[target] = counts.get(target, 0) + target_totals
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Daily sentiment of archived tweets")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--exclude-rt", action="store_true")
+    args = parser.parse_args()
+    end = datetime.datetime.utcnow().date()
+    start = end - datetime.timedelta(days=args.days)
+    history = sentiment_history(start=start, end=end, exclude_rt=args.exclude_rt)
+    print(history.pivot(index="date", columns="target", values="sentiment"))
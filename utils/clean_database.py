@@ -1,20 +1,47 @@
-import sqlite3
+import argparse
+import os
+from functools import partial
 from pathlib import Path
 
+from archive import archive_partition
+from database import connect
+from partitions import drop_expired_partitions
+from series import prune_series
+
 ROOT_DIR = Path(__file__).resolve().parents[1]
 TWEETS_DB = ROOT_DIR / "data" / "tweets.db"
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "2"))
+
+
+def main(db_path=TWEETS_DB, retention_days=RETENTION_DAYS, archive_dir=None):
+    """Drop the daily partitions of tweets older than the retention period
+
+    The fetcher already does this as it runs, one partition at a time. Buckets
+    of the hourly series older than the days it keeps are deleted too.
 
+    Args:
+        db_path: Path of the database
+        retention_days: Days kept before the current one
+        archive_dir: Directory where partitions are archived as Parquet files
+            before being dropped, None to drop them without archiving
 
-def main():
-    """Create database for storing Tweets"""
-    conn = sqlite3.connect(TWEETS_DB)
-    cur = conn.cursor()
-    cur.execute(
-        "DELETE FROM TWEETS WHERE DATE(TWEET_TIMESTAMP) < date('now', '-2 days')"
-    )
+    Returns:
+        Day numbers of the partitions dropped
+    """
+    archive = None
+    if archive_dir is not None:
+        archive = partial(archive_partition, archive_dir=archive_dir)
+    conn = connect(db_path)
+    with conn:
+        dropped = drop_expired_partitions(conn, retention_days, archive=archive)
+        prune_series(conn)
     conn.close()
-    return
+    return dropped
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Drop tweets older than N days")
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS)
+    parser.add_argument("--archive-dir", help="Archive tweets to Parquet files first")
+    args = parser.parse_args()
+    main(retention_days=args.days, archive_dir=args.archive_dir)
@@ -1,41 +1,127 @@
-import sqlite3
 from pathlib import Path
 
+from database import connect
+from partitions import create_tweets_view, list_partitions, partition_name
+from series import SERIES, create_series_tables
+
 ROOT_DIR = Path(__file__).resolve().parents[1]
 TWEETS_DB = ROOT_DIR / "data" / "tweets.db"
 
 
-def main():
-    """Create database for storing Tweets"""
-    conn = sqlite3.connect(TWEETS_DB)
-    cur = conn.cursor()
-    cur.execute("DROP TABLE IF EXISTS TWEETS")
+def create_rollup_table(cur):
+    """Create the per-minute aggregates of tweets used by the dashboard cards
+
+    RESPONSES counts every tweet when it is inserted, while SCORED and POSITIVE
+    only count the tweets that already have a sentiment.
+    """
     cur.execute(
         """
-        CREATE TABLE TWEETS (
-            ID INTEGER PRIMARY KEY,
-            TWEET_ID INTEGER NOT NULL, 
+        CREATE TABLE IF NOT EXISTS TWEETS_ROLLUP (
+            MINUTE_TS INTEGER NOT NULL,
             TARGET TEXT NOT NULL,
-            INSERT_TIMESTAMP TEXT NOT NULL,
-            FULL_TEXT TEXT,
-            PROCESSED_TEXT TEXT,
-            FOLLOWERS_COUNT INTEGER,
-            FAVOURITES_COUNT INTEGER,
-            FRIENDS_COUNT INTEGER,  
-            TWEETS_COUNT INTEGER,
-            ACCOUNT_CREATION_DATE TEXT,
-            TWEET_TIMESTAMP TEXT NOT NULL,
             IS_RT INTEGER NOT NULL,
-            SENTIMENT REAL
+            RESPONSES INTEGER NOT NULL,
+            POSITIVE INTEGER NOT NULL,
+            SCORED INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (MINUTE_TS, TARGET, IS_RT)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def create_scoring_queue(cur):
+    """Create the queue of tweets inserted without sentiment
+
+    Triggers of each partition keep the queue in sync with its tweets, so tweets
+    inserted with a NULL SENTIMENT are enqueued in the same transaction, and
+    deleted tweets leave the queue.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS SCORING_QUEUE (
+            TWEET_ROWID INTEGER PRIMARY KEY
         )
         """
     )
+
+
+def drop_tweets(cur):
+    """Drop every partition of tweets and the TWEETS view (or legacy table)"""
+    for day in list_partitions(cur):
+        cur.execute(f"DROP TABLE {partition_name(day)}")
+    row = cur.execute("SELECT TYPE FROM sqlite_master WHERE NAME = 'TWEETS'").fetchone()
+    if row is not None:
+        cur.execute(f"DROP {row[0]} TWEETS")
+
+
+def create_data_version_table(cur):
+    """Create the counter the fetcher bumps after inserting tweets"""
     cur.execute(
         """
-        CREATE INDEX IDX_TWEETS
-        ON TWEETS(TWEET_TIMESTAMP, TARGET, IS_RT);
+        CREATE TABLE IF NOT EXISTS DATA_VERSION (
+            ID INTEGER PRIMARY KEY CHECK (ID = 0),
+            VERSION INTEGER NOT NULL
+        )
         """
     )
+    cur.execute("INSERT OR IGNORE INTO DATA_VERSION VALUES (0, 0)")
+
+
+def create_backfill_table(cur):
+    """Create the ranges of tweet ids the fetcher still has to page through
+
+    A gap covers the tweets after SINCE_ID and up to MAX_ID (inclusive) that
+    did not fit in the request budget of a fetch.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS BACKFILL_GAPS (
+            TARGET TEXT NOT NULL,
+            SINCE_ID INTEGER NOT NULL,
+            MAX_ID INTEGER NOT NULL,
+            PRIMARY KEY (TARGET, SINCE_ID)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def create_cursors_table(cur):
+    """Create the id of the newest tweet fetched for each target
+
+    Fetches resume after it, so targets whose partitions were all dropped by
+    retention do not search again from the oldest tweets the API returns.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS FETCH_CURSORS (
+            TARGET TEXT PRIMARY KEY,
+            LAST_ID INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def main(db_path=TWEETS_DB):
+    """Create database for storing Tweets"""
+    conn = connect(db_path)
+    cur = conn.cursor()
+    drop_tweets(cur)
+    cur.execute("DROP TABLE IF EXISTS TWEETS_ROLLUP")
+    cur.execute("DROP TABLE IF EXISTS DATA_VERSION")
+    cur.execute("DROP TABLE IF EXISTS BACKFILL_GAPS")
+    cur.execute("DROP TABLE IF EXISTS FETCH_CURSORS")
+    cur.execute("DROP TABLE IF EXISTS SCORING_QUEUE")
+    for table, _, _ in SERIES:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+    # Tweets are stored in one table per day, created on their first insert
+    create_tweets_view(cur)
+    create_rollup_table(cur)
+    create_series_tables(cur)
+    create_data_version_table(cur)
+    create_backfill_table(cur)
+    create_cursors_table(cur)
+    create_scoring_queue(cur)
+    conn.commit()
     conn.close()
     return
 
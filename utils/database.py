@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+TWEETS_DB = ROOT_DIR / "data" / "tweets.db"
+BUSY_TIMEOUT = 30
+CACHED_STATEMENTS = 256
+
+
+def connect(path=TWEETS_DB, read_only=False, timeout=BUSY_TIMEOUT):
+    """Open a connection to an SQLite database
+
+    Writers switch the database to WAL mode, so readers and the writer do not
+    block each other. Read-only connections are opened with mode=ro.
+
+    Args:
+        path: Path of the database
+        read_only: Whether the connection can only read
+        timeout: Seconds to wait for a lock before failing (busy timeout)
+
+    Returns:
+        sqlite3 connection
+    """
+    if read_only:
+        conn = sqlite3.connect(
+            f"{Path(path).resolve().as_uri()}?mode=ro",
+            uri=True,
+            timeout=timeout,
+            cached_statements=CACHED_STATEMENTS,
+        )
+    else:
+        conn = sqlite3.connect(
+            str(path),
+            timeout=timeout,
+            cached_statements=CACHED_STATEMENTS,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class Database:
+    """Pool with one long-lived connection per thread and process
+
+    Reusing connections keeps sqlite3's cache of prepared statements warm, so
+    the same queries are not compiled again on every call.
+    """
+
+    def __init__(self, path=TWEETS_DB, read_only=False, timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.read_only = read_only
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connection(self):
+        """Returns the connection of the current thread, opening it if needed"""
+        conn = getattr(self._local, "conn", None)
+        # Connections must not be shared with forked processes (e.g., gunicorn)
+        if conn is None or self._local.pid != os.getpid():
+            conn = connect(self.path, self.read_only, self.timeout)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Closes the connection of the current thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
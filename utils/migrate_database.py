@@ -0,0 +1,117 @@
+from pathlib import Path
+
+from create_database import (
+    create_backfill_table,
+    create_cursors_table,
+    create_data_version_table,
+    create_rollup_table,
+    create_scoring_queue,
+)
+from database import connect
+from partitions import (
+    DAY_SECONDS,
+    TWEETS_COLUMNS,
+    create_partition,
+    create_tweets_view,
+    partition_name,
+)
+from series import backfill_series, create_series_tables
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+TWEETS_DB = ROOT_DIR / "data" / "tweets.db"
+
+
+def partition_tweets_table(cur):
+    """Moves the rows of a TWEETS table into one partition per day
+
+    Rows get new ids in their partition, and the partitions' triggers fill the
+    scoring queue again with the tweets that have no sentiment.
+    """
+    columns = [row[1] for row in cur.execute("PRAGMA table_info(TWEETS)")]
+    values = ", ".join(
+        column if column in columns else "NULL" for column in TWEETS_COLUMNS
+    )
+    days = cur.execute(
+        f"SELECT DISTINCT TWEET_TS / {DAY_SECONDS} FROM TWEETS ORDER BY 1"
+    ).fetchall()
+    cur.execute("DELETE FROM SCORING_QUEUE")
+    for (day,) in days:
+        create_partition(cur, day)
+        cur.execute(
+            f"""
+            INSERT INTO {partition_name(day)} ({", ".join(TWEETS_COLUMNS)})
+            SELECT {values} FROM TWEETS
+            WHERE TWEET_TS >= ? AND TWEET_TS < ?
+            ORDER BY ID
+            """,
+            (day * DAY_SECONDS, (day + 1) * DAY_SECONDS),
+        )
+    cur.execute("DROP TABLE TWEETS")
+    create_tweets_view(cur)
+
+
+def main(db_path=TWEETS_DB):
+    """Migrate an existing database to epoch timestamps, rollups and daily partitions"""
+    conn = connect(db_path)
+    cur = conn.cursor()
+    is_table = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE TYPE = 'table' AND NAME = 'TWEETS'"
+    ).fetchone()
+    if is_table:
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(TWEETS)")]
+        if "TWEET_TS" not in columns:
+            cur.execute(
+                "ALTER TABLE TWEETS ADD COLUMN TWEET_TS INTEGER NOT NULL DEFAULT 0"
+            )
+        cur.execute(
+            """
+            UPDATE TWEETS
+            SET TWEET_TS = CAST(strftime('%s', TWEET_TIMESTAMP) AS INTEGER)
+            WHERE TWEET_TS = 0
+            """
+        )
+    create_rollup_table(cur)
+    rollup_columns = [row[1] for row in cur.execute("PRAGMA table_info(TWEETS_ROLLUP)")]
+    if "SCORED" not in rollup_columns:
+        # Before the scoring queue, every tweet was inserted with its sentiment
+        cur.execute(
+            "ALTER TABLE TWEETS_ROLLUP ADD COLUMN SCORED INTEGER NOT NULL DEFAULT 0"
+        )
+        cur.execute("UPDATE TWEETS_ROLLUP SET SCORED = RESPONSES")
+    if cur.execute("SELECT COUNT(*) FROM TWEETS_ROLLUP").fetchone()[0] == 0:
+        cur.execute(
+            """
+            INSERT INTO TWEETS_ROLLUP
+            SELECT
+                TWEET_TS / 60 * 60,
+                TARGET,
+                IS_RT,
+                COUNT(*),
+                COALESCE(SUM(SENTIMENT >= 0.5), 0),
+                COUNT(SENTIMENT)
+            FROM TWEETS
+            GROUP BY 1, 2, 3
+            """
+        )
+    create_series_tables(cur)
+    backfill_series(cur)
+    create_data_version_table(cur)
+    create_backfill_table(cur)
+    create_scoring_queue(cur)
+    if is_table:
+        partition_tweets_table(cur)
+    create_cursors_table(cur)
+    cur.execute(
+        """
+        INSERT OR IGNORE INTO FETCH_CURSORS
+        SELECT TARGET, MAX(TWEET_ID) FROM TWEETS GROUP BY TARGET
+        """
+    )
+    conn.commit()
+    cur.execute("ANALYZE")
+    conn.close()
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import datetime
+import time
+
+DAY_SECONDS = 86400
+# Rows of a partition get ids from its day number * ID_SPAN on, so ids are
+# unique across partitions and the partition of an id is known without a lookup
+ID_SPAN = 10**10
+EPOCH = datetime.date(1970, 1, 1)
+TWEETS_COLUMNS = (
+    "TWEET_ID",
+    "TARGET",
+    "INSERT_TIMESTAMP",
+    "FULL_TEXT",
+    "PROCESSED_TEXT",
+    "FOLLOWERS_COUNT",
+    "FAVOURITES_COUNT",
+    "FRIENDS_COUNT",
+    "TWEETS_COUNT",
+    "ACCOUNT_CREATION_DATE",
+    "TWEET_TIMESTAMP",
+    "IS_RT",
+    "SENTIMENT",
+    "TWEET_TS",
+)
+
+
+def partition_day(tweet_ts):
+    """Returns the day number (days since 1970-01-01, UTC) of an epoch timestamp"""
+    return tweet_ts // DAY_SECONDS
+
+
+def partition_name(day):
+    """Returns the table of a day's tweets, e.g., TWEETS_20200719"""
+    return f"TWEETS_{EPOCH + datetime.timedelta(days=day):%Y%m%d}"
+
+
+def id_partition(rowid):
+    """Returns the day number of the partition a tweet's ID belongs to"""
+    return rowid // ID_SPAN
+
+
+def list_partitions(conn):
+    """Returns the day numbers of the existing partitions, oldest first"""
+    names = conn.execute(
+        """
+        SELECT NAME FROM sqlite_master
+        WHERE TYPE = 'table' AND NAME GLOB 'TWEETS_[0-9]*'
+        """
+    ).fetchall()
+    dates = [datetime.datetime.strptime(name[7:], "%Y%m%d") for (name,) in names]
+    return sorted((date.date() - EPOCH).days for date in dates)
+
+
+def create_partition(conn, day):
+    """Creates the table of a day's tweets with its indexes and triggers
+
+    TWEET_TS (epoch seconds) leads the covering index, so time-window filters
+    are range scans that never need to read the table. Tweets inserted with a
+    NULL SENTIMENT are added to the scoring queue in the same transaction.
+    Every step is idempotent, so it is safe to call on an existing partition.
+
+    Args:
+        conn: Connection to the database
+        day: Day number of the partition
+    """
+    table = partition_name(day)
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            TWEET_ID INTEGER NOT NULL,
+            TARGET TEXT NOT NULL,
+            INSERT_TIMESTAMP TEXT NOT NULL,
+            FULL_TEXT TEXT,
+            PROCESSED_TEXT TEXT,
+            FOLLOWERS_COUNT INTEGER,
+            FAVOURITES_COUNT INTEGER,
+            FRIENDS_COUNT INTEGER,
+            TWEETS_COUNT INTEGER,
+            ACCOUNT_CREATION_DATE TEXT,
+            TWEET_TIMESTAMP TEXT NOT NULL,
+            IS_RT INTEGER NOT NULL,
+            SENTIMENT REAL,
+            TWEET_TS INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO sqlite_sequence (NAME, SEQ)
+        SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE NAME = ?)
+        """,
+        (table, day * ID_SPAN, table),
+    )
+    conn.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS IDX_{table}_TS
+        ON {table}(TWEET_TS, IS_RT, TARGET, SENTIMENT)
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS IDX_{table}_TARGET
+        ON {table}(TARGET, TWEET_ID)
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS ENQUEUE_UNSCORED_{table}
+        AFTER INSERT ON {table} WHEN NEW.SENTIMENT IS NULL
+        BEGIN
+            INSERT INTO SCORING_QUEUE VALUES (NEW.ID);
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS DEQUEUE_DELETED_{table}
+        AFTER DELETE ON {table} WHEN OLD.SENTIMENT IS NULL
+        BEGIN
+            DELETE FROM SCORING_QUEUE WHERE TWEET_ROWID = OLD.ID;
+        END
+        """
+    )
+
+
+def create_tweets_view(conn):
+    """Creates the TWEETS view over every partition
+
+    Filters on TWEET_TS are pushed down to each partition and use its index,
+    so partitions outside a time window cost a single index lookup.
+    """
+    days = list_partitions(conn)
+    columns = ", ".join(("ID",) + TWEETS_COLUMNS)
+    if days:
+        query = "\nUNION ALL\n".join(
+            f"SELECT {columns} FROM {partition_name(day)}" for day in days
+        )
+    else:
+        nulls = ", ".join(f"NULL AS {column}" for column in ("ID",) + TWEETS_COLUMNS)
+        query = f"SELECT {nulls} WHERE 0"
+    conn.execute("DROP VIEW IF EXISTS TWEETS")
+    conn.execute(f"CREATE VIEW TWEETS AS {query}")
+
+
+def add_partitions(conn, days):
+    """Creates the missing partitions of several days and updates the view
+
+    Args:
+        conn: Connection to the database
+        days: Iterable of day numbers
+
+    Returns:
+        Day numbers of the partitions created
+    """
+    created = sorted(set(days) - set(list_partitions(conn)))
+    for day in created:
+        create_partition(conn, day)
+    if created:
+        create_tweets_view(conn)
+    return created
+
+
+def drop_expired_partitions(
+    conn, retention_days, now=None, max_partitions=None, archive=None
+):
+    """Drops the partitions of the days older than the retention period
+
+    Dropping a partition frees its pages without touching the other days, so
+    retention does not scan or delete rows one by one. The scoring queue and
+    the rollups of those days are deleted with range scans on their keys.
+    The caller commits the transaction.
+
+    If archive is given, it is called as archive(conn, day) before dropping
+    each partition, and a partition is only dropped if it did not fail.
+
+    Args:
+        conn: Connection to the database
+        retention_days: Days kept before the current one
+        now: Epoch timestamp of the current time, defaults to time.time()
+        max_partitions: Maximum number of partitions dropped, None for all
+        archive: Optional function that copies a partition elsewhere
+
+    Returns:
+        Day numbers of the partitions dropped
+    """
+    now = time.time() if now is None else now
+    cutoff = partition_day(int(now)) - retention_days
+    expired = [day for day in list_partitions(conn) if day < cutoff]
+    expired = expired[:max_partitions]
+    for day in expired:
+        if archive is not None:
+            archive(conn, day)
+        conn.execute(
+            "DELETE FROM SCORING_QUEUE WHERE TWEET_ROWID >= ? AND TWEET_ROWID < ?",
+            (day * ID_SPAN, (day + 1) * ID_SPAN),
+        )
+        conn.execute(
+            "DELETE FROM TWEETS_ROLLUP WHERE MINUTE_TS < ?", ((day + 1) * DAY_SECONDS,)
+        )
+        conn.execute(f"DROP TABLE {partition_name(day)}")
+    if expired:
+        create_tweets_view(conn)
+        conn.execute("UPDATE DATA_VERSION SET VERSION = VERSION + 1")
+    return expired
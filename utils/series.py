@@ -0,0 +1,123 @@
+import math
+import time
+
+from partitions import DAY_SECONDS
+
+HOUR_SECONDS = 3600
+# Aggregates of TWEETS_ROLLUP that outlive the retention of tweets, finest
+# first, as (table, seconds per bucket, days kept or None to keep them forever)
+SERIES = (
+    ("TWEETS_HOURLY", HOUR_SECONDS, 31),
+    ("TWEETS_DAILY", DAY_SECONDS, None),
+)
+
+
+def create_series_tables(cur):
+    """Create the hourly and daily aggregates used by the trend chart
+
+    Triggers on TWEETS_ROLLUP add every change of its counts to the bucket
+    that contains the minute, in the same transaction, so the series are kept
+    up to date incrementally. Deleting rollups (e.g., by the retention of
+    tweets) does not change them.
+    """
+    for table, seconds, _ in SERIES:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                BUCKET_TS INTEGER NOT NULL,
+                TARGET TEXT NOT NULL,
+                IS_RT INTEGER NOT NULL,
+                RESPONSES INTEGER NOT NULL,
+                POSITIVE INTEGER NOT NULL,
+                SCORED INTEGER NOT NULL,
+                PRIMARY KEY (BUCKET_TS, TARGET, IS_RT)
+            ) WITHOUT ROWID
+            """
+        )
+        for event, change in (("INSERT", "NEW.{0}"), ("UPDATE", "NEW.{0} - OLD.{0}")):
+            counts = ", ".join(
+                change.format(column) for column in ("RESPONSES", "POSITIVE", "SCORED")
+            )
+            cur.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS ROLLUP_{event}_{table}
+                AFTER {event} ON TWEETS_ROLLUP
+                BEGIN
+                    INSERT INTO {table} VALUES (
+                        NEW.MINUTE_TS / {seconds} * {seconds},
+                        NEW.TARGET,
+                        NEW.IS_RT,
+                        {counts}
+                    )
+                    ON CONFLICT (BUCKET_TS, TARGET, IS_RT) DO UPDATE SET
+                        RESPONSES = RESPONSES + excluded.RESPONSES,
+                        POSITIVE = POSITIVE + excluded.POSITIVE,
+                        SCORED = SCORED + excluded.SCORED;
+                END
+                """
+            )
+
+
+def backfill_series(cur):
+    """Fills empty series from the rollups of the days still kept"""
+    for table, seconds, _ in SERIES:
+        if cur.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None:
+            cur.execute(
+                f"""
+                INSERT INTO {table}
+                SELECT
+                    MINUTE_TS / {seconds} * {seconds},
+                    TARGET,
+                    IS_RT,
+                    SUM(RESPONSES),
+                    SUM(POSITIVE),
+                    SUM(SCORED)
+                FROM TWEETS_ROLLUP
+                GROUP BY 1, 2, 3
+                """
+            )
+
+
+def prune_series(conn, now=None):
+    """Deletes the buckets older than the days kept of each series
+
+    The caller commits the transaction.
+
+    Args:
+        conn: Connection to the database
+        now: Epoch timestamp of the current time, defaults to time.time()
+
+    Returns:
+        Number of buckets deleted
+    """
+    now = time.time() if now is None else now
+    deleted = 0
+    for table, _, days in SERIES:
+        if days is not None:
+            cutoff = int(now) - days * DAY_SECONDS
+            deleted += conn.execute(
+                f"DELETE FROM {table} WHERE BUCKET_TS < ?", (cutoff,)
+            ).rowcount
+    return deleted
+
+
+def series_step(window_seconds, points):
+    """Picks the series and bucket size that cover a window in about points buckets
+
+    The coarsest series whose buckets fit in a step is used, so the number of
+    rows read only depends on points and the number of targets, not on the
+    length of the window.
+
+    Args:
+        window_seconds: Length of the window
+        points: Maximum number of buckets
+
+    Returns:
+        (table, step) tuple, step is a multiple of the series' bucket seconds
+    """
+    min_step = window_seconds / points
+    table, seconds, _ = SERIES[0]
+    for series in SERIES[1:]:
+        if series[1] <= min_step:
+            table, seconds, _ = series
+    return table, math.ceil(min_step / seconds) * seconds
@@ -0,0 +1,183 @@
+import datetime
+import sqlite3
+import threading
+
+import pytest
+
+import archive
+import clean_database
+import create_database
+from database import Database, connect
+from partitions import add_partitions, drop_expired_partitions, list_partitions
+from series import prune_series, series_step
+
+
+def test_database_uses_wal_and_one_connection_per_thread(tmp_path):
+    """Check if the pool reuses connections within a thread but not across threads"""
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    db = Database(db_path)
+    assert db.connection() is db.connection()
+    assert db.connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    other_thread = []
+    thread = threading.Thread(target=lambda: other_thread.append(db.connection()))
+    thread.start()
+    thread.join()
+    assert other_thread[0] is not db.connection()
+
+
+def test_read_only_connections_cannot_write(tmp_path):
+    """Check if the dashboard's read-only connections reject writes"""
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    conn = connect(db_path, read_only=True)
+    assert conn.execute("SELECT COUNT(*) FROM TWEETS").fetchone()[0] == 0
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("UPDATE DATA_VERSION SET VERSION = VERSION + 1")
+
+
+def test_retention_drops_whole_daily_partitions(tmp_path):
+    """Check if expired days are dropped with their queue entries and rollups"""
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    conn = connect(db_path)
+    day = 1595160000 // 86400
+    with conn:
+        add_partitions(conn, [day - 3, day - 2, day])
+        for offset in (-3, -2, 0):
+            ts = (day + offset) * 86400
+            conn.execute(
+                "INSERT INTO TWEETS_ROLLUP VALUES (?, 'pablo_casado', 0, 1, 0, 0)",
+                (ts,),
+            )
+    insert = (
+        "INSERT INTO {} (TWEET_ID, TARGET, INSERT_TIMESTAMP, TWEET_TIMESTAMP, "
+        "IS_RT, TWEET_TS) VALUES (1, 'pablo_casado', '', '', 0, 0)"
+    )
+    with conn:
+        conn.execute(insert.format("TWEETS_20200716"))
+        conn.execute(insert.format("TWEETS_20200719"))
+    assert conn.execute("SELECT COUNT(*) FROM TWEETS").fetchone()[0] == 2
+    assert conn.execute("SELECT COUNT(*) FROM SCORING_QUEUE").fetchone()[0] == 2
+
+    now = 1595160000 + 3600
+    with conn:
+        assert drop_expired_partitions(conn, 2, now, max_partitions=1) == [day - 3]
+    assert list_partitions(conn) == [day - 2, day]
+    assert conn.execute("SELECT COUNT(*) FROM TWEETS").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM SCORING_QUEUE").fetchone()[0] == 1
+    assert conn.execute("SELECT MINUTE_TS FROM TWEETS_ROLLUP").fetchall() == [
+        ((day - 2) * 86400,),
+        (day * 86400,),
+    ]
+    assert conn.execute("SELECT VERSION FROM DATA_VERSION").fetchone()[0] == 1
+    conn.close()
+
+    # Cleaning by hand commits, and drops every expired partition at once
+    assert clean_database.main(db_path, retention_days=2) == [day - 2, day]
+    conn = connect(db_path)
+    assert list_partitions(conn) == []
+    assert conn.execute("SELECT COUNT(*) FROM TWEETS").fetchone()[0] == 0
+
+
+def test_archive_partition_and_sentiment_history(tmp_path):
+    """Check if a partition is archived with typed columns and aggregated per day"""
+    try:
+        pa = archive.import_pyarrow().parquet
+    except ImportError:
+        pytest.skip("pyarrow is not installed")
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    conn = connect(db_path)
+    day = 1595160000 // 86400
+    with conn:
+        add_partitions(conn, [day])
+        conn.executemany(
+            "INSERT INTO TWEETS_20200719 (TWEET_ID, TARGET, INSERT_TIMESTAMP, "
+            "TWEET_TIMESTAMP, IS_RT, SENTIMENT, TWEET_TS, ACCOUNT_CREATION_DATE) "
+            "VALUES (?, ?, '2020-07-19 12:00:01.5', '', ?, ?, ?, '2010-01-01')",
+            [
+                (1, "pablo_casado", 0, 0.9, 1595160000),
+                (2, "pablo_casado", 0, 0.1, 1595160001),
+                (3, "pablo_casado", 1, None, 1595160002),
+                (4, "pedro_sanchez", 1, 1.0, 1595160003),
+            ],
+        )
+    archive_dir = tmp_path / "archive"
+    assert archive.archive_partition(conn, day, archive_dir, chunk_size=3) == 4
+
+    path = archive_dir / "date=2020-07-19" / "tweets.parquet"
+    parquet_file = pa.ParquetFile(path)
+    assert parquet_file.num_row_groups == 2
+    schema = parquet_file.schema_arrow
+    assert str(schema.field("TWEET_ID").type) == "int64"
+    assert str(schema.field("SENTIMENT").type) == "float"
+    assert (
+        str(schema.field("TARGET").type)
+        == "dictionary<values=string, indices=int32, ordered=0>"
+    )
+    assert str(schema.field("TWEET_TS").type) == "timestamp[ms, tz=UTC]"
+
+    history = archive.sentiment_history(archive_dir)
+    assert history.values.tolist() == [
+        [datetime.date(2020, 7, 19), "pablo_casado", 3, 2, 1, 50.0],
+        [datetime.date(2020, 7, 19), "pedro_sanchez", 1, 1, 1, 100.0],
+    ]
+    history = archive.sentiment_history(archive_dir, exclude_rt=True)
+    assert history.values.tolist() == [
+        [datetime.date(2020, 7, 19), "pablo_casado", 2, 2, 1, 50.0]
+    ]
+    later = datetime.date(2020, 7, 20)
+    assert archive.sentiment_history(archive_dir, start=later).empty
+
+    # Archiving a day again, e.g., after the drop of its partition was rolled
+    # back, replaces its file with the same tweets
+    expected = archive.sentiment_history(archive_dir)
+    assert archive.archive_partition(conn, day, archive_dir) == 4
+    assert [p.name for p in path.parent.iterdir()] == ["tweets.parquet"]
+    assert archive.sentiment_history(archive_dir).equals(expected)
+
+
+def test_series_follow_rollups_and_outlive_them(tmp_path):
+    """Check if the hourly and daily series add up rollups and keep them"""
+    db_path = tmp_path / "tweets.db"
+    create_database.main(db_path)
+    conn = connect(db_path)
+    upsert = (
+        "INSERT INTO TWEETS_ROLLUP VALUES (?, 'pablo_casado', 0, ?, ?, ?) "
+        "ON CONFLICT (MINUTE_TS, TARGET, IS_RT) DO UPDATE SET "
+        "RESPONSES = RESPONSES + excluded.RESPONSES, "
+        "POSITIVE = POSITIVE + excluded.POSITIVE, SCORED = SCORED + excluded.SCORED"
+    )
+    day = 1595160000 // 86400
+    with conn:
+        add_partitions(conn, [day])
+        conn.execute(upsert, (1595160000, 2, 0, 0))
+        conn.execute(upsert, (1595160060, 1, 1, 1))
+        conn.execute(upsert, (1595163600, 1, 0, 1))
+        # Scoring updates the rollup of tweets already counted
+        conn.execute(upsert, (1595160000, 0, 2, 2))
+    assert conn.execute("SELECT * FROM TWEETS_HOURLY").fetchall() == [
+        (1595160000, "pablo_casado", 0, 3, 3, 3),
+        (1595163600, "pablo_casado", 0, 1, 0, 1),
+    ]
+    assert conn.execute("SELECT * FROM TWEETS_DAILY").fetchall() == [
+        (day * 86400, "pablo_casado", 0, 4, 3, 4)
+    ]
+
+    with conn:
+        drop_expired_partitions(conn, 2, now=(day + 3) * 86400)
+        assert prune_series(conn, now=1595160000 + 31 * 86400 + 1) == 1
+    assert conn.execute("SELECT COUNT(*) FROM TWEETS_ROLLUP").fetchone()[0] == 0
+    assert conn.execute("SELECT BUCKET_TS FROM TWEETS_HOURLY").fetchall() == [
+        (1595163600,)
+    ]
+    assert conn.execute("SELECT COUNT(*) FROM TWEETS_DAILY").fetchone()[0] == 1
+
+
+def test_series_step_keeps_the_number_of_buckets_fixed():
+    """Check if longer windows use coarser buckets instead of more of them"""
+    assert series_step(7 * 86400, 84) == ("TWEETS_HOURLY", 7200)
+    assert series_step(30 * 86400, 84) == ("TWEETS_HOURLY", 32400)
+    assert series_step(365 * 86400, 84) == ("TWEETS_DAILY", 5 * 86400)